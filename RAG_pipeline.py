@@ -1,234 +1,1406 @@
-from utilities.generate_embeddings.generate_db import get_vector_store
+from utilities.generate_embeddings.generate_db import get_embeddings, similarity_search_by_vectors, search_tables, configure_backend, EMBEDDING_MODEL, TABLES_COLLECTION
+from utilities.generate_embeddings.embedding_cache import EmbeddingCache, CachedEmbeddings
+from utilities.generate_embeddings.lexical_index import DEFAULT_THRESHOLD as LEXICAL_THRESHOLD, LexicalRouter, load_router
+from utilities.answer_cache import SemanticAnswerCache
+from utilities.stage_cache import StageCache
+from utilities.sql_stream import SQLStreamExtractor, extract_sql_statements
+from utilities.sql_executor import SQLExecutor, load_db_config
+from utilities.speculation import SpeculationPlan, SpeculativeScheduler
+from utilities.model_router import ModelRouter
+from utilities.schema_bundles import SchemaBundle, SchemaRegistry
+from utilities.tracing import tracer
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_groq import ChatGroq
-from groq import Groq
-from model import table_result, Knowledge_Graph, RelevantColumnsOutput
-from utilities.prompts import prompt_lvl1 , seed_table_extraction_prompt, column_extraction_prompt, col_filter_prompt , query_generation_prompt
+from model import table_result, Knowledge_Graph, RelevantColumnsOutput, PipelineResult, ExecutionResult
+from model import (PipelineEvent, ChunksEvent, BroadTablesEvent, SeedTablesEvent, JoinPathsEvent, TableColumnsEvent,
+                   FilteredColumnsEvent, SQLTokenEvent, SQLStatementEvent, SQLRepairEvent, ResultEvent)
+from utilities.prompts import prompt_lvl1 , seed_table_extraction_prompt, column_extraction_prompt, col_filter_prompt , query_generation_prompt, query_repair_prompt
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+import argparse
+import asyncio
+import contextvars
 import os
+import time
+
+if TYPE_CHECKING:
+    from utilities.sql_validator import SQLValidator  # sqlglot is only imported with --validate
 
 load_dotenv()
 
-# ------------------------------------------RELEVANT CHUNKS---------------------------------------------
-
-# Load the existing vector store (already contains embedded documents)
-vector_store_lvl1 = get_vector_store("overview", "db/overview_db")
-
-# Create a retriever
-retriever = vector_store_lvl1.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 10})
-
-# Run a test query
-query = input(str("what is your query? \n"))
-results = retriever.invoke(query)
-
-# -----------------------------------EXTRACTION OF POSSIBLE TABLES-----------------------------------------
-
-# Provide structured output for the table names for the levels ahead.
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
-model2 = ChatGroq(model = "llama-3.3-70b-versatile")
-llm = model.with_structured_output(table_result)
-
-# prompt for level1 RAG
-prompt_lvl1 = prompt_lvl1
-
-# Create the final prompt for Level 1 RAG
-final_prompt_lvl1 = ChatPromptTemplate.from_messages(
-    [
-        ("system", prompt_lvl1),
-        ("human", "{context}"),
-        ("human", "{question}"),
-    ]
-)
-# Create the chain for Level 1 RAG
-chain = final_prompt_lvl1 | llm
-
-# Invoke the chain with the context and query
-results_lvl1 = chain.invoke({
-    "context": "\n\n".join(doc.page_content for doc in results),
-    "question": query
-})
-
-
-#  Get the initial broad list of tables from Level 1
-initial_table_names_from_level1 = results_lvl1.table_names
-
-
-# -------------------------------------EXTRACTION OF SEED TABLES--------------------------------------------
-#1 identify the seed table
-seed_prompt = seed_table_extraction_prompt
-
-# 2. Create the chain for seed table extraction
-seed_chain = ChatPromptTemplate.from_messages(
-    [
-        ("system", seed_prompt),
-        ("human", "Given list of broadly relevant tables:\n{broadly_relevant_tables}\n\nUser Query:\n{user_query}"),
-    ]
-) | llm
-
-# 3. Invoke the chain to get the seed tables
-extracted_seed_tables_pydantic = seed_chain.invoke({
-    "broadly_relevant_tables": ", ".join(initial_table_names_from_level1), # Pass as a comma-separated string
-    "user_query": query # Your original user query
-})
-
-#4 Extract the list of strings
-seed_tables = extracted_seed_tables_pydantic.table_names
-
-print("SEED TABLES:" , end = " ")
-for table in seed_tables:
-    print(table, end=", ")
-    
-print("\n")
-
-# -----------------------------KNOWLEDGE GRAPH FOR TABLES------------------------------------------------
-kg_file_path = "knowledge_graph.gml"
-table_KG  = Knowledge_Graph.load_graph(kg_file_path)
-
-complete_paths , path_list = table_KG.validate_path(seed_tables)
-print("\n")
-for path in path_list:
-    print(path)
-    
-print("\n")
-for path in complete_paths:
-    print(path)
-    
-print("\n")
-
-filtered_tables  = []
-required_colums = []
-
-for source , fk_key, target in path_list:
-    
-    if source not in filtered_tables:
-        filtered_tables.append(source)
-        
-    required_colums.append(f"{source} refers {target} via the foreign_key: {fk_key}")
-    
-    if target not in filtered_tables:
-        filtered_tables.append(target)
-
-# -------------------------------LEVEL-2 RAG: EXTRACTION OF COLUMNS-----------------------------------------
-
-def get_table_context(table_name:str , query:str) -> str:
-    temp_vector_store = get_vector_store(table_name , "db/table_db")
-    temp_retriever = temp_vector_store.as_retriever(
-        search_type = "similarity",
-        search_kwargs = {"k":7}
-    )
-    
-    results = temp_retriever.invoke(query)
-    result_doc = "\n\n".join(doc.page_content for doc in results)
-    
-    return result_doc
-
-def get_chain(user_query:str):
-    col_extract_prompt = column_extraction_prompt
-    col_extract_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", column_extraction_prompt),
-            ("human", "USER QUERY: {user_query}\n\nRELEVANT DOCUMENT:\n{relevant_chunks}")
-        ]
-    )
-    col_extraction_chain = col_extract_prompt | model.with_structured_output(RelevantColumnsOutput)
-    return col_extraction_chain
-
-def get_results(curr_table: str, query: str):
-    col_chain = get_chain(query)
-    relevant_docs = get_table_context(curr_table, query)
-    # print(relevant_docs)
-
-    try:
-        col_results = col_chain.invoke({
-            "relevant_chunks": relevant_docs,
+# Stages answering with a structured output (the query generation answers with text)
+STRUCTURED_STAGES = ("lvl1", "seed", "columns", "filter")
+
+QUERY_INPUTS_TEMPLATE = "USER QUERY:\n {user_query} \n\nRELEVANT TABLES:\n{tables} \n\nTABLE RELATIONSHIPS:\n{relationships} \n\nRELEVANT COLUMNS (with reasons):\n{columns}"
+
+
+class NLToSQLPipeline:
+    def __init__(self, kg_file_path: str = "knowledge_graph.gml", overview_db_path: str = "db/overview_db",
+                 table_db_path: str = "db/table_db", overview_k: int = 10, table_k: int = 7, verbose: bool = True,
+                 max_concurrency: int = 1, table_timeout: Optional[float] = None,
+                 embedding_cache_path: str = "db/embedding_cache.sqlite", embedding_cache_size: int = 10000,
+                 answer_cache: Optional[SemanticAnswerCache] = None, stage_cache: Optional[StageCache] = None,
+                 table_layout: str = "per_table", lexical_router: Optional[LexicalRouter] = None,
+                 chat_model=None, query_model=None, embeddings=None, executor: Optional[SQLExecutor] = None,
+                 validator: Optional["SQLValidator"] = None, max_repairs: int = 2, speculation: Optional[str] = None,
+                 speculation_workers: int = 8, model_router: Optional[ModelRouter] = None, database: str = "bike_store",
+                 schemas: Optional[SchemaRegistry] = None):
+        """
+        Builds everything the pipeline needs once, so that a long-lived process only pays
+        the setup cost a single time and can then answer any number of questions.
+
+        The database-specific parts (knowledge graph, vector stores, executor, validator, lexical
+        router, answer cache) form a schema bundle. Without a registry, the arguments below make
+        the single bundle; with one, each question names its database (see SchemaRegistry).
+
+        Args:
+            kg_file_path (str): Path to the knowledge graph of the database schema.
+            overview_db_path (str): Persist directory of the overview vector store.
+            table_db_path (str): Persist directory of the per-table vector stores.
+            overview_k (int): Number of overview chunks retrieved for Level 1.
+            table_k (int): Number of chunks retrieved per table for Level 2.
+            verbose (bool): Print the output of every stage.
+            max_concurrency (int): Number of tables processed in parallel in Level 2. 1 keeps the sequential loop.
+            table_timeout (float, optional): Seconds allowed for a single table in concurrent Level 2.
+            embedding_cache_path (str): sqlite file caching the question embeddings across runs.
+            embedding_cache_size (int): Maximum number of cached question embeddings.
+            answer_cache (SemanticAnswerCache, optional): Cache of whole results, matched by question similarity.
+            stage_cache (StageCache, optional): Memoization of the structured LLM stages.
+            table_layout (str): "per_table" (one collection per table) or "single" (one collection
+                for every table, filtered on the 'table' metadata).
+            lexical_router (LexicalRouter, optional): Lexical fast path proposing the broad and seed
+                tables without the Level 1 and seed LLM calls when it is confident enough.
+            chat_model (BaseChatModel, optional): Model of the structured stages (default: gpt-4o-mini).
+            query_model (BaseChatModel, optional): Model generating the SQL (default: qwen-qwq-32b on Groq).
+            embeddings (Embeddings, optional): Embeddings client of the questions (default: get_embeddings()).
+            executor (SQLExecutor, optional): Runs the generated statements on the database (pooled,
+                read-only, with a statement timeout and a row cap). None stops at the SQL.
+            validator (SQLValidator, optional): Checks the generated SQL against the knowledge graph and
+                the column catalog; on errors only the query generation is re-run, with the errors.
+            max_repairs (int): Maximum number of query generation re-runs per question.
+            speculation (str, optional): Work started on the Level 1 tables while the seed extraction and
+                the join planning are still running (run only). "retrieval" fetches the docs of the Level 1
+                tables and of their KG neighbours; "columns" also runs Level 2 on the Level 1 tables.
+                Results of the tables the join plan rules out are discarded. None disables it.
+            speculation_workers (int): Speculative tasks running at once, across all questions.
+            model_router (ModelRouter, optional): Routes every stage over several providers, with
+                latency budgets, hedged requests and circuit breakers. Replaces chat_model and query_model.
+            database (str): Name of the database of the single bundle, given to the query prompt.
+            schemas (SchemaRegistry, optional): The databases the questions can be answered on, loaded on
+                first use and unloaded past a memory budget. Replaces kg_file_path, overview_db_path,
+                table_db_path, executor, validator, lexical_router, answer_cache and database.
+        """
+        self.overview_k = overview_k
+        self.table_k = table_k
+        self.verbose = verbose
+        self.max_concurrency = max(1, max_concurrency)
+        self.table_timeout = table_timeout
+        self.stage_cache = stage_cache
+        self.table_layout = table_layout
+        self.max_repairs = max_repairs
+        if speculation not in (None, "retrieval", "columns"):
+            raise ValueError(f"Unknown speculation mode: {speculation} (expected 'retrieval' or 'columns')")
+        self.speculation = speculation
+        self.speculator = SpeculativeScheduler(speculation_workers) if speculation else None
+
+        # The clients are built on first use (see the properties below), so that starting the
+        # process, or running it with other models or a numpy index, never pays for them
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_cache_size = embedding_cache_size
+        self.model_router = model_router
+        self._embeddings = embeddings
+        self._chat_model = chat_model
+        self._query_model = query_model
+
+        # -----------------------------SCHEMA BUNDLES------------------------------------------------
+        # The knowledge graph and the stores of a database are loaded by its first question
+        if schemas is None:
+            schemas = SchemaRegistry([SchemaBundle(
+                database, kg_file_path=kg_file_path, overview_db_path=overview_db_path, table_db_path=table_db_path,
+                components={"executor": executor, "validator": validator, "lexical_router": lexical_router,
+                            "answer_cache": answer_cache}
+            )])
+        self.schemas = schemas
+
+    @property
+    def schema(self) -> SchemaBundle:
+        """The bundle of the database the current question is answered on."""
+        return self.schemas.current()
+
+    @property
+    def table_KG(self) -> Knowledge_Graph:
+        return self.schema.table_KG
+
+    @property
+    def executor(self) -> Optional[SQLExecutor]:
+        return self.schema.executor
+
+    @property
+    def validator(self) -> Optional["SQLValidator"]:
+        return self.schema.validator
+
+    @property
+    def lexical_router(self) -> Optional[LexicalRouter]:
+        return self.schema.lexical_router
+
+    @property
+    def answer_cache(self) -> Optional[SemanticAnswerCache]:
+        return self.schema.answer_cache
+
+    # ------------------------------------------RELEVANT CHUNKS---------------------------------------------
+
+    @cached_property
+    def embeddings(self) -> CachedEmbeddings:
+        """The question embeddings, through the embedding cache. The question is embedded once per
+        run and the vector is searched in every collection."""
+        embeddings = self._embeddings or get_embeddings()
+        return CachedEmbeddings(
+            embeddings, EmbeddingCache(self.embedding_cache_path, max_entries=self.embedding_cache_size),
+            getattr(embeddings, "model", EMBEDDING_MODEL)
+        )
+
+    async def aembed_query(self, query: str) -> List[float]:
+        """Async embedding of the question. The first use of the embeddings opens the embedding
+        cache and builds the client, which happens in a worker thread."""
+        embeddings = await asyncio.to_thread(lambda: self.embeddings)
+        return await embeddings.aembed_query(query)
+
+    @property
+    def overview_store(self):
+        """The existing vector store of the overview (already contains embedded documents)."""
+        return self.schema.overview_store
+
+    # ------------------------------------------MODELS------------------------------------------------------
+
+    @cached_property
+    def model(self):
+        """Model of the structured stages (the Level 1 one when routed)."""
+        if self.model_router is not None:
+            return self.stage_models["lvl1"]
+        if self._chat_model is not None:
+            return self._chat_model
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
+
+    @cached_property
+    def query_model(self):
+        """Model generating the SQL."""
+        if self.model_router is not None:
+            return self.model_router.stage("query")
+        if self._query_model is not None:
+            return self._query_model
+        from langchain_groq import ChatGroq
+        return ChatGroq(model = "qwen-qwq-32b")
+
+    @cached_property
+    def stage_models(self) -> Dict[str, Any]:
+        """Model of every structured stage. With a model router, every stage gets its own routed
+        model (budget, hedging, fallback)."""
+        if self.model_router is not None:
+            return {stage: self.model_router.stage(stage) for stage in STRUCTURED_STAGES}
+        return {stage: self.model for stage in STRUCTURED_STAGES}
+
+    # ------------------------------------------CHAINS------------------------------------------------------
+    # Provide structured output for the table names / columns for the levels ahead.
+
+    @cached_property
+    def lvl1_chain(self):
+        """Level 1 RAG."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", prompt_lvl1),
+                ("human", "{context}"),
+                ("human", "{question}"),
+            ]
+        ) | self.stage_models["lvl1"].with_structured_output(table_result)
+
+    @cached_property
+    def seed_chain(self):
+        """Seed table extraction."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", seed_table_extraction_prompt),
+                ("human", "Given list of broadly relevant tables:\n{broadly_relevant_tables}\n\nUser Query:\n{user_query}"),
+            ]
+        ) | self.stage_models["seed"].with_structured_output(table_result)
+
+    @cached_property
+    def col_chain(self):
+        """Level 2 RAG (shared by every table)."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system", column_extraction_prompt),
+                ("human", "USER QUERY: {user_query}\n\nRELEVANT DOCUMENT:\n{relevant_chunks}")
+            ]
+        ) | self.stage_models["columns"].with_structured_output(RelevantColumnsOutput)
+
+    @cached_property
+    def filter_chain(self):
+        """Column filtering."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system" , col_filter_prompt),
+                ("human" , "Please now provide the final list of truly relevant columns for this query.")
+            ]
+        ) | self.stage_models["filter"].with_structured_output(RelevantColumnsOutput)
+
+    @cached_property
+    def final_query_chain(self):
+        """Query generation."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system" , query_generation_prompt),
+                ("human" , QUERY_INPUTS_TEMPLATE)
+            ]
+        ) | self.query_model
+
+    @cached_property
+    def repair_chain(self):
+        """Query repair: the same conversation, followed by the previous query and its validation errors."""
+        return ChatPromptTemplate.from_messages(
+            [
+                ("system" , query_generation_prompt),
+                ("human" , QUERY_INPUTS_TEMPLATE),
+                ("ai" , "{previous_query}"),
+                ("human" , query_repair_prompt)
+            ]
+        ) | self.query_model
+
+    def _log(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+    def _stage_key(self, stage: str, chain, schema, inputs: dict) -> str:
+        # chain.first is the prompt template, rendered exactly as the model will see it
+        rendered_prompt = chain.first.format_prompt(**inputs).to_string()
+        model = self.stage_models[stage]
+        return StageCache.make_key(model.model_name, model.temperature, rendered_prompt, schema, namespace=self.schema.name)
+
+    def _invoke_stage(self, stage: str, chain, schema, inputs: dict):
+        """Invoke a structured chain (in a tracing span), through the stage cache if there is one."""
+        with tracer.span(stage) as span:
+            if self.stage_cache is None:
+                return chain.invoke(inputs, config=tracer.config())
+
+            key = self._stage_key(stage, chain, schema, inputs)
+            result = self.stage_cache.get(stage, key, schema)
+            span.cache(result is not None)
+            if result is None:
+                result = chain.invoke(inputs, config=tracer.config())
+                self.stage_cache.put(stage, key, result)
+            return result
+
+    async def _ainvoke_stage(self, stage: str, chain, schema, inputs: dict):
+        """Async version of _invoke_stage."""
+        with tracer.span(stage) as span:
+            if self.stage_cache is None:
+                return await chain.ainvoke(inputs, config=tracer.config())
+
+            key = self._stage_key(stage, chain, schema, inputs)
+            result = await asyncio.to_thread(self.stage_cache.get, stage, key, schema)
+            span.cache(result is not None)
+            if result is None:
+                result = await chain.ainvoke(inputs, config=tracer.config())
+                await asyncio.to_thread(self.stage_cache.put, stage, key, result)
+            return result
+
+    def _batch_stage(self, stage: str, chain, schema, inputs_list: List[dict], max_concurrency: int) -> list:
+        """
+        Send a whole stage through chain.batch(), skipping the inputs already in the stage cache.
+        A failed input gets its exception in place of the result.
+        """
+        with tracer.span(stage, batch_size=len(inputs_list)) as span:
+            results = [None] * len(inputs_list)
+            keys = [None] * len(inputs_list)
+            pending = list(range(len(inputs_list)))
+
+            if self.stage_cache is not None and schema is not None:
+                pending = []
+                for i, inputs in enumerate(inputs_list):
+                    keys[i] = self._stage_key(stage, chain, schema, inputs)
+                    results[i] = self.stage_cache.get(stage, keys[i], schema)
+                    span.cache(results[i] is not None)
+                    if results[i] is None:
+                        pending.append(i)
+
+            if pending:
+                outputs = chain.batch([inputs_list[i] for i in pending], config=tracer.config({"max_concurrency": max_concurrency}),
+                                      return_exceptions=True)
+                for i, output in zip(pending, outputs):
+                    results[i] = output
+                    if keys[i] is not None and not isinstance(output, Exception):
+                        self.stage_cache.put(stage, keys[i], output)
+
+            return results
+
+    # -----------------------------------EXTRACTION OF POSSIBLE TABLES-----------------------------------------
+
+    def embed_query(self, query: str) -> List[float]:
+        """Embed the question once; the vector is reused for every collection."""
+        with tracer.span("embed_query"):
+            return self.embeddings.embed_query(query)
+
+    def retrieve_overview(self, query: str, query_vector: Optional[List[float]] = None) -> list:
+        """Retrieve the overview chunks relevant to the query."""
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+        with tracer.span("overview_retrieval"):
+            return self.overview_store.similarity_search_by_vector(query_vector, k=self.overview_k)
+
+    def extract_tables(self, query: str, docs: list) -> List[str]:
+        """Level 1: the broad list of tables that could be needed for the query."""
+        results_lvl1 = self._invoke_stage("lvl1", self.lvl1_chain, table_result, {
+            "context": "\n\n".join(doc.page_content for doc in docs),
+            "question": query
+        })
+        return results_lvl1.table_names
+
+    # -------------------------------------EXTRACTION OF SEED TABLES--------------------------------------------
+
+    def extract_seed_tables(self, query: str, broad_tables: List[str]) -> List[str]:
+        """The most crucial tables, picked out of the broad Level 1 list."""
+        extracted_seed_tables_pydantic = self._invoke_stage("seed", self.seed_chain, table_result, {
+            "broadly_relevant_tables": ", ".join(broad_tables), # Pass as a comma-separated string
             "user_query": query
         })
-        return col_results
-
-    except Exception as e:
-        print(f"[ERROR] Model failed for table: {curr_table}\n{e}")
-        return RelevantColumnsOutput(relevant_columns=[])
-
-
-# print(get_table_context("products" , query))
-
-reasons = dict()
-tables = []
-
-for table in filtered_tables:
-    print(f"Processing table {table}")
-    results = get_results(table , query)    
-    relevant_cols = results.relevant_columns
-    
-    if len(relevant_cols)  > 0:
-        tables.append(table)
-        
-        
-    
-    for col in relevant_cols:
-        if col.column_name is not None and col.column_name not in reasons:
-            key_1 = f"{col.table_name}.{col.column_name} ({col.data_type})"
-            reasons[key_1] = col.reason
-
-
-print("\nTABLES REQUIRED:")
-for table in tables:
-    print(table)
-
-col_docs  = []
-print("\nCOLUMNS REQUIRED")
-for key,value in reasons.items():
-    print(f"{key} -->{value}")
-    col_docs.append(f"{key} -->{value}")
-
-
-
-filter_chain = ChatPromptTemplate.from_messages(
-    [
-        ("system" , col_filter_prompt),
-        ("human" , "Please now provide the final list of truly relevant columns for this query.")
-    ]
-) | model.with_structured_output(RelevantColumnsOutput)
-
-filter_results = filter_chain.invoke(
-    {
-        "user_query" : query,
-        "relevant_columns" : "\n".join(col_doc for col_doc in col_docs)
-    }
-)
-
-final_cols = []
-print("\nRELEVANT COLUMNS")
-for rel_col in filter_results.relevant_columns:
-    final_cols.append(f"{rel_col.table_name}.{rel_col.column_name} ({rel_col.data_type}) -> {rel_col.reason}")
-    print(f"{rel_col.table_name}.{rel_col.column_name} ({rel_col.data_type}) -> {rel_col.reason}")
-        
-        
-# ------------------------------------- QUERY GENERATION---------------------------------------------
-
-model3 = ChatGroq(model = "qwen-qwq-32b")
-col_relationships = required_colums
-final_query_chain = ChatPromptTemplate.from_messages(
-    [
-        ("system" , query_generation_prompt),
-        ("human" , "USER QUERY:\n {user_query} \n\nRELEVANT TABLES:\n{tables} \n\nTABLE RELATIONSHIPS:\n{relationships} \n\nRELEVANT COLUMNS (with reasons):\n{columns}")
-    ]
-) | model3
-
-final_query = final_query_chain.invoke(
-    {
-        "user_query":query,
-        "tables" : " ".join(table for table in tables),
-        "relationships" : " \n".join(rel for rel in col_relationships),
-        "columns" : " \n".join(col for col in final_cols)
-    }
-)
-
-print(final_query.content)
+        return extracted_seed_tables_pydantic.table_names
+
+    def select_tables(self, query: str, query_vector: Optional[List[float]] = None,
+                      plan: Optional[SpeculationPlan] = None) -> Tuple[List[str], List[str], bool]:
+        """
+        The broad and seed tables of the query. When the lexical router is confident, its proposal
+        is used and the Level 1 and seed LLM calls are skipped (unless the question is audited);
+        otherwise the LLM calls run and their answer is compared with the proposal. With a
+        speculation plan, the Level 2 work of the broad tables starts before the seed extraction.
+
+        Returns:
+            Tuple: (broad tables, seed tables, whether the lexical fast path was used)
+        """
+        proposal = None
+        if self.lexical_router is not None:
+            proposal = self.lexical_router.route(query, self.table_KG.graph)
+
+            if proposal["fire"]:
+                self._log(f"Lexical fast path (confidence {proposal['confidence']:.2f})")
+                if proposal["audit"]:
+                    self._audit_fast_path(query, query_vector, proposal)
+                return proposal["broad_tables"], proposal["seed_tables"], True
+
+        docs = self.retrieve_overview(query, query_vector)
+        broad_tables = self.extract_tables(query, docs)
+        if plan is not None:
+            self.speculate(plan, query, query_vector, broad_tables)
+        seed_tables = self.extract_seed_tables(query, broad_tables)
+
+        if proposal is not None:
+            self.lexical_router.record(proposal, seed_tables)
+        return broad_tables, seed_tables, False
+
+    def _audit_fast_path(self, query: str, query_vector: Optional[List[float]], proposal: dict):
+        """Run the LLM stages for a fast-path question, only to compare their seed tables with the proposal."""
+        try:
+            llm_broad_tables = self.extract_tables(query, self.retrieve_overview(query, query_vector))
+            self.lexical_router.record(proposal, self.extract_seed_tables(query, llm_broad_tables))
+        except Exception as e:
+            print(f"[ERROR] Audit of the lexical fast path failed\n{e}")
+
+    # -----------------------------KNOWLEDGE GRAPH FOR TABLES------------------------------------------------
+
+    def plan_joins(self, seed_tables: List[str]) -> Tuple[list, List[str], List[str]]:
+        """
+        Validates the join paths between the seed tables.
+
+        Returns:
+            Tuple: (complete paths, tables needed for the joins, FK relationship descriptions)
+        """
+        with tracer.span("kg_validation", seed_tables=seed_tables):
+            complete_paths , path_list = self.table_KG.validate_path(seed_tables)
+
+        filtered_tables  = []
+        required_colums = []
+
+        for source , fk_key, target in path_list:
+
+            if source not in filtered_tables:
+                filtered_tables.append(source)
+
+            required_colums.append(f"{source} refers {target} via the foreign_key: {fk_key}")
+
+            if target not in filtered_tables:
+                filtered_tables.append(target)
+
+        # A single seed table (or an unconnected one) has no join, but is still needed
+        for table in seed_tables:
+            if table not in filtered_tables and table in self.table_KG.graph:
+                filtered_tables.append(table)
+
+        return complete_paths, filtered_tables, required_colums
+
+    # -------------------------------LEVEL-2 RAG: EXTRACTION OF COLUMNS-----------------------------------------
+
+    def get_table_context(self, table_name: str, query: str, query_vector: Optional[List[float]] = None) -> str:
+        """Retrieve the chunks of a table's documentation relevant to the query."""
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+        if self.table_layout == "single":
+            return self.get_tables_context([table_name], query_vector)[table_name]
+        with tracer.span("table_retrieval", table=table_name):
+            results = self.schema.store(table_name).similarity_search_by_vector(query_vector, k=self.table_k)
+        return "\n\n".join(doc.page_content for doc in results)
+
+    async def aget_table_context(self, table_name: str, query: str, query_vector: Optional[List[float]] = None) -> str:
+        """Async version of get_table_context."""
+        if query_vector is None:
+            query_vector = await self.aembed_query(query)
+        if self.table_layout == "single":
+            return (await asyncio.to_thread(self.get_tables_context, [table_name], query_vector))[table_name]
+        with tracer.span("table_retrieval", table=table_name):
+            store = await asyncio.to_thread(self.schema.store, table_name)
+            results = await store.asimilarity_search_by_vector(query_vector, k=self.table_k)
+        return "\n\n".join(doc.page_content for doc in results)
+
+    def get_tables_context(self, tables: List[str], query_vector: List[float]) -> Dict[str, str]:
+        """
+        Retrieve the chunks of several tables at once. In the single-collection layout this is one
+        filtered search; in the per-table layout, one search per table.
+        """
+        if self.table_layout == "single":
+            with tracer.span("table_retrieval", tables=tables):
+                found = search_tables(self.schema.store(TABLES_COLLECTION), query_vector, tables, self.table_k)
+            return {table: "\n\n".join(doc.page_content for doc in found[table]) for table in tables}
+
+        return {table: self.get_table_context(table, "", query_vector) for table in tables}
+
+    def get_results(self, curr_table: str, query: str, query_vector: Optional[List[float]] = None,
+                    relevant_docs: Optional[str] = None) -> RelevantColumnsOutput:
+        """Extract the relevant columns of a single table (relevant_docs is retrieved if not given)."""
+        with tracer.span("table", table=curr_table):
+            if relevant_docs is None:
+                relevant_docs = self.get_table_context(curr_table, query, query_vector)
+
+            try:
+                return self._invoke_stage("columns", self.col_chain, RelevantColumnsOutput, {
+                    "relevant_chunks": relevant_docs,
+                    "user_query": query
+                })
+
+            except Exception as e:
+                print(f"[ERROR] Model failed for table: {curr_table}\n{e}")
+                return RelevantColumnsOutput(relevant_columns=[])
+
+    async def aget_results(self, curr_table: str, query: str, query_vector: Optional[List[float]] = None,
+                           relevant_docs: Optional[str] = None) -> RelevantColumnsOutput:
+        """Async version of get_results, bounded by the per-table timeout."""
+        async def _extract():
+            docs = relevant_docs
+            if docs is None:
+                docs = await self.aget_table_context(curr_table, query, query_vector)
+            return await self._ainvoke_stage("columns", self.col_chain, RelevantColumnsOutput, {
+                "relevant_chunks": docs,
+                "user_query": query
+            })
+
+        try:
+            with tracer.span("table", table=curr_table):
+                return await asyncio.wait_for(_extract(), timeout=self.table_timeout)
+
+        except asyncio.TimeoutError:
+            print(f"[ERROR] Timed out after {self.table_timeout}s for table: {curr_table}")
+            return RelevantColumnsOutput(relevant_columns=[])
+
+        except Exception as e:
+            print(f"[ERROR] Model failed for table: {curr_table}\n{e}")
+            return RelevantColumnsOutput(relevant_columns=[])
+
+    @staticmethod
+    def _merge_columns(filtered_tables: List[str], outputs: List[RelevantColumnsOutput]) -> Tuple[List[str], Dict[str, str]]:
+        """Merge the per-table outputs in the order of filtered_tables, so every mode gives the same result."""
+        reasons = dict()
+        tables = []
+
+        for table, output in zip(filtered_tables, outputs):
+            relevant_cols = output.relevant_columns
+
+            if len(relevant_cols)  > 0:
+                tables.append(table)
+
+            for col in relevant_cols:
+                if col.column_name is not None and col.column_name not in reasons:
+                    key_1 = f"{col.table_name}.{col.column_name} ({col.data_type})"
+                    reasons[key_1] = col.reason
+
+        return tables, reasons
+
+    def extract_columns(self, query: str, filtered_tables: List[str], query_vector: Optional[List[float]] = None,
+                        relevant_docs: Optional[Dict[str, str]] = None) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Runs Level 2 on every table needed for the joins. With max_concurrency > 1 the
+        tables are processed concurrently (see aextract_columns).
+
+        Args:
+            relevant_docs (Dict[str, str], optional): Already retrieved docs of some tables (the others are retrieved).
+
+        Returns:
+            Tuple: (tables with at least one relevant column, {"table.column (type)": reason})
+        """
+        return self._merge_columns(filtered_tables, self._column_outputs(query, filtered_tables, query_vector, relevant_docs))
+
+    async def aextract_columns(self, query: str, filtered_tables: List[str], query_vector: Optional[List[float]] = None,
+                               relevant_docs: Optional[Dict[str, str]] = None) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Runs Level 2 on all tables concurrently, at most max_concurrency at a time.
+        A table that fails or exceeds table_timeout contributes no columns.
+        """
+        return self._merge_columns(filtered_tables, await self._acolumn_outputs(query, filtered_tables, query_vector, relevant_docs))
+
+    def _column_outputs(self, query: str, tables: List[str], query_vector: Optional[List[float]],
+                        relevant_docs: Optional[Dict[str, str]]) -> List[RelevantColumnsOutput]:
+        """The Level 2 output of every table, in the order of tables."""
+        if self.max_concurrency > 1 and len(tables) > 1:
+            coroutine = self._acolumn_outputs(query, tables, query_vector, relevant_docs)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return asyncio.run(coroutine)
+            # Called from a coroutine (run() inside an event loop): asyncio.run needs a thread without a loop
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                return pool.submit(context.run, asyncio.run, coroutine).result()
+
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+
+        contexts = dict(relevant_docs or {})
+        missing = [table for table in tables if table not in contexts]
+        if self.table_layout == "single" and missing:
+            contexts.update(self.get_tables_context(missing, query_vector))
+
+        outputs = []
+        for table in tables:
+            self._log(f"Processing table {table}")
+            outputs.append(self.get_results(table , query, query_vector, contexts.get(table)))
+        return outputs
+
+    async def _acolumn_outputs(self, query: str, tables: List[str], query_vector: Optional[List[float]],
+                               relevant_docs: Optional[Dict[str, str]]) -> List[RelevantColumnsOutput]:
+        if query_vector is None:
+            query_vector = await self.aembed_query(query)
+
+        contexts = dict(relevant_docs or {})
+        missing = [table for table in tables if table not in contexts]
+        if self.table_layout == "single" and missing:
+            contexts.update(await asyncio.to_thread(self.get_tables_context, missing, query_vector))
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _bounded(table: str) -> RelevantColumnsOutput:
+            async with semaphore:
+                self._log(f"Processing table {table}")
+                return await self.aget_results(table, query, query_vector, contexts.get(table))
+
+        return list(await asyncio.gather(*(_bounded(table) for table in tables)))
+
+    # -------------------------------SPECULATIVE LEVEL 2-----------------------------------------
+
+    def speculate(self, plan: SpeculationPlan, query: str, query_vector: List[float], broad_tables: List[str]):
+        """
+        Start the Level 2 work the join plan is likely to need: the docs of the broad tables and of
+        their KG neighbours (the join plan may add a bridge table), and in "columns" mode the
+        column extraction of the broad tables themselves.
+        """
+        graph = self.table_KG.graph
+        broad_tables = [table for table in broad_tables if table in graph]
+        candidates = list(broad_tables)
+        for table in broad_tables:
+            for neighbour in sorted(set(graph.successors(table)) | set(graph.predecessors(table))):
+                if neighbour not in candidates:
+                    candidates.append(neighbour)
+
+        for table in candidates:
+            plan.start(f"retrieval:{table}", self.get_table_context, table, query, query_vector)
+        if self.speculation == "columns":
+            for table in broad_tables:
+                plan.start(f"columns:{table}", self.get_results, table, query, query_vector, after=[f"retrieval:{table}"])
+
+    def extract_columns_speculative(self, plan: SpeculationPlan, query: str, filtered_tables: List[str],
+                                    query_vector: List[float]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Level 2 reusing the speculative work: the columns of a table already extracted are claimed,
+        the other tables are extracted like in extract_columns (concurrently, up to max_concurrency),
+        from their speculatively retrieved docs when there are any. Everything started for a table
+        outside filtered_tables is discarded.
+        """
+        try:
+            speculated = [table for table in filtered_tables if plan.has(f"columns:{table}")]
+            remaining = [table for table in filtered_tables if table not in speculated]
+            relevant_docs = {table: plan.claim(f"retrieval:{table}") for table in remaining
+                             if plan.has(f"retrieval:{table}")}
+
+            outputs = dict(zip(remaining, self._column_outputs(query, remaining, query_vector, relevant_docs)))
+            # Claimed last: the speculative extractions kept running while the other tables were extracted
+            for table in speculated:
+                outputs[table] = plan.claim(f"columns:{table}")
+        finally:
+            plan.close()
+
+        return self._merge_columns(filtered_tables, [outputs[table] for table in filtered_tables])
+
+    def filter_columns(self, query: str, reasons: Dict[str, str]) -> List[str]:
+        """Keep only the columns that are truly relevant for the query."""
+        col_docs = [f"{key} -->{value}" for key, value in reasons.items()]
+
+        filter_results = self._invoke_stage("filter", self.filter_chain, RelevantColumnsOutput,
+            {
+                "user_query" : query,
+                "relevant_columns" : "\n".join(col_doc for col_doc in col_docs)
+            }
+        )
+
+        return self._format_columns(filter_results)
+
+    @staticmethod
+    def _format_columns(filter_results: RelevantColumnsOutput) -> List[str]:
+        return [f"{rel_col.table_name}.{rel_col.column_name} ({rel_col.data_type}) -> {rel_col.reason}"
+                for rel_col in filter_results.relevant_columns]
+
+    # ------------------------------------- QUERY GENERATION---------------------------------------------
+
+    def _query_inputs(self, query: str, tables: List[str], relationships: List[str], final_cols: List[str]) -> dict:
+        return {
+            "database": self.schema.name,
+            "user_query":query,
+            "tables" : " ".join(table for table in tables),
+            "relationships" : " \n".join(rel for rel in relationships),
+            "columns" : " \n".join(col for col in final_cols)
+        }
+
+    def generate_query(self, query: str, tables: List[str], relationships: List[str], final_cols: List[str]) -> str:
+        """Generate the SQL query from everything gathered so far."""
+        with tracer.span("query"):
+            final_query = self.final_query_chain.invoke(self._query_inputs(query, tables, relationships, final_cols),
+                                                        config=tracer.config())
+        return final_query.content
+
+    # -------------------------------------VALIDATION AND REPAIR---------------------------------------------
+
+    def validate_query(self, statements: List[str]) -> List[str]:
+        """Validation errors of the statements (none without a validator)."""
+        if self.validator is None:
+            return []
+        with tracer.span("validate") as span:
+            errors = self.validator.validate_all(statements)
+            span.set(errors=len(errors))
+        return errors
+
+    @staticmethod
+    def _repair_inputs(inputs: dict, statements: List[str], errors: List[str]) -> dict:
+        return {
+            **inputs,
+            "previous_query": "```sql\n" + "\n".join(statement.rstrip(";") + ";" for statement in statements) + "\n```",
+            "errors": "\n".join(f"- {error}" for error in errors),
+        }
+
+    def repair_query(self, inputs: dict, sql: str) -> Tuple[str, List[str], List[str], int]:
+        """
+        Validate the query model output and, while it has errors, re-run only the query generation
+        with the errors added to the conversation (at most max_repairs times).
+
+        Args:
+            inputs (dict): The query generation inputs (see _query_inputs).
+            sql (str): The first query model output.
+
+        Returns:
+            Tuple: (final output, its statements, its remaining errors, number of repairs)
+        """
+        statements = extract_sql_statements(sql)
+        errors = self.validate_query(statements)
+        repairs = 0
+        while errors and repairs < self.max_repairs:
+            repairs += 1
+            self._log(f"\nREPAIR {repairs}:\n" + "\n".join(errors))
+            with tracer.span("repair", attempt=repairs):
+                sql = self.repair_chain.invoke(self._repair_inputs(inputs, statements, errors), config=tracer.config()).content
+            statements = extract_sql_statements(sql)
+            errors = self.validate_query(statements)
+        return sql, statements, errors, repairs
+
+    # ------------------------------------- PIPELINE---------------------------------------------
+
+    def run(self, query: str, database: Optional[str] = None) -> PipelineResult:
+        """Runs every stage of the pipeline for a single question (one trace when profiling), on a database of the registry."""
+        with self.schemas.use(database) as schema, tracer.trace(query, database=schema.name) as root:
+            result = self._run(query)
+            self.execute(result)
+            root.set(from_cache=result.from_cache, fast_path=result.fast_path)
+        return result
+
+    def execute(self, result: PipelineResult) -> PipelineResult:
+        """
+        Run the statements of a result on the database (if the pipeline has an executor). The
+        execution is never cached with the answer, so a cached answer still returns current rows.
+        """
+        if self.executor is None or not result.statements:
+            return result
+        if result.validation_errors:
+            # The database would only reject it, so the round trip is saved
+            result.execution = [ExecutionResult(sql=statement, error="Not executed: the query failed validation")
+                                for statement in result.statements]
+        else:
+            result.execution = [ExecutionResult(**execution) for execution in self.executor.execute_all(result.statements)]
+        return result
+
+    def _lookup_answer(self, query_vector: List[float]) -> Optional[dict]:
+        with tracer.span("answer_cache") as span:
+            cached = self.answer_cache.lookup(query_vector)
+            span.cache(cached is not None)
+        return cached
+
+    def _run(self, query: str) -> PipelineResult:
+        query_vector = self.embed_query(query)
+
+        if self.answer_cache is not None:
+            cached = self._lookup_answer(query_vector)
+            if cached is not None:
+                self._log("Answer served from the cache.")
+                return PipelineResult(**{**cached, "question": query, "from_cache": True})
+
+        plan = self.speculator.plan() if self.speculator is not None else None
+        try:
+            broad_tables, seed_tables, fast_path = self.select_tables(query, query_vector, plan)
+            self._log("SEED TABLES: " + ", ".join(seed_tables) + "\n")
+
+            complete_paths, filtered_tables, relationships = self.plan_joins(seed_tables)
+        except BaseException:
+            if plan is not None:
+                plan.close()
+            raise
+        for rel in relationships:
+            self._log(rel)
+        for path in complete_paths:
+            self._log(path)
+        self._log()
+
+        if plan is not None:
+            tables, reasons = self.extract_columns_speculative(plan, query, filtered_tables, query_vector)
+        else:
+            tables, reasons = self.extract_columns(query, filtered_tables, query_vector)
+        self._log("\nTABLES REQUIRED:")
+        for table in tables:
+            self._log(table)
+
+        self._log("\nCOLUMNS REQUIRED")
+        for key, value in reasons.items():
+            self._log(f"{key} -->{value}")
+
+        final_cols = self.filter_columns(query, reasons)
+        self._log("\nRELEVANT COLUMNS")
+        for col in final_cols:
+            self._log(col)
+
+        sql = self.generate_query(query, tables, relationships, final_cols)
+        sql, statements, errors, repairs = self.repair_query(self._query_inputs(query, tables, relationships, final_cols), sql)
+
+        result = PipelineResult(
+            question=query,
+            broad_tables=broad_tables,
+            seed_tables=seed_tables,
+            join_paths=complete_paths,
+            relationships=relationships,
+            tables=tables,
+            columns=final_cols,
+            sql=sql,
+            fast_path=fast_path,
+            statements=statements,
+            validation_errors=errors,
+            repairs=repairs,
+            database=self.schema.name,
+        )
+
+        if self.answer_cache is not None:
+            self.answer_cache.store(query, query_vector, result.model_dump())
+
+        return result
+
+    async def astream(self, query: str, database: Optional[str] = None) -> AsyncIterator[PipelineEvent]:
+        """
+        Runs the pipeline for a single question as an async generator of events: retrieved chunks,
+        broad tables, seed tables, join paths, the columns of each table as soon as it is processed,
+        the filtered columns, then the query model output token by token (astream), every SQL
+        statement as soon as it is complete, and finally the PipelineResult.
+
+        Closing the generator early (e.g. breaking out of the loop) cancels the remaining stages.
+        """
+        with self.schemas.use(database) as schema, tracer.trace(query, streamed=True, database=schema.name):
+            async for event in self._astream(query):
+                if isinstance(event, ResultEvent):
+                    await asyncio.to_thread(self.execute, event.result)
+                yield event
+
+    async def _astream(self, query: str) -> AsyncIterator[PipelineEvent]:
+        # Everything that blocks (sqlite, the indexes, the first load of a bundle's components) runs
+        # in a worker thread, so the event loop keeps serving the other questions
+        with tracer.span("embed_query"):
+            query_vector = await self.aembed_query(query)
+
+        answer_cache = await asyncio.to_thread(lambda: self.answer_cache)
+        if answer_cache is not None:
+            cached = await asyncio.to_thread(self._lookup_answer, query_vector)
+            if cached is not None:
+                yield ResultEvent(result=PipelineResult(**{**cached, "question": query, "from_cache": True}))
+                return
+
+        proposal = None
+        lexical_router = await asyncio.to_thread(lambda: self.lexical_router)
+        if lexical_router is not None:
+            proposal = await asyncio.to_thread(lambda: lexical_router.route(query, self.table_KG.graph))
+
+        fast_path = proposal is not None and proposal["fire"]
+        if fast_path:
+            broad_tables, seed_tables = proposal["broad_tables"], proposal["seed_tables"]
+            yield BroadTablesEvent(tables=broad_tables)
+        else:
+            with tracer.span("overview_retrieval"):
+                overview_store = await asyncio.to_thread(lambda: self.overview_store)
+                docs = await overview_store.asimilarity_search_by_vector(query_vector, k=self.overview_k)
+            yield ChunksEvent(chunks=[doc.page_content for doc in docs])
+
+            broad_tables = (await self._ainvoke_stage("lvl1", self.lvl1_chain, table_result, {
+                "context": "\n\n".join(doc.page_content for doc in docs),
+                "question": query
+            })).table_names
+            yield BroadTablesEvent(tables=broad_tables)
+
+            seed_tables = (await self._ainvoke_stage("seed", self.seed_chain, table_result, {
+                "broadly_relevant_tables": ", ".join(broad_tables),
+                "user_query": query
+            })).table_names
+            if proposal is not None:
+                lexical_router.record(proposal, seed_tables)
+        yield SeedTablesEvent(tables=seed_tables, fast_path=fast_path)
+
+        complete_paths, filtered_tables, relationships = await asyncio.to_thread(self.plan_joins, seed_tables)
+        yield JoinPathsEvent(paths=complete_paths, relationships=relationships, tables=filtered_tables)
+
+        # Level 2: the tables run concurrently (at most max_concurrency) and are reported as they finish
+        contexts = {}
+        if self.table_layout == "single":
+            contexts = await asyncio.to_thread(self.get_tables_context, filtered_tables, query_vector)
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _bounded(table: str) -> Tuple[str, RelevantColumnsOutput]:
+            async with semaphore:
+                return table, await self.aget_results(table, query, query_vector, contexts.get(table))
+
+        outputs = {}
+        tasks = [asyncio.ensure_future(_bounded(table)) for table in filtered_tables]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                table, output = await next_done
+                outputs[table] = output
+                yield TableColumnsEvent(table=table, columns=output.relevant_columns)
+        finally:
+            for task in tasks:
+                task.cancel()
+        tables, reasons = self._merge_columns(filtered_tables, [outputs[table] for table in filtered_tables])
+
+        filter_results = await self._ainvoke_stage("filter", self.filter_chain, RelevantColumnsOutput, {
+            "user_query": query,
+            "relevant_columns": "\n".join(f"{key} -->{value}" for key, value in reasons.items())
+        })
+        final_cols = self._format_columns(filter_results)
+        yield FilteredColumnsEvent(columns=final_cols)
+
+        inputs = self._query_inputs(query, tables, relationships, final_cols)
+        chain, stage_inputs, stage = self.final_query_chain, inputs, "query"
+        repairs = 0
+        while True:
+            extractor = SQLStreamExtractor()
+            with tracer.span(stage, streamed=True):
+                async for chunk in chain.astream(stage_inputs, config=tracer.config()):
+                    if not chunk.content:
+                        continue
+                    yield SQLTokenEvent(text=chunk.content)
+                    for statement in extractor.feed(chunk.content):
+                        yield SQLStatementEvent(sql=statement)
+            for statement in extractor.finish():
+                yield SQLStatementEvent(sql=statement)
+
+            # An invalid query is streamed again by the repair stage, which replaces it
+            errors = await asyncio.to_thread(self.validate_query, extractor.statements)
+            if not errors or repairs >= self.max_repairs:
+                break
+            repairs += 1
+            yield SQLRepairEvent(attempt=repairs, errors=errors)
+            chain, stage_inputs, stage = self.repair_chain, self._repair_inputs(inputs, extractor.statements, errors), "repair"
+
+        result = PipelineResult(
+            question=query,
+            broad_tables=broad_tables,
+            seed_tables=seed_tables,
+            join_paths=complete_paths,
+            relationships=relationships,
+            tables=tables,
+            columns=final_cols,
+            sql=extractor.buffer,
+            fast_path=fast_path,
+            statements=extractor.statements,
+            validation_errors=errors,
+            repairs=repairs,
+            database=self.schema.name,
+        )
+        if answer_cache is not None:
+            await asyncio.to_thread(answer_cache.store, query, query_vector, result.model_dump())
+        yield ResultEvent(result=result)
+
+        # The audit does not change the result, so it runs once the result is out
+        if fast_path and proposal["audit"]:
+            await asyncio.to_thread(self._audit_fast_path, query, query_vector, proposal)
+
+    def run_many(self, queries: Iterable[str], database: Optional[str] = None) -> List[PipelineResult]:
+        """Runs the pipeline for several questions, reusing the same models, chains and stores."""
+        return [self.run(query, database) for query in queries]
+
+    def run_batch(self, queries: List[str], max_concurrency: Optional[int] = None,
+                  database: Optional[str] = None) -> List[Union[PipelineResult, Exception]]:
+        """
+        Runs many questions stage by stage instead of question by question: every LLM stage is
+        sent through chain.batch() and every retrieval stage makes one query per collection.
+
+        Args:
+            queries (List[str]): The questions.
+            max_concurrency (int, optional): Concurrent LLM calls per stage. Defaults to max_concurrency.
+            database (str, optional): Database of every question of the batch (default: the registry's default).
+
+        Returns:
+            List: One PipelineResult per question, or the exception that made the question fail.
+        """
+        # The stages are shared by the questions, so the whole batch is one trace
+        with self.schemas.use(database) as schema, tracer.trace(f"batch of {len(queries)} questions", batch_size=len(queries),
+                                                                database=schema.name):
+            results = self._run_batch(queries, max_concurrency or self.max_concurrency)
+
+            # The answers are executed concurrently, at most one query per pooled connection
+            if self.executor is not None:
+                answered = [result for result in results if isinstance(result, PipelineResult) and result.statements]
+                valid = [result for result in answered if not result.validation_errors]
+                executions = self.executor.execute_many([result.statements for result in valid])
+                for result, execution in zip(valid, executions):
+                    result.execution = [ExecutionResult(**statement) for statement in execution]
+                for result in answered:
+                    if result.validation_errors:
+                        self.execute(result)
+            return results
+
+    def _run_batch(self, queries: List[str], max_concurrency: int) -> List[Union[PipelineResult, Exception]]:
+        results: List[Union[PipelineResult, Exception, None]] = [None] * len(queries)
+        with tracer.span("embed_query", batch_size=len(queries)):
+            vectors = self.embeddings.embed_queries(queries)
+
+        if self.answer_cache is not None:
+            for i, query in enumerate(queries):
+                cached = self._lookup_answer(vectors[i])
+                if cached is not None:
+                    results[i] = PipelineResult(**{**cached, "question": query, "from_cache": True})
+
+        def _active():
+            return [i for i in range(len(queries)) if results[i] is None]
+
+        def _record(active, outputs, audit_only=()):
+            # Keep the successful outputs, turn the failed questions into their exception
+            # (a failed audit of the lexical fast path only loses the comparison)
+            kept = {}
+            for i, output in zip(active, outputs):
+                if isinstance(output, Exception):
+                    print(f"[ERROR] Question failed: {queries[i]}\n{output}")
+                    if i not in audit_only:
+                        results[i] = output
+                else:
+                    kept[i] = output
+            return kept
+
+        # Lexical fast path: the confident questions skip Level 1 and the seed stage (unless audited)
+        active = _active()
+        proposals = {}
+        if self.lexical_router is not None:
+            proposals = {i: self.lexical_router.route(queries[i], self.table_KG.graph) for i in active}
+        fast = {i for i, proposal in proposals.items() if proposal["fire"]}
+        llm_active = [i for i in active if i not in fast or proposals[i]["audit"]]
+
+        # Overview retrieval: one query for all the questions
+        with tracer.span("overview_retrieval", batch_size=len(llm_active)):
+            docs = dict(zip(llm_active, similarity_search_by_vectors(self.overview_store, [vectors[i] for i in llm_active], self.overview_k)))
+
+        # Level 1
+        outputs = self._batch_stage("lvl1", self.lvl1_chain, table_result, [
+            {"context": "\n\n".join(doc.page_content for doc in docs[i]), "question": queries[i]} for i in llm_active
+        ], max_concurrency)
+        broad_tables = {i: output.table_names for i, output in _record(llm_active, outputs, fast).items()}
+
+        # Seed tables
+        llm_active = [i for i in llm_active if i in broad_tables]
+        outputs = self._batch_stage("seed", self.seed_chain, table_result, [
+            {"broadly_relevant_tables": ", ".join(broad_tables[i]), "user_query": queries[i]} for i in llm_active
+        ], max_concurrency)
+        seed_tables = {i: output.table_names for i, output in _record(llm_active, outputs, fast).items()}
+
+        for i, proposal in proposals.items():
+            if i in seed_tables:
+                self.lexical_router.record(proposal, seed_tables[i])
+            if i in fast:
+                broad_tables[i] = proposal["broad_tables"]
+                seed_tables[i] = proposal["seed_tables"]
+
+        # Knowledge graph
+        active = _active()
+        plans = {i: self.plan_joins(seed_tables[i]) for i in active}
+
+        # Level 2: the retrieval is grouped per table collection (or per question in the
+        # single-collection layout), the extraction is one batch
+        pairs = [(i, table) for i in active for table in plans[i][1]]
+        contexts = {}
+        if self.table_layout == "single":
+            for i in active:
+                for table, context in self.get_tables_context(plans[i][1], vectors[i]).items():
+                    contexts[(i, table)] = context
+        for table in dict.fromkeys(table for _, table in pairs if self.table_layout != "single"):
+            group = [i for i, pair_table in pairs if pair_table == table]
+            with tracer.span("table_retrieval", table=table, batch_size=len(group)):
+                table_docs = similarity_search_by_vectors(self.schema.store(table),
+                                                          [vectors[i] for i in group], self.table_k)
+            for i, found in zip(group, table_docs):
+                contexts[(i, table)] = "\n\n".join(doc.page_content for doc in found)
+
+        outputs = self._batch_stage("columns", self.col_chain, RelevantColumnsOutput, [
+            {"relevant_chunks": contexts[pair], "user_query": queries[pair[0]]} for pair in pairs
+        ], max_concurrency)
+        column_outputs = {}
+        for (i, table), output in zip(pairs, outputs):
+            if isinstance(output, Exception):
+                print(f"[ERROR] Model failed for table: {table}\n{output}")
+                output = RelevantColumnsOutput(relevant_columns=[])
+            column_outputs[(i, table)] = output
+        merged = {i: self._merge_columns(plans[i][1], [column_outputs[(i, table)] for table in plans[i][1]]) for i in active}
+
+        # Column filtering
+        outputs = self._batch_stage("filter", self.filter_chain, RelevantColumnsOutput, [
+            {"user_query": queries[i], "relevant_columns": "\n".join(f"{key} -->{value}" for key, value in merged[i][1].items())}
+            for i in active
+        ], max_concurrency)
+        final_cols = {i: self._format_columns(output) for i, output in _record(active, outputs).items()}
+
+        # Query generation
+        active = _active()
+        inputs = {i: self._query_inputs(queries[i], merged[i][0], plans[i][2], final_cols[i]) for i in active}
+        outputs = self._batch_stage("query", self.final_query_chain, None, [inputs[i] for i in active], max_concurrency)
+        sqls = {i: output.content for i, output in _record(active, outputs).items()}
+
+        # Validation: only the invalid queries go through the repair stage again, as one batch per attempt
+        statements = {i: extract_sql_statements(sql) for i, sql in sqls.items()}
+        errors = {i: self.validate_query(statements[i]) for i in sqls}
+        repairs = dict.fromkeys(sqls, 0)
+        for _ in range(self.max_repairs):
+            invalid = [i for i in sqls if errors[i]]
+            if not invalid:
+                break
+            outputs = self._batch_stage("repair", self.repair_chain, None, [
+                self._repair_inputs(inputs[i], statements[i], errors[i]) for i in invalid
+            ], max_concurrency)
+            for i, output in zip(invalid, outputs):
+                repairs[i] += 1
+                if isinstance(output, Exception):
+                    print(f"[ERROR] Repair failed: {queries[i]}\n{output}")
+                    continue
+                sqls[i] = output.content
+                statements[i] = extract_sql_statements(output.content)
+                errors[i] = self.validate_query(statements[i])
+
+        for i, sql in sqls.items():
+            results[i] = PipelineResult(
+                question=queries[i],
+                broad_tables=broad_tables[i],
+                seed_tables=seed_tables[i],
+                join_paths=plans[i][0],
+                relationships=plans[i][2],
+                tables=merged[i][0],
+                columns=final_cols[i],
+                sql=sql,
+                fast_path=i in fast,
+                statements=statements[i],
+                validation_errors=errors[i],
+                repairs=repairs[i],
+                database=self.schema.name,
+            )
+            if self.answer_cache is not None:
+                self.answer_cache.store(queries[i], vectors[i], results[i].model_dump())
+
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert natural language questions to SQL.")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Tables processed in parallel in Level 2")
+    parser.add_argument("--table-timeout", type=float, default=None, help="Seconds allowed per table in Level 2")
+    parser.add_argument("--answer-cache", default=None, help="sqlite file of the semantic answer cache (disabled if omitted)")
+    parser.add_argument("--cache-threshold", type=float, default=0.92, help="Cosine similarity needed to reuse a cached answer")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Seconds after which a cached answer expires")
+    parser.add_argument("--stage-cache", default=None, help="sqlite file memoizing the structured LLM stages (disabled if omitted)")
+    parser.add_argument("--table-layout", choices=["per_table", "single"], default="per_table",
+                        help="Table docs in one collection per table, or in a single filtered collection")
+    parser.add_argument("--vector-backend", choices=["chroma", "numpy"], default=None,
+                        help="Retrieval backend (defaults to the VECTOR_BACKEND env var, else chroma)")
+    parser.add_argument("--numpy-index", default="db/numpy_index", help="Directory of the numpy vector index")
+    parser.add_argument("--lexical-index", default=None, help="JSON lexical index enabling the fast path (disabled if omitted)")
+    parser.add_argument("--lexical-threshold", type=float, default=LEXICAL_THRESHOLD, help="Confidence needed to skip the Level 1 and seed LLM calls")
+    parser.add_argument("--lexical-audit-rate", type=float, default=0.0, help="Share of fast-path questions also sent to the LLM to measure agreement")
+    parser.add_argument("--stream", action="store_true", help="Print every stage as it completes and the SQL as it is generated")
+    parser.add_argument("--speculate", choices=["retrieval", "columns"], default=None,
+                        help="Start the Level 2 work of the Level 1 tables while the seed extraction and join planning run")
+    add_profile_arguments(parser)
+    add_execution_arguments(parser)
+    add_validation_arguments(parser)
+    add_router_arguments(parser)
+    add_schema_arguments(parser)
+    args = parser.parse_args()
+    configure_profiling(args)
+    model_router = create_model_router(args)
+
+    # With --schemas, every database has its own executor, validator, lexical index and answer cache
+    schemas = create_schema_registry(args)
+    single = schemas is None
+    executor = create_executor(args) if single else None
+
+    if args.vector_backend:
+        configure_backend(args.vector_backend, args.numpy_index)
+
+    answer_cache = None
+    if args.answer_cache and single:
+        answer_cache = SemanticAnswerCache(args.answer_cache, threshold=args.cache_threshold, ttl=args.cache_ttl,
+                                           watch_paths=("knowledge_graph.gml", args.table_docs))
+
+    stage_cache = StageCache(args.stage_cache) if args.stage_cache else None
+
+    lexical_router = None
+    if args.lexical_index and single:
+        lexical_router = load_router(args.lexical_index, threshold=args.lexical_threshold, audit_rate=args.lexical_audit_rate)
+
+    pipeline = NLToSQLPipeline(max_concurrency=args.max_concurrency, table_timeout=args.table_timeout,
+                               answer_cache=answer_cache, stage_cache=stage_cache, table_layout=args.table_layout,
+                               lexical_router=lexical_router, executor=executor,
+                               validator=create_validator(args) if single else None, max_repairs=args.max_repairs,
+                               speculation=args.speculate, model_router=model_router, schemas=schemas)
+
+    while True:
+        try:
+            query = input(str("what is your query? \n"))
+        except EOFError:
+            break
+
+        if not query.strip():
+            break
+
+        if args.stream:
+            asyncio.run(print_stream(pipeline, query, args.database))
+        else:
+            result = pipeline.run(query, database=args.database)
+            print(result.sql)
+            for error in result.validation_errors:
+                print(f"[ERROR] {error}")
+            print_execution(result.execution)
+            if args.execute and args.export_dir:
+                export_results(pipeline.schemas.get(result.database).executor, result, args.export_dir)
+
+    if stage_cache is not None:
+        for stage, stats in stage_cache.stats().items():
+            print(f"{stage}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})")
+
+    if lexical_router is not None:
+        print_lexical_report(lexical_router.stats())
+
+    if pipeline.speculator is not None:
+        print_speculation_report(pipeline.speculator.stats())
+
+    if model_router is not None:
+        print_router_report(model_router.stats())
+        model_router.close()
+
+    if schemas is not None:
+        print_schema_report(schemas.stats())
+        schemas.close()
+
+    if executor is not None:
+        executor.close()
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile", action="store_true", help="Trace every stage (time, tokens, cost, retries, cache hits)")
+    parser.add_argument("--trace-dir", default="db/traces", help="Directory of the per-question JSON traces")
+    parser.add_argument("--metrics-file", default="db/metrics.prom", help="Prometheus text file of the aggregated stage metrics")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Also serve the metrics at http://0.0.0.0:<port>/metrics")
+
+
+def configure_profiling(args):
+    """Switch the tracing on from the --profile arguments."""
+    if not args.profile:
+        return
+    tracer.configure(enabled=True, trace_dir=args.trace_dir, metrics_path=args.metrics_file)
+    if args.metrics_port:
+        tracer.serve_prometheus(args.metrics_port)
+    print(f"Profiling: traces in {args.trace_dir}, metrics in {args.metrics_file}")
+
+
+def add_execution_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--execute", action="store_true", help="Run the generated SQL on the database (read-only)")
+    parser.add_argument("--db-config", default=None, help="JSON file of the database settings (see utilities/sql_executor.py)")
+    parser.add_argument("--db-backend", choices=["mysql", "sqlite"], default=None, help="Database backend (defaults to DB_BACKEND, else mysql)")
+    parser.add_argument("--db-path", default=None, help="SQLite database file of the sqlite backend")
+    parser.add_argument("--pool-size", type=int, default=None, help="Open database connections, i.e. queries run at once")
+    parser.add_argument("--statement-timeout", type=float, default=None, help="Seconds a query may run before it is interrupted")
+    parser.add_argument("--max-rows", type=int, default=None, help="Rows returned per query")
+    parser.add_argument("--export-dir", default=None, help="Also stream the full result of every statement into a Parquet file of this directory")
+
+
+def create_executor(args) -> Optional[SQLExecutor]:
+    """The SQL executor of the --execute arguments (settings: arguments, then env, then --db-config)."""
+    if not args.execute:
+        return None
+    config = load_db_config(args.db_config, backend=args.db_backend, path=args.db_path, pool_size=args.pool_size,
+                            statement_timeout=args.statement_timeout, max_rows=args.max_rows)
+    return SQLExecutor.from_config(config)
+
+
+def print_execution(execution: List[ExecutionResult], max_rows: int = 20):
+    """Print the rows returned by every executed statement."""
+    for statement in execution:
+        if statement.error:
+            print(f"[ERROR] {statement.error}")
+            continue
+        print(" | ".join(statement.columns))
+        for row in statement.rows[:max_rows]:
+            print(" | ".join(str(value) for value in row))
+        more = " (truncated)" if statement.truncated else ""
+        print(f"({statement.row_count} rows{more}, {statement.seconds * 1000:.0f} ms)")
+
+
+def add_validation_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--validate", action="store_true", help="Check the SQL against the knowledge graph and the column catalog, and repair it")
+    parser.add_argument("--max-repairs", type=int, default=2, help="Query generation re-runs allowed to fix validation errors")
+    parser.add_argument("--table-docs", default="docs/table_docs", help="Table docs the column catalog is read from")
+
+
+def create_validator(args, kg_file_path: str = "knowledge_graph.gml") -> Optional["SQLValidator"]:
+    """The SQL validator of the --validate arguments."""
+    if not args.validate:
+        return None
+    from utilities.sql_validator import SQLValidator
+    table_KG = Knowledge_Graph.load_graph(kg_file_path)
+    if table_KG is None:
+        raise ValueError(f"Could not load the knowledge graph from {kg_file_path}")
+    return SQLValidator.from_files(table_KG.graph, args.table_docs)
+
+
+def add_router_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--router-config", default=None,
+                        help="JSON file routing every stage over several providers (budgets, hedging, circuit breakers; see utilities/model_router.py)")
+
+
+def create_model_router(args) -> Optional[ModelRouter]:
+    """The model router of the --router-config argument."""
+    if not args.router_config:
+        return None
+    return ModelRouter.from_config(args.router_config)
+
+
+def print_router_report(stats: dict):
+    """Calls, hedges, fallbacks and wins per stage, and the state of every circuit."""
+    for stage, counters in sorted(stats["stages"].items()):
+        wins = ", ".join(f"{name.split(':', 1)[1]} {count}" for name, count in sorted(counters.items()) if name.startswith("wins:"))
+        print(f"{stage}: {counters.get('calls', 0)} calls, {counters.get('hedges', 0)} hedged, "
+              f"{counters.get('fallbacks', 0)} fallbacks, {counters.get('timeouts', 0)} timeouts, "
+              f"{counters.get('circuit_skips', 0)} circuit skips (won by {wins or 'none'})")
+    for name, circuit in stats["circuits"].items():
+        print(f"  {name}: circuit {circuit['state']}, opened {circuit['trips']} times")
+
+
+def add_schema_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--schemas", default=None,
+                        help="JSON file of the databases to answer on (schema bundles loaded on first use; see utilities/schema_bundles.py)")
+    parser.add_argument("--database", default=None, help="Database of the questions that do not name one (default: the default database of --schemas)")
+    parser.add_argument("--schema-memory-mb", type=float, default=None, help="Memory budget of the loaded schema bundles (overrides the config)")
+
+
+def create_schema_registry(args) -> Optional[SchemaRegistry]:
+    """The schema registry of the --schemas arguments; --validate, --execute and the execution settings apply to every database."""
+    if not args.schemas:
+        return None
+    db_overrides = {"pool_size": args.pool_size, "statement_timeout": args.statement_timeout, "max_rows": args.max_rows}
+    schemas = SchemaRegistry.from_config(args.schemas, validate=args.validate, execute=args.execute, db_overrides=db_overrides)
+    if args.database:
+        schemas.default = schemas.get(args.database).name
+    if args.schema_memory_mb:
+        schemas.max_bytes = int(args.schema_memory_mb * 1024 * 1024)
+    return schemas
+
+
+def print_schema_report(stats: dict):
+    """Loads, hits and evictions of the schema bundles, and the measured footprint of the loaded ones."""
+    budget = f"budget {stats['max_bytes'] / 2**20:.1f} MB" if stats["max_bytes"] else "no budget"
+    print(f"Schemas: {len(stats['resident'])}/{stats['databases']} loaded ({stats['resident_bytes'] / 2**20:.1f} MB, {budget}), "
+          f"{stats['loads']} loads, {stats['hits']} hits, {stats['evictions']} evictions")
+    for name, bundle in stats["bundles"].items():
+        components = ", ".join(f"{component} {size / 2**20:.2f} MB" for component, size in bundle["components"].items())
+        print(f"  {name}: {bundle['bytes'] / 2**20:.2f} MB ({components or 'no component'}, {bundle['collections']} Chroma collections)")
+
+
+def export_results(executor: SQLExecutor, result: PipelineResult, export_dir: str):
+    """Stream the full result of every statement (no row cap) into <export_dir>/<time>-<n>.parquet."""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    for i, statement in enumerate(result.statements):
+        path = os.path.join(export_dir, f"{stamp}-{i}.parquet")
+        try:
+            summary = executor.export(statement, path)
+            print(f"{summary['rows']} rows written to {path}")
+        except Exception as e:
+            print(f"[ERROR] Export failed: {statement}\n{e}")
+
+
+async def print_stream(pipeline: NLToSQLPipeline, query: str, database: Optional[str] = None):
+    """Print the events of a question as they arrive."""
+    async for event in pipeline.astream(query, database):
+        if isinstance(event, SQLTokenEvent):
+            print(event.text, end="", flush=True)
+        elif isinstance(event, SQLStatementEvent):
+            print(f"\n[SQL] {event.sql}", flush=True)
+        elif isinstance(event, ResultEvent):
+            if event.result.from_cache:
+                print(event.result.sql)
+            print()
+            print_execution(event.result.execution)
+        elif isinstance(event, TableColumnsEvent):
+            print(f"[{event.event}] {event.table}: " + ", ".join(col.column_name for col in event.columns))
+        else:
+            print(f"[{event.event}] " + str(event.model_dump(exclude={"event"})))
+
+
+def print_lexical_report(stats: dict):
+    """How often the lexical fast path fired, and how often it agreed with the LLM seed tables."""
+    print(f"Lexical fast path: fired for {stats['fired']}/{stats['questions']} questions ({stats['fire_rate']:.0%})")
+    for label in ("fired", "fallback"):
+        if stats[label + "_compared"]:
+            print(f"  {label}: agreed with the LLM on {stats[label + '_agreement']:.0%} of {stats[label + '_compared']} "
+                  f"questions (mean Jaccard {stats[label + '_jaccard']:.2f})")
+    if stats.get("calibrated_threshold") is not None:
+        print(f"  lowest threshold at which every compared question that would fire agreed: {stats['calibrated_threshold']:.2f}")
 
 
+def print_speculation_report(stats: dict):
+    """How much of the speculative work was used, the wall time it saved and what the rest cost."""
+    print(f"Speculation: {stats['used']}/{stats['started']} tasks used ({stats['use_rate']:.0%}), "
+          f"{stats['cancelled']} cancelled before starting, {stats['wasted']} discarded")
+    print(f"  saved {stats['saved_seconds']:.2f}s of wall time, wasted {stats['wasted_seconds']:.2f}s of work and "
+          f"{stats['wasted_prompt_tokens'] + stats['wasted_completion_tokens']} tokens (counted with --profile)")
 
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from RAG_pipeline import (NLToSQLPipeline, print_lexical_report, add_profile_arguments, configure_profiling,
+                          add_execution_arguments, create_executor, add_validation_arguments, create_validator,
+                          add_router_arguments, create_model_router, print_router_report, add_schema_arguments,
+                          create_schema_registry, print_schema_report)
+from utilities.generate_embeddings.lexical_index import DEFAULT_THRESHOLD as LEXICAL_THRESHOLD, load_router
+from utilities.schema_bundles import UnknownSchemaError
+from typing import List, Set
+import argparse
+import json
+import os
+import time
+
+
+def read_questions(input_path: str) -> List[dict]:
+    """
+    Read the questions of a JSONL file, one {"id": ..., "question": ..., "database": ...} object per line.
+    Lines without an id get their line number as id; lines without a database use the default one.
+    """
+    questions = []
+    with open(input_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            questions.append({"id": record.get("id", line_number), "question": record["question"], "database": record.get("database")})
+    return questions
+
+
+def read_done_ids(output_path: str) -> Set:
+    """Ids already answered successfully in a previous (possibly crashed) run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Last line of a crashed run may be truncated
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+def run_batch_file(pipeline: NLToSQLPipeline, input_path: str, output_path: str, chunk_size: int = 50,
+                   max_concurrency: int = 8):
+    """
+    Answers every question of input_path and appends the results to output_path.
+
+    The questions are processed in chunks. Each chunk runs stage by stage through
+    NLToSQLPipeline.run_batch, and its results are flushed to disk before the next chunk
+    starts, so a restarted run skips every question that already has a result. Failed
+    questions are written with an "error" field and retried on the next run; the later
+    line for an id supersedes the earlier one. The questions of a chunk are batched per database.
+    """
+    questions = read_questions(input_path)
+    done = read_done_ids(output_path)
+    todo = [question for question in questions if question["id"] not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(todo)} already done, {len(todo)} to run")
+
+    started = time.perf_counter()
+    answered = 0
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            results = [None] * len(chunk)
+            for database in dict.fromkeys(question["database"] for question in chunk):
+                indices = [i for i, question in enumerate(chunk) if question["database"] == database]
+                try:
+                    batch = pipeline.run_batch([chunk[i]["question"] for i in indices], max_concurrency=max_concurrency,
+                                               database=database)
+                except UnknownSchemaError as e:
+                    batch = [e] * len(indices)
+                for i, result in zip(indices, batch):
+                    results[i] = result
+
+            for question, result in zip(chunk, results):
+                if isinstance(result, Exception):
+                    record = {"id": question["id"], "question": question["question"], "database": question["database"],
+                              "error": str(result)}
+                else:
+                    record = {"id": question["id"], **result.model_dump()}
+                    answered += 1
+                output.write(json.dumps(record) + "\n")
+
+            output.flush()
+            os.fsync(output.fileno())
+
+            elapsed = time.perf_counter() - started
+            print(f"{start + len(chunk)}/{len(todo)} questions, {answered / elapsed:.2f} questions/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SQL for a JSONL file of questions.")
+    parser.add_argument("input", help="JSONL file with one {\"id\", \"question\", \"database\"} object per line (database optional)")
+    parser.add_argument("output", help="JSONL file the results are appended to (also the checkpoint)")
+    parser.add_argument("--chunk-size", type=int, default=50, help="Questions run through the stages together")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Concurrent LLM calls per stage")
+    parser.add_argument("--lexical-index", default=None, help="JSON lexical index enabling the fast path (disabled if omitted)")
+    parser.add_argument("--lexical-threshold", type=float, default=LEXICAL_THRESHOLD, help="Confidence needed to skip the Level 1 and seed LLM calls")
+    parser.add_argument("--lexical-audit-rate", type=float, default=0.0, help="Share of fast-path questions also sent to the LLM to measure agreement")
+    add_profile_arguments(parser)
+    add_execution_arguments(parser)
+    add_validation_arguments(parser)
+    add_router_arguments(parser)
+    add_schema_arguments(parser)
+    args = parser.parse_args()
+    configure_profiling(args)
+    model_router = create_model_router(args)
+
+    # With --schemas, every database has its own executor, validator and lexical index
+    schemas = create_schema_registry(args)
+    single = schemas is None
+    executor = create_executor(args) if single else None
+
+    lexical_router = None
+    if args.lexical_index and single:
+        lexical_router = load_router(args.lexical_index, threshold=args.lexical_threshold, audit_rate=args.lexical_audit_rate)
+
+    pipeline = NLToSQLPipeline(verbose=False, max_concurrency=args.max_concurrency, lexical_router=lexical_router,
+                               executor=executor, validator=create_validator(args) if single else None,
+                               max_repairs=args.max_repairs, model_router=model_router, schemas=schemas)
+    run_batch_file(pipeline, args.input, args.output, chunk_size=args.chunk_size, max_concurrency=args.max_concurrency)
+
+    if lexical_router is not None:
+        print_lexical_report(lexical_router.stats())
+
+    if model_router is not None:
+        print_router_report(model_router.stats())
+        model_router.close()
+
+    if schemas is not None:
+        print_schema_report(schemas.stats())
+        schemas.close()
+
+    if executor is not None:
+        stats = executor.stats()
+        print(f"Executed {stats['executed']} statements ({stats['failed']} failed) over {stats['connections_created']} connections")
+        executor.close()
+
+
+if __name__ == "__main__":
+    main()
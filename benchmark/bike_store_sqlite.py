@@ -0,0 +1,131 @@
+import os
+import random
+import re
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+SQLITE_TYPES = {"int": "INTEGER", "double": "REAL", "text": "TEXT"}
+
+BRANDS = ["Electra", "Haro", "Heller", "Pure Cycles", "Ritchey", "Strider", "Sun Bicycles", "Surly", "Trek"]
+CATEGORIES = ["Children Bicycles", "Comfort Bicycles", "Cruisers Bicycles", "Cyclocross Bicycles",
+              "Electric Bikes", "Mountain Bikes", "Road Bikes"]
+STORES = [("Santa Cruz Bikes", "Santa Cruz", "CA", 95060), ("Baldwin Bikes", "Baldwin", "NY", 11432),
+          ("Rowlett Bikes", "Rowlett", "TX", 75088)]
+FIRST_NAMES = ["Debra", "Kasha", "Tameka", "Daryl", "Charolette", "Lyndsey", "Latasha", "Jacquline", "Genoveva",
+               "Pamelia", "Deshawn", "Robby", "Lashawn", "Jayne", "Fabiola", "Mireya", "Bernardine", "Kali"]
+LAST_NAMES = ["Burks", "Todd", "Fisher", "Spence", "Rice", "Bean", "Hays", "Duncan", "Baldwin", "Newman",
+              "Mendoza", "Sykes", "Ortiz", "Kirkland", "Hess", "Wooten", "Houston", "Vargas"]
+CITIES = [("Orchard Park", "NY"), ("Campbell", "CA"), ("Redondo Beach", "CA"), ("Uniondale", "NY"),
+          ("Sacramento", "CA"), ("Houston", "TX"), ("Buffalo", "NY"), ("Fairport", "NY")]
+MODELS = ["Townie", "Cruiser", "Fuel EX", "Slash", "Domane", "Madone", "Marlin", "Verve", "Cross Check", "Straggler"]
+
+
+def build_database(db_path: str, catalog: Dict[str, Dict[str, str]], scale: float = 1.0, seed: int = 0):
+    """
+    Create a SQLite copy of bike_store with the schema of the table docs and deterministic
+    synthetic rows (same seed and scale, same database).
+
+    Args:
+        db_path (str): Output sqlite file (replaced if it exists).
+        catalog (Dict[str, Dict[str, str]]): Table -> column -> data type (see load_column_catalog).
+        scale (float): Multiplier of the number of customers, products and orders.
+        seed (int): Seed of the random data.
+    """
+    rng = random.Random(seed)
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    for table, columns in catalog.items():
+        definition = ", ".join(f"{column} {SQLITE_TYPES.get(data_type, 'TEXT')}" for column, data_type in columns.items())
+        conn.execute(f"CREATE TABLE {table} ({definition})")
+
+    def insert(table: str, rows: List[tuple]):
+        placeholders = ", ".join("?" for _ in catalog[table])
+        conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+
+    insert("brands", [(i + 1, name) for i, name in enumerate(BRANDS)])
+    insert("categories", [(i + 1, name) for i, name in enumerate(CATEGORIES)])
+    insert("stores", [(i + 1, name, f"({rng.randint(200, 999)}) 555-{rng.randint(1000, 9999)}",
+                       f"{name.split()[0].lower()}@bikes.shop", f"{rng.randint(10, 9999)} Main St", city, state, zip_code)
+                      for i, (name, city, state, zip_code) in enumerate(STORES)])
+
+    staffs = []
+    for i in range(10):
+        store_id = i % len(STORES) + 1
+        manager_id = None if i == 0 else (1 if i < len(STORES) else store_id)
+        first, last = FIRST_NAMES[i % len(FIRST_NAMES)], LAST_NAMES[(i * 7) % len(LAST_NAMES)]
+        staffs.append((i + 1, first, last, f"{first.lower()}.{last.lower()}@bikes.shop",
+                       f"(831) 555-{5554 + i}", int(i != 9), store_id, manager_id))
+    insert("staffs", staffs)
+
+    n_products = max(10, int(100 * scale))
+    products = []
+    for i in range(n_products):
+        brand_id = rng.randint(1, len(BRANDS))
+        model_year = rng.choice([2016, 2017, 2018, 2019])
+        name = f"{BRANDS[brand_id - 1]} {rng.choice(MODELS)} {rng.randint(1, 9)} - {model_year}"
+        products.append((i + 1, name, brand_id, rng.randint(1, len(CATEGORIES)), model_year,
+                         round(rng.uniform(89.99, 5999.99), 2)))
+    insert("products", products)
+
+    insert("stocks", [(store_id, product_id, rng.randint(0, 30))
+                      for store_id in range(1, len(STORES) + 1) for product_id in range(1, n_products + 1)])
+
+    n_customers = max(10, int(300 * scale))
+    customers = []
+    for i in range(n_customers):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        city, state = rng.choice(CITIES)
+        phone = None if rng.random() < 0.7 else f"(516) 555-{rng.randint(1000, 9999)}"
+        customers.append((i + 1, first, last, phone, f"{first.lower()}.{last.lower()}{i}@example.com",
+                          f"{rng.randint(1, 999)} {rng.choice(LAST_NAMES)} Ave", city, state, rng.randint(10000, 99999)))
+    insert("customers", customers)
+
+    n_orders = max(20, int(600 * scale))
+    orders = []
+    order_items = []
+    start = date(2016, 1, 1)
+    for i in range(n_orders):
+        order_date = start + timedelta(days=rng.randint(0, 3 * 365 - 1))
+        status = rng.choices([1, 2, 3, 4], weights=[1, 1, 1, 7])[0]
+        shipped = (order_date + timedelta(days=rng.randint(1, 4))).isoformat() if status == 4 else None
+        store_id = rng.randint(1, len(STORES))
+        staff_id = rng.choice([staff[0] for staff in staffs if staff[6] == store_id])
+        orders.append((i + 1, rng.randint(1, n_customers), status, order_date.isoformat(),
+                       (order_date + timedelta(days=rng.randint(2, 5))).isoformat(), shipped, store_id, staff_id))
+        for item_id in range(1, rng.randint(1, 4) + 1):
+            product = products[rng.randint(0, n_products - 1)]
+            order_items.append((i + 1, item_id, product[0], rng.randint(1, 3), product[5], rng.choice([0.05, 0.07, 0.1, 0.2])))
+    insert("orders", orders)
+    insert("order_items", order_items)
+
+    conn.commit()
+    conn.close()
+
+
+def _normalise(rows: List[tuple]) -> List[tuple]:
+    # Floats are compared to 2 decimals (money), the rest as is
+    return [tuple(round(value, 2) if isinstance(value, float) else value for value in row) for row in rows]
+
+
+def execution_match(conn: sqlite3.Connection, predicted_sql: Optional[str], gold_sql: str) -> bool:
+    """
+    Whether the predicted query returns the same rows as the gold query. Row order only
+    matters when the gold query has an ORDER BY; column names never matter.
+    """
+    if not predicted_sql:
+        return False
+    try:
+        predicted = _normalise(conn.execute(predicted_sql).fetchall())
+    except sqlite3.Error:
+        return False
+    gold = _normalise(conn.execute(gold_sql).fetchall())
+
+    if re.search(r"\bORDER\s+BY\b", gold_sql, re.IGNORECASE):
+        return predicted == gold
+    return sorted(predicted, key=repr) == sorted(gold, key=repr)
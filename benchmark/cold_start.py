@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What is timed, each in a fresh interpreter: importing the pipeline, and the CLI up to its first
+# prompt (stdin is closed, so it exits there)
+TARGETS = {
+    "import": ["-c", "import RAG_pipeline"],
+    "startup": ["RAG_pipeline.py"],
+}
+
+# Milliseconds of the median run above which the benchmark fails
+DEFAULT_BUDGETS_MS = {"import": 1500, "startup": 2500}
+
+# Only imported when they are used (a question is asked, --validate, --execute, draw_graph...)
+DEFERRED_MODULES = ("langchain_openai", "langchain_groq", "groq", "openai", "chromadb", "langchain_chroma",
+                    "matplotlib", "sqlglot", "pyarrow", "mysql")
+
+
+def run_target(args: List[str], importtime: bool = False) -> Tuple[float, str]:
+    """Wall time (seconds) of one run of `python <args>`, and its stderr."""
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + args
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=REPO_DIR, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"python {' '.join(args)} failed:\n{completed.stderr[-2000:]}")
+    return elapsed, completed.stderr
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Self import time (microseconds) of every module of an `-X importtime` report."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        # import time:       self |  cumulative |   package.module (indented by nesting)
+        self_us, _, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+def by_package(modules: Dict[str, int]) -> Dict[str, int]:
+    """Self import time summed per top-level package (e.g. every langchain_core.* module)."""
+    packages = defaultdict(int)
+    for name, self_us in modules.items():
+        packages[name.split(".")[0]] += self_us
+    return dict(packages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the pipeline and fail past a budget.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target (the median is compared)")
+    parser.add_argument("--import-budget-ms", type=float, default=DEFAULT_BUDGETS_MS["import"], help="Budget of `import RAG_pipeline`")
+    parser.add_argument("--startup-budget-ms", type=float, default=DEFAULT_BUDGETS_MS["startup"], help="Budget of the CLI up to its first prompt")
+    parser.add_argument("--top", type=int, default=10, help="Packages listed in the import time report")
+    parser.add_argument("--report", default=None, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    budgets = {"import": args.import_budget_ms, "startup": args.startup_budget_ms}
+
+    report = {}
+    failures = []
+    for target, target_args in TARGETS.items():
+        # One untimed run first, so every timed run finds the bytecode compiled and the files in the page cache
+        run_target(target_args)
+        times = [run_target(target_args)[0] * 1000 for _ in range(args.runs)]
+        modules = parse_importtime(run_target(target_args, importtime=True)[1])
+        eager = sorted({name.split(".")[0] for name in modules if name.split(".")[0] in DEFERRED_MODULES})
+
+        report[target] = {
+            "median_ms": statistics.median(times),
+            "max_ms": max(times),
+            "budget_ms": budgets[target],
+            "packages_ms": {name: self_us / 1000 for name, self_us in
+                            sorted(by_package(modules).items(), key=lambda item: -item[1])[:args.top]},
+            "eager_deferred_modules": eager,
+        }
+        if report[target]["median_ms"] > budgets[target]:
+            failures.append(f"{target}: median {report[target]['median_ms']:.0f} ms is over the {budgets[target]:.0f} ms budget")
+        if eager:
+            failures.append(f"{target}: imports {', '.join(eager)} at startup")
+
+    for target, stats in report.items():
+        print(f"\n{target} (python {' '.join(TARGETS[target])}): median {stats['median_ms']:.0f} ms, "
+              f"max {stats['max_ms']:.0f} ms, budget {stats['budget_ms']:.0f} ms")
+        print("  Import time per package (self, ms)")
+        for name, ms in stats["packages_ms"].items():
+            print(f"    {name:<30} {ms:>8.1f}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if failures:
+        for failure in failures:
+            print(f"[ERROR] {failure}")
+        sys.exit(1)
+    print("\nCold start within budget.")
+
+
+if __name__ == "__main__":
+    main()
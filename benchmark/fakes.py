@@ -0,0 +1,318 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from utilities import prompts
+
+
+def _unit(key: str) -> float:
+    """A number in [0, 1], deterministic for a given key."""
+    return zlib.crc32(key.encode("utf-8")) / 0xFFFFFFFF
+
+
+def _jittered(latency: float, jitter: float, key: str) -> float:
+    """latency +/- jitter (relative), deterministic for a given key."""
+    if not latency:
+        return 0.0
+    return max(0.0, latency * (1 + jitter * (2 * _unit(key) - 1)))
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, dim: int = 256, latency: float = 0.0, jitter: float = 0.0):
+        """
+        Deterministic local embeddings: a normalised bag of hashed words, so texts sharing
+        words are close. Every call sleeps latency seconds (+/- jitter) to stand in for the API.
+        """
+        self.dim = dim
+        self.latency = latency
+        self.jitter = jitter
+        self.model = f"fake-hashing-{dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(_jittered(self.latency, self.jitter, "".join(texts[:1])))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(_jittered(self.latency, self.jitter, text))
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(_jittered(self.latency, self.jitter, "".join(texts[:1])))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(_jittered(self.latency, self.jitter, text))
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model: responder maps the prompt messages to the reply text, and every
+    call sleeps latency seconds (+/- jitter). Replies carry an estimated token usage, and
+    with_structured_output parses the reply as JSON into the schema.
+
+    To exercise the model router, a share of the calls (drawn at random) can be made slow
+    (slow_rate, slow_latency extra seconds) or fail after half their latency (error_rate).
+    """
+
+    responder: Callable[[List[BaseMessage]], str]
+    latency: float = 0.0
+    jitter: float = 0.0
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+    chunk_size: int = 8
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    error_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: List[BaseMessage]) -> Tuple[str, float, dict]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        content = self.responder(messages)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        delay = _jittered(self.latency, self.jitter, prompt)
+        if self.slow_rate and random.random() < self.slow_rate:
+            delay += self.slow_latency
+        return content, delay, usage
+
+    def _fails(self) -> bool:
+        return bool(self.error_rate) and random.random() < self.error_rate
+
+    def _failure(self) -> Exception:
+        return ConnectionError(f"{self.model_name}: injected provider failure")
+
+    def _result(self, content: str, usage: dict) -> ChatResult:
+        message = AIMessage(content=content, usage_metadata=usage, response_metadata={"model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content, delay, usage = self._reply(messages)
+        if self._fails():
+            time.sleep(delay / 2)
+            raise self._failure()
+        time.sleep(delay)
+        return self._result(content, usage)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content, delay, usage = self._reply(messages)
+        if self._fails():
+            await asyncio.sleep(delay / 2)
+            raise self._failure()
+        await asyncio.sleep(delay)
+        return self._result(content, usage)
+
+    def _chunks(self, content: str, usage: dict):
+        pieces = [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)] or [""]
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=piece, usage_metadata=usage if last else None,
+                response_metadata={"model_name": self.model_name} if last else {},
+            ))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Half of the latency before the first token, the rest spread over the reply
+        content, delay, usage = self._reply(messages)
+        chunks = list(self._chunks(content, usage))
+        time.sleep(delay / 2)
+        if self._fails():
+            raise self._failure()
+        for chunk in chunks:
+            time.sleep(delay / 2 / len(chunks))
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        content, delay, usage = self._reply(messages)
+        chunks = list(self._chunks(content, usage))
+        await asyncio.sleep(delay / 2)
+        if self._fails():
+            raise self._failure()
+        for chunk in chunks:
+            await asyncio.sleep(delay / 2 / len(chunks))
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs):
+        return self | RunnableLambda(lambda message: schema.model_validate_json(message.content))
+
+
+def empty_responder(messages: List[BaseMessage]) -> str:
+    """Reply of a fake provider without an oracle: an empty structured output."""
+    return json.dumps({"table_names": [], "relevant_columns": []})
+
+
+def _marker(prompt: str) -> str:
+    # The longest line of a system prompt without template variables identifies its stage
+    return max((line.strip() for line in prompt.splitlines() if "{" not in line), key=len)
+
+
+STAGE_MARKERS = {
+    "lvl1": _marker(prompts.prompt_lvl1),
+    "seed": _marker(prompts.seed_table_extraction_prompt),
+    "columns": _marker(prompts.column_extraction_prompt),
+    "filter": _marker(prompts.col_filter_prompt),
+    "query": _marker(prompts.query_generation_prompt),
+}
+
+# The repair conversation keeps the query generation system prompt, and ends with this
+REPAIR_MARKER = _marker(prompts.query_repair_prompt)
+
+
+def parse_gold(sql: str, catalog: Dict[str, Dict[str, str]]) -> Tuple[List[str], Set[Tuple[str, str]]]:
+    """Tables of a gold query (FROM / JOIN), and the columns of those tables it needs."""
+    tables = list(dict.fromkeys(table.lower() for table in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)", sql, re.IGNORECASE)
+                                if table.lower() in catalog))
+    words = set(re.findall(r"[a-z_]+", sql.lower()))
+    columns = {(table, column) for table in tables for column in catalog[table] if column in words}
+    # A table queried without naming a column (COUNT(*)) still needs one: a model picks its key
+    for table in tables:
+        if not any(name == table for name, _ in columns):
+            columns.add((table, next(iter(catalog[table]))))
+    return tables, columns
+
+
+class OracleResponder:
+    def __init__(self, questions: List[dict], catalog: Dict[str, Dict[str, str]], neighbours: Dict[str, List[str]],
+                 error_rate: float = 0.0):
+        """
+        Stands in for the LLM at every stage, answering from the gold SQL of the question found
+        in the prompt. It only sees what the pipeline passes on: the column extractor must find
+        the table's column list in the retrieved chunks, and the query model writes the gold SQL
+        only if every table and column it needs reached its prompt. A retrieval, join planning or
+        merging regression therefore shows up as an execution mismatch.
+
+        Args:
+            questions (List[dict]): The corpus ({"id", "question", "gold_sql"}).
+            catalog (Dict[str, Dict[str, str]]): Table -> column -> data type.
+            neighbours (Dict[str, List[str]]): Table -> tables it joins with (knowledge graph).
+            error_rate (float): Share of the questions whose first query misspells a column, which
+                only a repair (given the validation errors) corrects.
+        """
+        self.catalog = catalog
+        self.error_rate = error_rate
+        self.neighbours = neighbours
+        # Longest questions first, so a question contained in another is not mistaken for it
+        self.questions = sorted(questions, key=lambda question: -len(question["question"]))
+        self.gold = {question["question"]: parse_gold(question["gold_sql"], catalog) + (question["gold_sql"],)
+                     for question in questions}
+
+    def _question(self, text: str) -> Optional[str]:
+        for question in self.questions:
+            if question["question"] in text:
+                return question["question"]
+        return None
+
+    def __call__(self, messages: List[BaseMessage]) -> str:
+        system = str(messages[0].content)
+        text = "\n".join(str(message.content) for message in messages)
+        stage = next((name for name, marker in STAGE_MARKERS.items() if marker in system), None)
+        if stage == "query" and REPAIR_MARKER in text:
+            stage = "repair"
+        question = self._question(text)
+        if stage is None or question is None:
+            return empty_responder(messages)
+
+        tables, columns, sql = self.gold[question]
+        return getattr(self, "_" + stage)(text, tables, columns, sql)
+
+    def _lvl1(self, text, tables, columns, sql) -> str:
+        # Over-inclusive like the real Level 1: the gold tables and their neighbours
+        broad = list(tables)
+        for table in tables:
+            broad.extend(other for other in self.neighbours.get(table, []) if other not in broad)
+        return json.dumps({"table_names": broad})
+
+    def _seed(self, text, tables, columns, sql) -> str:
+        offered = re.search(r"broadly relevant tables:\n(.*)", text)
+        offered = {table.strip() for table in offered.group(1).split(",")} if offered else set()
+        return json.dumps({"table_names": [table for table in tables if table in offered]})
+
+    def _columns(self, text, tables, columns, sql) -> str:
+        # The table is recognised from the column rows of its doc in the retrieved chunks
+        listed = set(re.findall(r"^\|\s*`(\w+)`\s*\|", text, flags=re.MULTILINE))
+        table = max(self.catalog, key=lambda name: len(listed & set(self.catalog[name])) - len(set(self.catalog[name]) - listed))
+        if not listed or not listed >= set(self.catalog[table]):
+            return json.dumps({"relevant_columns": []})
+        return json.dumps({"relevant_columns": [
+            {"table_name": table, "column_name": column, "reason": "used by the question", "data_type": self.catalog[table][column]}
+            for column in self.catalog[table] if (table, column) in columns
+        ]})
+
+    def _filter(self, text, tables, columns, sql) -> str:
+        kept = []
+        for table, column, data_type in re.findall(r"^(\w+)\.(\w+) \(([^)]*)\) -->", text, flags=re.MULTILINE):
+            if (table, column) in columns:
+                kept.append({"table_name": table, "column_name": column, "reason": "used by the question", "data_type": data_type})
+        return json.dumps({"relevant_columns": kept})
+
+    def _query(self, text, tables, columns, sql) -> str:
+        offered_tables = re.search(r"RELEVANT TABLES:\n(.*)", text)
+        offered_tables = set(offered_tables.group(1).split()) if offered_tables else set()
+        offered_columns = set(re.findall(r"^\s*(\w+)\.(\w+) \(", text, flags=re.MULTILINE))
+
+        thinking = "<think>\nMapping the entities of the question to the given tables and columns.\n</think>\n"
+        if not (set(tables) <= offered_tables and columns <= offered_columns):
+            return thinking + "```sql\nSELECT NULL AS missing_context;\n```"
+        if _unit(sql) < self.error_rate:
+            # A hallucinated column name, e.g. brand_name -> brand_name_value
+            column = sorted(columns)[0][1]
+            sql = re.sub(rf"\b{column}\b", f"{column}_value", sql, count=1)
+        return thinking + f"```sql\n{sql}\n```"
+
+    def _repair(self, text, tables, columns, sql) -> str:
+        return f"```sql\n{sql}\n```"
+
+
+def make_models(responder: OracleResponder, llm_latency: float, query_latency: float, jitter: float) -> Dict[str, Any]:
+    """The fake structured-stage model and query model of the pipeline."""
+    return {
+        "chat_model": FakeChatModel(responder=responder, latency=llm_latency, jitter=jitter, model_name="fake-gpt-4o-mini"),
+        "query_model": FakeChatModel(responder=responder, latency=query_latency, jitter=jitter, model_name="fake-qwen-qwq-32b"),
+    }
+
+
+def make_router(responder: OracleResponder, llm_latency: float, query_latency: float, jitter: float,
+                slow_rate: float = 0.0, slow_latency: float = 0.0, error_rate: float = 0.0,
+                failure_threshold: int = 5, reset_after: float = 30.0, **stage_config):
+    """
+    A model router over two fake providers per stage (a primary and a 20% slower secondary),
+    every one of them with the injected slow calls and failures; stage_config (budget, hedge,
+    hedge_after, ...) applies to every stage.
+    """
+    from utilities.model_router import ModelRouter
+
+    faults = {"slow_rate": slow_rate, "slow_latency": slow_latency, "error_rate": error_rate}
+    providers = {
+        "fake-openai": FakeChatModel(responder=responder, latency=llm_latency, jitter=jitter, model_name="fake-gpt-4o-mini", **faults),
+        "fake-groq": FakeChatModel(responder=responder, latency=llm_latency * 1.2, jitter=jitter, model_name="fake-llama-3.3-70b", **faults),
+        "fake-groq-qwq": FakeChatModel(responder=responder, latency=query_latency, jitter=jitter, model_name="fake-qwen-qwq-32b", **faults),
+        "fake-openai-4o": FakeChatModel(responder=responder, latency=query_latency * 1.2, jitter=jitter, model_name="fake-gpt-4o", **faults),
+    }
+    stages = {
+        "default": {"providers": ["fake-openai", "fake-groq"], **stage_config},
+        "query": {"providers": ["fake-groq-qwq", "fake-openai-4o"], **stage_config},
+    }
+    return ModelRouter(providers, stages, failure_threshold=failure_threshold, reset_after=reset_after)
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from RAG_pipeline import NLToSQLPipeline, print_lexical_report, print_router_report
+from model import Knowledge_Graph
+from utilities.tracing import tracer
+from utilities.sql_executor import SQLExecutor, SQLiteAdapter
+from utilities.generate_embeddings.generate_db import configure_backend
+from utilities.generate_embeddings.numpy_index import NumpyVectorIndex
+from utilities.generate_embeddings.retrieve_doc import get_doc_content, get_chunks
+from utilities.generate_embeddings.lexical_index import DEFAULT_THRESHOLD as LEXICAL_THRESHOLD, LexicalTableIndex, LexicalRouter
+from utilities.sql_validator import SQLValidator, load_column_catalog
+from benchmark.bike_store_sqlite import build_database, execution_match
+from benchmark.fakes import FakeEmbeddings, OracleResponder, make_models, make_router
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50 / p90 / p99 in milliseconds."""
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0}
+    values = np.asarray(values) * 1000
+    return {f"p{q}": float(np.percentile(values, q)) for q in (50, 90, 99)}
+
+
+class SpanCollector:
+    def __init__(self):
+        """Keeps the raw duration of every span of every finished trace, per span name."""
+        self.durations = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __call__(self, root):
+        with self._lock:
+            stack = [root]
+            while stack:
+                span = stack.pop()
+                self.durations[span.name].append(span.duration)
+                stack.extend(span.children)
+
+
+def build_workspace(work_dir: str, docs_dir: str, embeddings, scale: float, seed: int):
+    """The SQLite bike_store, the numpy index of the docs (fake embeddings) and the lexical index."""
+    catalog = load_column_catalog(os.path.join(docs_dir, "table_docs"))
+    build_database(os.path.join(work_dir, "bike_store.sqlite"), catalog, scale=scale, seed=seed)
+
+    collections = {"overview": get_chunks(get_doc_content(os.path.join(docs_dir, "overview.md")))}
+    for table in catalog:
+        collections[table] = get_chunks(get_doc_content(os.path.join(docs_dir, "table_docs", f"{table}.md")))
+    NumpyVectorIndex.build_from_documents(collections, embeddings, os.path.join(work_dir, "numpy_index"))
+
+    LexicalTableIndex.build(os.path.join(docs_dir, "overview.md"), os.path.join(docs_dir, "table_docs"),
+                            os.path.join(work_dir, "lexical_index.json"))
+    return catalog
+
+
+def run_level(pipeline: NLToSQLPipeline, questions: List[dict], concurrency: int):
+    """Answer every question with `concurrency` questions in flight; returns (wall time, latencies, results)."""
+    def _timed(question):
+        started = time.perf_counter()
+        try:
+            result = pipeline.run(question["question"])
+        except Exception as e:
+            print(f"[ERROR] Question failed: {question['question']}\n{e}")
+            result = None
+        return time.perf_counter() - started, result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outputs = list(pool.map(_timed, questions))
+    return time.perf_counter() - started, [latency for latency, _ in outputs], [result for _, result in outputs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the pipeline with fake LLMs, fake embeddings and SQLite.")
+    parser.add_argument("--questions", default="benchmark/questions.jsonl", help="JSONL corpus of {id, question, gold_sql}")
+    parser.add_argument("--docs", default="docs", help="Directory of overview.md and table_docs/")
+    parser.add_argument("--kg", default="knowledge_graph.gml", help="Knowledge graph of the schema")
+    parser.add_argument("--work-dir", default="db/bench", help="Directory of the generated SQLite database and indexes")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated numbers of questions in flight")
+    parser.add_argument("--repeat", type=int, default=1, help="Times the corpus is run at every concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds per structured LLM call")
+    parser.add_argument("--query-latency", type=float, default=1.5, help="Seconds per SQL generation call")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embedding call")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative +/- variation of the latencies")
+    parser.add_argument("--table-concurrency", type=int, default=1, help="Tables processed in parallel in Level 2")
+    parser.add_argument("--lexical", action="store_true", help="Enable the lexical fast path")
+    parser.add_argument("--lexical-threshold", type=float, default=LEXICAL_THRESHOLD, help="Confidence above which the fast path fires")
+    parser.add_argument("--lexical-audit-rate", type=float, default=0.0,
+                        help="Share of fast-path questions also sent to the LLM, to measure the agreement and calibrate the threshold")
+    parser.add_argument("--speculate", choices=["retrieval", "columns"], default=None, help="Speculative Level 2 mode of the pipeline")
+    parser.add_argument("--router", action="store_true", help="Route every stage over two fake providers (see --slow-rate, --fail-rate)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of provider calls taking --slow-latency longer")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Extra seconds of a slow provider call")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of provider calls failing")
+    parser.add_argument("--no-hedge", action="store_true", help="Only fall back on errors, never send hedged requests")
+    parser.add_argument("--hedge-after", type=float, default=None, help="Seconds before hedging (default: p95 of the provider)")
+    parser.add_argument("--stage-budget", type=float, default=None, help="Seconds allowed per stage call")
+    parser.add_argument("--execute", action="store_true", help="Also run the generated SQL through the pooled executor")
+    parser.add_argument("--validate", action="store_true", help="Validate the SQL and repair it (see --error-rate)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of first queries with a hallucinated column")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size of the synthetic bike_store")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic bike_store")
+    parser.add_argument("--report", default=None, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    with open(args.questions, "r", encoding="utf-8") as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+
+    embeddings = FakeEmbeddings(latency=args.embed_latency, jitter=args.jitter)
+    catalog = build_workspace(args.work_dir, args.docs, embeddings, args.scale, args.seed)
+    configure_backend("numpy", os.path.join(args.work_dir, "numpy_index"), embeddings=embeddings)
+
+    graph = Knowledge_Graph.load_graph(args.kg)
+    neighbours = {table: sorted(set(graph.graph.successors(table)) | set(graph.graph.predecessors(table)) - {table})
+                  for table in graph.graph.nodes}
+    responder = OracleResponder(questions, catalog, neighbours, error_rate=args.error_rate)
+    models = make_models(responder, args.llm_latency, args.query_latency, args.jitter)
+    validator = SQLValidator(graph.graph, catalog) if args.validate else None
+
+    collector = SpanCollector()
+    tracer.configure(enabled=True, trace_dir=None, metrics_path=None)
+    tracer.add_listener(collector)
+
+    conn = sqlite3.connect(os.path.join(args.work_dir, "bike_store.sqlite"), check_same_thread=False)
+    report = {"questions": len(questions), "levels": [], "stages": {}}
+    mismatches = {}
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    executor = None
+    if args.execute:
+        executor = SQLExecutor(SQLiteAdapter(os.path.join(args.work_dir, "bike_store.sqlite")), pool_size=max(levels))
+
+    for concurrency in levels:
+        # A fresh pipeline and embedding cache per level, so every level pays the same calls
+        cache_path = os.path.join(args.work_dir, f"embedding_cache_{concurrency}.sqlite")
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        lexical_router = None
+        if args.lexical:
+            lexical_router = LexicalRouter(LexicalTableIndex(os.path.join(args.work_dir, "lexical_index.json")),
+                                           threshold=args.lexical_threshold, audit_rate=args.lexical_audit_rate)
+        # A fresh router per level too, so every level starts without latency history or open circuits
+        model_router = None
+        if args.router:
+            model_router = make_router(responder, args.llm_latency, args.query_latency, args.jitter,
+                                       slow_rate=args.slow_rate, slow_latency=args.slow_latency, error_rate=args.fail_rate,
+                                       budget=args.stage_budget, hedge=not args.no_hedge, hedge_after=args.hedge_after)
+        pipeline = NLToSQLPipeline(kg_file_path=args.kg, verbose=False, max_concurrency=args.table_concurrency,
+                                   embedding_cache_path=cache_path, lexical_router=lexical_router, embeddings=embeddings,
+                                   executor=executor, validator=validator, speculation=args.speculate, model_router=model_router, **models)
+
+        wall = 0.0
+        latencies = []
+        matched = 0
+        repairs = 0
+        for _ in range(args.repeat):
+            elapsed, run_latencies, results = run_level(pipeline, questions, concurrency)
+            wall += elapsed
+            latencies.extend(run_latencies)
+            for question, result in zip(questions, results):
+                repairs += result.repairs if result is not None else 0
+                predicted = result.statements[0] if result is not None and result.statements else None
+                if execution_match(conn, predicted, question["gold_sql"]):
+                    matched += 1
+                else:
+                    mismatches[question["id"]] = predicted
+
+        answered = len(questions) * args.repeat
+        level = {
+            "concurrency": concurrency,
+            "qps": answered / wall,
+            "latency_ms": percentiles(latencies),
+            "execution_accuracy": matched / answered,
+            "repairs": repairs,
+        }
+        if lexical_router is not None:
+            level["lexical"] = lexical_router.stats()
+            level["lexical_fire_rate"] = level["lexical"]["fire_rate"]
+        if pipeline.speculator is not None:
+            level["speculation"] = pipeline.speculator.stats()
+            pipeline.speculator.close()
+        if model_router is not None:
+            level["router"] = model_router.stats()
+            model_router.close()
+        report["levels"].append(level)
+
+    report["stages"] = {name: {"count": len(values), **percentiles(values)} for name, values in sorted(collector.durations.items())}
+    report["mismatches"] = mismatches
+
+    print(f"\n{len(questions)} questions, latencies: LLM {args.llm_latency}s, query {args.query_latency}s, "
+          f"embeddings {args.embed_latency}s (+/- {args.jitter:.0%})")
+    print("\nStage latency (ms)             count      p50      p90      p99")
+    for name, stats in report["stages"].items():
+        print(f"  {name:<26} {stats['count']:>7} {stats['p50']:>8.1f} {stats['p90']:>8.1f} {stats['p99']:>8.1f}")
+    print("\nConcurrency      QPS   p50 ms   p99 ms   execution accuracy")
+    for level in report["levels"]:
+        print(f"  {level['concurrency']:>9} {level['qps']:>8.2f} {level['latency_ms']['p50']:>8.0f} "
+              f"{level['latency_ms']['p99']:>8.0f}   {level['execution_accuracy']:.1%}")
+    for level in report["levels"]:
+        if "speculation" in level:
+            stats = level["speculation"]
+            print(f"\nSpeculation at concurrency {level['concurrency']}: {stats['used']}/{stats['started']} tasks used, "
+                  f"{stats['cancelled']} cancelled, {stats['wasted']} discarded; saved {stats['saved_seconds']:.1f}s, "
+                  f"wasted {stats['wasted_seconds']:.1f}s and {stats['wasted_prompt_tokens'] + stats['wasted_completion_tokens']} tokens")
+    for level in report["levels"]:
+        if "lexical" in level:
+            print(f"\nAt concurrency {level['concurrency']}:")
+            print_lexical_report(level["lexical"])
+    for level in report["levels"]:
+        if "router" in level:
+            print(f"\nRouter at concurrency {level['concurrency']}:")
+            print_router_report(level["router"])
+    if mismatches:
+        print("\nMismatched questions: " + ", ".join(sorted(mismatches)))
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,168 @@
 from pydantic import BaseModel, Field
 import networkx as nx
-import matplotlib.pyplot as plt
-from typing import List, Tuple, Set, Optional
+from typing import Any, Dict, FrozenSet, List, Literal, Tuple, Set, Optional, Union
+from collections import OrderedDict
+import heapq
+import itertools
+import threading
+from utilities.compiled_graph import CompiledGraph
+from utilities.tracing import tracer
+
+# --------------------------------------JOIN INDEX--------------------------------------
+
+class JoinIndex:
+    def __init__(self, graph: nx.DiGraph, max_exact_terminals: int = 8, cache_size: int = 4096):
+        """
+        Compiled join planner for a schema graph. Built once, it holds the undirected FK graph,
+        the BFS predecessor map of every table already used as a path source (computed on first
+        use, one BFS per source) and a memo of the join trees already solved.
+
+        Args:
+            graph (nx.DiGraph): The FK graph (edge direction: FK table -> PK table).
+            max_exact_terminals (int): Up to this many seed tables the minimum Steiner tree is solved
+                exactly (Dreyfus-Wagner); above it the networkx approximation is used.
+            cache_size (int): Number of seed sets whose join tree is memoized.
+        """
+        self.graph = graph
+        self.max_exact_terminals = max_exact_terminals
+        self.cache_size = cache_size
+
+        self.undirected = nx.Graph(graph.to_undirected())
+        self.undirected.remove_edges_from(list(nx.selfloop_edges(self.undirected)))
+        self._predecessors: Dict[str, Dict[str, Optional[str]]] = {}
+        self._trees: "OrderedDict[FrozenSet[str], List[Tuple[str, str]]]" = OrderedDict()
+        self._trees_lock = threading.Lock()
+
+    def predecessors(self, source: str) -> Dict[str, Optional[str]]:
+        """BFS predecessor of every table reachable from source (None for the source itself)."""
+        predecessors = self._predecessors.get(source)
+        if predecessors is None:
+            predecessors = {source: None}
+            frontier = [source]
+            while frontier:
+                next_frontier = []
+                for u in frontier:
+                    for v in self.undirected.neighbors(u):
+                        if v not in predecessors:
+                            predecessors[v] = u
+                            next_frontier.append(v)
+                frontier = next_frontier
+            # Computed outside any lock: two threads may run the same BFS, the maps are equal
+            self._predecessors[source] = predecessors
+        return predecessors
+
+    def shortest_path(self, source: str, target: str) -> Optional[List[str]]:
+        """Shortest path between two tables, ignoring the FK direction."""
+        if source not in self.undirected:
+            return None
+        predecessors = self.predecessors(source)
+        if target not in predecessors:
+            return None
+        path = [target]
+        while predecessors[path[-1]] is not None:
+            path.append(predecessors[path[-1]])
+        return path[::-1]
+
+    def join_edge(self, u: str, v: str) -> Tuple[str, str, str]:
+        """The (source_table, join_column, target_table) tuple of an undirected edge, in FK direction."""
+        if self.graph.has_edge(u, v):
+            data = self.graph.get_edge_data(u, v)
+            return (u, data.get("on_column", data.get("predicate", "")), v)
+        data = self.graph.get_edge_data(v, u)
+        return (v, data.get("on_column", data.get("predicate", "")), u)
+
+    def steiner_tree(self, seeds: FrozenSet[str]) -> List[Tuple[str, str]]:
+        """
+        Smallest join tree connecting the seed tables, as a list of undirected edges.
+        Seeds in different connected components get one tree per component.
+        """
+        with self._trees_lock:
+            if seeds in self._trees:
+                self._trees.move_to_end(seeds)
+                return self._trees[seeds]
+
+        edges = []
+        terminals = sorted(seed for seed in seeds if seed in self.undirected)
+        components = {}
+        for terminal in terminals:
+            root = min(self.predecessors(terminal))
+            components.setdefault(root, []).append(terminal)
+
+        for component in components.values():
+            if len(component) == 2:
+                path = self.shortest_path(component[0], component[1])
+                edges.extend(zip(path, path[1:]))
+            elif len(component) > 2 and len(component) <= self.max_exact_terminals:
+                edges.extend(self._dreyfus_wagner(component))
+            elif len(component) > 2:
+                tree = nx.algorithms.approximation.steiner_tree(self.undirected, component)
+                edges.extend(sorted(tree.edges()))
+
+        # Solved outside the lock: two threads may solve the same seeds, the trees are equal
+        with self._trees_lock:
+            self._trees[seeds] = edges
+            self._trees.move_to_end(seeds)
+            if len(self._trees) > self.cache_size:
+                self._trees.popitem(last=False)
+        return edges
+
+    def _dreyfus_wagner(self, terminals: List[str]) -> List[Tuple[str, str]]:
+        # dp[mask][v]: size of the smallest tree spanning the terminals in mask plus node v
+        full = (1 << len(terminals)) - 1
+        dp = [dict() for _ in range(full + 1)]
+        parent = [dict() for _ in range(full + 1)]
+
+        for i, terminal in enumerate(terminals):
+            dp[1 << i][terminal] = 0
+            parent[1 << i][terminal] = ("leaf", None)
+
+        for mask in range(1, full + 1):
+            # Merge two subtrees meeting at v
+            if mask & (mask - 1):
+                sub = (mask - 1) & mask
+                while sub:
+                    other = mask ^ sub
+                    if sub < other:
+                        # Only the nodes both subtrees reach can join them
+                        for v, sub_cost in dp[sub].items():
+                            if v in dp[other]:
+                                cost = sub_cost + dp[other][v]
+                                if cost < dp[mask].get(v, float("inf")):
+                                    dp[mask][v] = cost
+                                    parent[mask][v] = ("split", sub)
+                    sub = (sub - 1) & mask
+
+            # Grow the trees along the graph edges (Dijkstra with unit weights)
+            counter = itertools.count()
+            heap = [(cost, next(counter), v) for v, cost in dp[mask].items()]
+            heapq.heapify(heap)
+            while heap:
+                cost, _, u = heapq.heappop(heap)
+                if cost > dp[mask][u]:
+                    continue
+                for v in self.undirected.neighbors(u):
+                    if cost + 1 < dp[mask].get(v, float("inf")):
+                        dp[mask][v] = cost + 1
+                        parent[mask][v] = ("edge", u)
+                        heapq.heappush(heap, (cost + 1, next(counter), v))
+
+        edges = []
+        stack = [(full, terminals[0])]
+        while stack:
+            mask, v = stack.pop()
+            kind, value = parent[mask][v]
+            if kind == "split":
+                stack.append((value, v))
+                stack.append((mask ^ value, v))
+            elif kind == "edge":
+                edges.append((value, v))
+                stack.append((mask, value))
+
+        # Ties can make two subtrees share an edge; keep each edge once
+        unique = {}
+        for u, v in edges:
+            unique.setdefault(frozenset((u, v)), (u, v))
+        return list(unique.values())
 
 # --------------------------------------KNOWLEDGE GRAPH--------------------------------------
 
@@ -17,14 +178,36 @@ class Knowledge_Graph:
                 (source_table, target_table, fk_column_name) representing foreign key
                 relationships. The edge direction is from FK table (source) to PK table (target).
         """
-        self.graph = nx.DiGraph()
-        self.graph.graph['name'] = 'Database Schema Knowledge Graph'
+        self._graph = nx.DiGraph()
+        self._graph.graph['name'] = 'Database Schema Knowledge Graph'
+        self._compiled = None
+        self._join_index = None
 
         if table_names:
             self.add_nodes_from(table_names)
         if fk_relationships:
             self._add_fk_edges(fk_relationships) # Internal method to add FKs
 
+    @property
+    def graph(self) -> nx.DiGraph:
+        """The networkx graph; materialized on first use when loaded from a compiled (.kgb) file."""
+        if self._graph is None:
+            self._graph = self._compiled.to_networkx()
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph: nx.DiGraph):
+        self._graph = graph
+        self._compiled = None
+        self._join_index = None
+
+    @property
+    def compiled(self) -> CompiledGraph:
+        """The array-backed (CSR) form of the graph, rebuilt only after the graph changes."""
+        if self._compiled is None:
+            self._compiled = CompiledGraph.from_networkx(self.graph)
+        return self._compiled
+
     def add_node(self, node: str, **attributes):
         """
         Add a node to the graph with optional attributes.
@@ -37,6 +220,8 @@ class Knowledge_Graph:
             print(f"Warning: Node name must be a non-empty string. Skipping node: {node}")
             return
         self.graph.add_node(node, **attributes)
+        self._compiled = None
+        self._join_index = None
 
     def add_nodes_from(self, nodes: List[str]):
         """
@@ -67,6 +252,8 @@ class Knowledge_Graph:
             self.add_node(target)
 
         self.graph.add_edge(source, target, predicate=predicate, **attributes)
+        self._compiled = None
+        self._join_index = None
 
     def _add_fk_edges(self, fk_relationships: List[Tuple[str, str, str]]):
         """
@@ -108,22 +295,14 @@ class Knowledge_Graph:
         Returns:
             Set[str]: A set of unique connected table names.
         """
-        connected_nodes = set()
-        
+        compiled = self.compiled
+
         for start_node in start_nodes:
-            if start_node not in self.graph:
+            if start_node not in compiled:
                 print(f"Warning: Start node '{start_node}' not found in the graph. Skipping.")
-                continue
-            
-            # BFS in forward direction (FK to PK)
-            for node in nx.bfs_tree(self.graph, start_node, depth_limit=max_depth):
-                connected_nodes.add(node)
-            
-            # BFS in reverse direction (PK to FK) to get tables that *reference* the start_node
-            for node in nx.bfs_tree(self.graph.reverse(), start_node, depth_limit=max_depth):
-                connected_nodes.add(node)
-                
-        return connected_nodes
+
+        # Multi-source BFS over the CSR arrays, forward (FK to PK) and reverse (PK to FK)
+        return compiled.find_connected(start_nodes, max_depth)
 
     
     def get_subgraph(self, nodes_list: List[str]) -> nx.DiGraph:
@@ -149,6 +328,12 @@ class Knowledge_Graph:
             with_labels (bool): Whether to draw node labels.
             title (Optional[str]): Title for the plot.
         """
+        # matplotlib is only needed here, and takes longer to import than the rest of the pipeline
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            raise ImportError("draw_graph needs matplotlib: pip install matplotlib")
+
         plt.figure(figsize=(12, 8))
 
         if layout == 'spring':
@@ -183,7 +368,7 @@ class Knowledge_Graph:
 
     def save_graph(self, file_path: str):
         """
-        Saves the graph to a file (e.g., .gml, .graphml, .gpickle).
+        Saves the graph to a file (e.g., .gml, .graphml, .gpickle, or the compiled binary .kgb).
 
         Args:
             file_path (str): The path to save the graph file.
@@ -195,67 +380,70 @@ class Knowledge_Graph:
                 nx.write_graphml(self.graph, file_path)
             elif file_path.endswith('.gpickle'):
                 nx.write_gpickle(self.graph, file_path)
+            elif file_path.endswith('.kgb'):
+                self.compiled.save(file_path)
             else:
-                print("Unsupported file format. Please use .gml, .graphml, or .gpickle.")
+                print("Unsupported file format. Please use .gml, .graphml, .gpickle, or .kgb.")
                 return
             print(f"Graph saved to {file_path}")
         except Exception as e:
             print(f"Error saving graph: {e}")
     
+    @property
+    def join_index(self) -> JoinIndex:
+        """The compiled join planner of the graph, rebuilt only after the graph changes."""
+        if self._join_index is None:
+            self._join_index = JoinIndex(self.graph)
+        return self._join_index
+
     def validate_path(self, nodes_list: List[str]) :
         """
         Validates that the given list of tables can be joined together using the knowledge graph.
 
         Returns a list of join tuples (source_table, join_column, target_table) for the minimum
-        required join path. This will include only mediator tables that are essential for joins.
+        required join path. This is the minimum Steiner tree connecting the seed tables, so it
+        will include only mediator tables that are essential for joins.
 
         Args:
             nodes_list (List[str]): List of seed  tables.
 
         Returns:
+            List[List[str]]: Path from the first seed table to each other seed table, along the join tree.
             List[Tuple[str, str, str]]: List of join relationships required to connect all tables.
             ** If a new table is added, then it will automatically be added in the path list.
         """
+        with tracer.span("validate_path", seeds=len(nodes_list)):
+            return self._validate_path(nodes_list)
+
+    def _validate_path(self, nodes_list: List[str]):
         if len(nodes_list) < 2:
-            return []
+            return [], []
+
+        for node in nodes_list:
+            if node not in self.graph:
+                print(f"Warning: Table '{node}' not found in the graph. Skipping.")
+
+        seeds = [node for node in dict.fromkeys(nodes_list) if node in self.graph]
+        tree_edges = self.join_index.steiner_tree(frozenset(seeds))
+        required_joins = [self.join_index.join_edge(u, v) for u, v in tree_edges]
 
-        required_joins = set()
+        # Paths from the first seed to the others, inside the join tree
+        tree = nx.Graph(tree_edges)
+        tree.add_nodes_from(seeds)
         paths = []
-        subgraph = self.get_subgraph(nodes_list)
-
-        for i in range(len(nodes_list)):
-            for j in range(i + 1, len(nodes_list)):
-                source = nodes_list[i]
-                target = nodes_list[j]
-                try:
-                    path = nx.shortest_path(subgraph.to_undirected(), source, target)
-                    paths.append(path)
-                except (nx.NetworkXNoPath, nx.NodeNotFound):
-                    try:
-                        path = nx.shortest_path(self.graph.to_undirected() , source, target)
-                        paths.append(path)
-                    except(nx.NetworkXNoPath, nx.NodeNotFound):
-                        print(f"No path found between {source} and {target} in either subgraph or whole graph")
-
-                # Convert path like [a, b, c] to [(a,b), (b,c)]
-                for u, v in zip(path, path[1:]):
-                    if self.graph.has_edge(u, v):
-                        data = self.graph.get_edge_data(u, v)
-                        join_col = data.get("on_column", data.get("predicate", ""))
-                        required_joins.add((u, join_col, v))
-                    elif self.graph.has_edge(v, u):
-                        data = self.graph.get_edge_data(v, u)
-                        join_col = data.get("on_column", data.get("predicate", ""))
-                        required_joins.add((v, join_col, u))
-                    else:
-                        continue  # Not a valid edge
-
-        return paths , list(required_joins)
+        for target in seeds[1:]:
+            try:
+                paths.append(nx.shortest_path(tree, seeds[0], target))
+            except nx.NetworkXNoPath:
+                print(f"No path found between {seeds[0]} and {target} in the whole graph")
+
+        return paths , required_joins
 
     @classmethod
     def load_graph(cls, file_path: str):
         """
         Loads a graph from a file and returns a new Knowledge_Graph instance.
+        A compiled .kgb file is memory-mapped instead of parsed.
 
         Args:
             file_path (str): The path to the graph file.
@@ -271,8 +459,15 @@ class Knowledge_Graph:
                 kg.graph = nx.read_graphml(file_path)
             elif file_path.endswith('.gpickle'):
                 kg.graph = nx.read_gpickle(file_path)
+            elif file_path.endswith('.kgb'):
+                # Memory-mapped; the networkx graph and join index are only built when first needed
+                kg._graph = None
+                kg._compiled = CompiledGraph.load(file_path)
+                print(f"Graph loaded from {file_path}")
+                return kg
             else:
-                raise ValueError("Unsupported file format. Please use .gml, .graphml, or .gpickle.")
+                raise ValueError("Unsupported file format. Please use .gml, .graphml, .gpickle, or .kgb.")
+            kg._join_index = JoinIndex(kg.graph)
             print(f"Graph loaded from {file_path}")
             return kg
         except Exception as e:
@@ -291,6 +486,80 @@ class RelevantColumns(BaseModel):
     
 class RelevantColumnsOutput(BaseModel):
     relevant_columns : List[RelevantColumns] = Field(..., description= "A list of relevant columns identified from the context")
-    
-    
-    
+
+class ExecutionResult(BaseModel):
+    sql: str = Field(description = "The executed statement")
+    columns: List[str] = Field(default_factory=list, description = "Names of the result columns")
+    rows: List[List[Any]] = Field(default_factory=list, description = "The returned rows (at most max_rows)")
+    row_count: int = Field(default = 0, description = "Number of returned rows")
+    truncated: bool = Field(default = False, description = "Whether the query had more rows than max_rows")
+    seconds: float = Field(default = 0.0, description = "Execution time, waiting for a connection included")
+    error: Optional[str] = Field(default = None, description = "Why the statement was rejected, timed out or failed")
+
+class PipelineResult(BaseModel):
+    question: str = Field(description = "The natural language question asked by the user")
+    broad_tables: List[str] = Field(default_factory=list, description = "Broadly relevant tables identified by Level 1")
+    seed_tables: List[str] = Field(default_factory=list, description = "The most crucial tables for the question")
+    join_paths: List[List[str]] = Field(default_factory=list, description = "Table paths found between the seed tables")
+    relationships: List[str] = Field(default_factory=list, description = "Foreign key relationships required for the joins")
+    tables: List[str] = Field(default_factory=list, description = "Tables with at least one relevant column")
+    columns: List[str] = Field(default_factory=list, description = "Final filtered columns with their reasons")
+    sql: str = Field(default = "", description = "The generated SQL query (raw model output)")
+    from_cache: bool = Field(default = False, description = "Whether the result was served from the answer cache")
+    fast_path: bool = Field(default = False, description = "Whether the tables were proposed by the lexical fast path")
+    statements: List[str] = Field(default_factory=list, description = "The SQL statements separated from the model output")
+    validation_errors: List[str] = Field(default_factory=list, description = "Errors of the SQL still found by the validator after the repairs")
+    repairs: int = Field(default = 0, description = "Times the query generation was re-run to fix validation errors")
+    execution: List[ExecutionResult] = Field(default_factory=list, description = "Results of the statements on the database (when executed)")
+    database: Optional[str] = Field(default = None, description = "The database (schema bundle) the question was answered on")
+
+# ----------------------------------------PIPELINE EVENTS-------------------------------------------
+# Yielded in this order by NLToSQLPipeline.astream (a cached answer only yields the result)
+
+class ChunksEvent(BaseModel):
+    event: Literal["chunks"] = "chunks"
+    chunks: List[str] = Field(description = "Overview chunks retrieved for Level 1")
+
+class BroadTablesEvent(BaseModel):
+    event: Literal["broad_tables"] = "broad_tables"
+    tables: List[str] = Field(description = "Broadly relevant tables")
+
+class SeedTablesEvent(BaseModel):
+    event: Literal["seed_tables"] = "seed_tables"
+    tables: List[str] = Field(description = "The most crucial tables for the question")
+    fast_path: bool = Field(default = False, description = "Whether the tables were proposed by the lexical fast path")
+
+class JoinPathsEvent(BaseModel):
+    event: Literal["join_paths"] = "join_paths"
+    paths: List[List[str]] = Field(description = "Table paths found between the seed tables")
+    relationships: List[str] = Field(description = "Foreign key relationships required for the joins")
+    tables: List[str] = Field(description = "Tables whose columns are extracted next")
+
+class TableColumnsEvent(BaseModel):
+    event: Literal["table_columns"] = "table_columns"
+    table: str = Field(description = "The table processed by Level 2")
+    columns: List[RelevantColumns] = Field(description = "Its relevant columns")
+
+class FilteredColumnsEvent(BaseModel):
+    event: Literal["filtered_columns"] = "filtered_columns"
+    columns: List[str] = Field(description = "Final filtered columns with their reasons")
+
+class SQLTokenEvent(BaseModel):
+    event: Literal["sql_token"] = "sql_token"
+    text: str = Field(description = "Next piece of the query model output")
+
+class SQLStatementEvent(BaseModel):
+    event: Literal["sql_statement"] = "sql_statement"
+    sql: str = Field(description = "A complete SQL statement, emitted as soon as it is closed")
+
+class SQLRepairEvent(BaseModel):
+    event: Literal["sql_repair"] = "sql_repair"
+    attempt: int = Field(description = "Number of the repair (the query model output streamed next replaces the previous one)")
+    errors: List[str] = Field(description = "Validation errors of the previous query")
+
+class ResultEvent(BaseModel):
+    event: Literal["result"] = "result"
+    result: PipelineResult
+
+PipelineEvent = Union[ChunksEvent, BroadTablesEvent, SeedTablesEvent, JoinPathsEvent, TableColumnsEvent,
+                      FilteredColumnsEvent, SQLTokenEvent, SQLStatementEvent, SQLRepairEvent, ResultEvent]
@@ -0,0 +1,362 @@
+from RAG_pipeline import (NLToSQLPipeline, add_execution_arguments, create_executor, add_validation_arguments, create_validator,
+                          add_router_arguments, create_model_router, add_schema_arguments, create_schema_registry)
+from model import PipelineResult, ResultEvent
+from utilities.schema_bundles import UnknownSchemaError
+from utilities.tracing import tracer
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import re
+
+# Largest request body accepted (a question, not a document)
+MAX_BODY_BYTES = 64 * 1024
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+                429: "Too Many Requests", 500: "Internal Server Error", 504: "Gateway Timeout"}
+
+
+def normalize_question(question: str) -> str:
+    """The key of a question for coalescing: case, spacing and trailing punctuation do not matter."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.! ").lower()
+
+
+class Saturated(Exception):
+    """The admission queue is full."""
+
+
+class Reservation:
+    def __init__(self, queue: "AdmissionQueue"):
+        """A place in the admission queue, held from admission until the run gets a slot (or is dropped)."""
+        self.queue = queue
+        self.active = True
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self.queue.waiting -= 1
+
+
+class AdmissionQueue:
+    def __init__(self, max_running: int, max_waiting: int):
+        """
+        Bounds the pipeline runs: max_running run at once, max_waiting more wait for a slot, and
+        anything beyond is refused at once (HTTP 429) instead of piling up behind the LLM calls.
+        """
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_running)
+
+    def reserve(self) -> Reservation:
+        if self.running + self.waiting >= self.max_running + self.max_waiting:
+            raise Saturated()
+        self.waiting += 1
+        return Reservation(self)
+
+    @asynccontextmanager
+    async def slot(self, reservation: Reservation):
+        try:
+            await self._slots.acquire()
+        finally:
+            reservation.release()
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+
+class Flight:
+    def __init__(self, task: asyncio.Task):
+        """One pipeline run and the number of requests waiting for its result."""
+        self.task = task
+        self.waiters = 0
+
+
+class NLToSQLService:
+    def __init__(self, pipeline: NLToSQLPipeline, max_running: int = 4, max_waiting: int = 32,
+                 default_deadline: float = 30.0, max_deadline: float = 120.0):
+        """
+        Serves the pipeline to concurrent requests on one event loop. Identical questions (after
+        normalize_question) asked while a run is in flight join that run and all get its result
+        (single flight). New runs go through a bounded admission queue, and every request has a
+        deadline; a run nobody waits for any more is cancelled.
+
+        Args:
+            pipeline (NLToSQLPipeline): The pipeline, run through astream so a run can be cancelled.
+            max_running (int): Pipeline runs at once.
+            max_waiting (int): Runs waiting for a slot before new questions get a 429.
+            default_deadline (float): Seconds a request waits for its answer when it does not say.
+            max_deadline (float): Upper bound of the deadline a request may ask for.
+        """
+        self.pipeline = pipeline
+        self.admission = AdmissionQueue(max_running, max_waiting)
+        self.default_deadline = default_deadline
+        self.max_deadline = max_deadline
+        self.flights: Dict[str, Flight] = {}
+        self.counters = defaultdict(int)
+
+    async def _run(self, question: str, database: str, reservation: Reservation) -> PipelineResult:
+        async with self.admission.slot(reservation):
+            self.counters["runs"] += 1
+            stream = self.pipeline.astream(question, database)
+            try:
+                async for event in stream:
+                    if isinstance(event, ResultEvent):
+                        return event.result
+            finally:
+                await stream.aclose()
+        raise RuntimeError("The pipeline ended without a result")
+
+    def _start(self, key: str, question: str, database: str) -> Flight:
+        reservation = self.admission.reserve()
+        flight = Flight(asyncio.create_task(self._run(question, database, reservation)))
+        self.flights[key] = flight
+
+        def _landed(task):
+            # A task cancelled before it started never reached the slot
+            reservation.release()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            if not task.cancelled():
+                task.exception()  # Retrieved here, so an abandoned failed run is not logged as unhandled
+
+        flight.task.add_done_callback(_landed)
+        return flight
+
+    async def answer(self, question: str, deadline: Optional[float] = None,
+                     database: Optional[str] = None) -> Tuple[PipelineResult, bool]:
+        """
+        The result of a question on a database (the default one if None), from the run already in
+        flight for the same question on the same database if there is one.
+
+        Returns:
+            Tuple: (result, whether the request joined another request's run)
+
+        Raises:
+            Saturated: The admission queue is full.
+            asyncio.TimeoutError: No result within the deadline.
+            UnknownSchemaError: The pipeline has no such database.
+        """
+        # Resolving the name can load the bundle from disk, keep it off the event loop
+        database = (await asyncio.to_thread(self.pipeline.schemas.get, database)).name
+        key = f"{database}:{normalize_question(question)}"
+        flight = self.flights.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.counters["coalesced"] += 1
+        else:
+            flight = self._start(key, question, database)
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.wait_for(asyncio.shield(flight.task), deadline or self.default_deadline)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self.counters["cancelled_runs"] += 1
+                flight.task.cancel()
+        return result, coalesced
+
+    # -----------------------------------------HTTP--------------------------------------------------
+
+    async def handle_query(self, body: bytes) -> Tuple[int, dict]:
+        try:
+            request = json.loads(body or b"{}")
+            question = request["question"]
+            if not isinstance(question, str) or not question.strip():
+                raise ValueError("question must be a non-empty string")
+            deadline = min(float(request.get("timeout") or self.default_deadline), self.max_deadline)
+            database = request.get("database")
+            if database is not None and not isinstance(database, str):
+                raise ValueError("database must be a string")
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": f"Expected a JSON body {{\"question\": ..., \"database\": name, \"timeout\": seconds}} ({e})"}
+
+        try:
+            result, coalesced = await self.answer(question, deadline, database)
+        except UnknownSchemaError as e:
+            return 404, {"error": str(e)}
+        except Saturated:
+            return 429, {"error": "Too many questions in flight, retry later"}
+        except asyncio.TimeoutError:
+            return 504, {"error": f"No answer within {deadline}s"}
+        except Exception as e:
+            print(f"[ERROR] Pipeline failed for question: {question}\n{e}")
+            return 500, {"error": str(e)}
+        return 200, {**result.model_dump(), "question": question, "coalesced": coalesced}
+
+    def health(self) -> dict:
+        schemas = self.pipeline.schemas.stats()
+        return {
+            "status": "ok",
+            "databases": schemas["databases"],
+            "loaded_databases": schemas["resident"],
+            "in_flight": len(self.flights),
+            "running": self.admission.running,
+            "waiting": self.admission.waiting,
+            "max_running": self.admission.max_running,
+            "max_waiting": self.admission.max_waiting,
+        }
+
+    def render_metrics(self) -> str:
+        """The request metrics of the service, followed by the stage metrics of the tracer."""
+        lines = ["# HELP nl2sql_requests_total Requests answered, by route and HTTP status.",
+                 "# TYPE nl2sql_requests_total counter"]
+        for name, value in sorted(self.counters.items()):
+            if name.startswith("requests:"):
+                _, route, status = name.split(":")
+                lines.append(f'nl2sql_requests_total{{route="{route}",status="{status}"}} {value}')
+        for metric, key, help_text in (
+            ("nl2sql_runs_total", "runs", "Pipeline runs started."),
+            ("nl2sql_coalesced_total", "coalesced", "Requests answered by the run of an identical question."),
+            ("nl2sql_cancelled_runs_total", "cancelled_runs", "Runs cancelled because every request gave up."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {self.counters[key]}"]
+        schemas = self.pipeline.schemas.stats()
+        for metric, key, kind, help_text in (
+            ("nl2sql_schema_loads_total", "loads", "counter", "Schema bundles loaded (again after an eviction)."),
+            ("nl2sql_schema_evictions_total", "evictions", "counter", "Schema bundles unloaded to stay within the memory budget."),
+            ("nl2sql_schema_resident_bytes", "resident_bytes", "gauge", "Measured memory footprint of the loaded schema bundles."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric} {schemas[key]}"]
+        health = self.health()
+        for metric, key, help_text in (
+            ("nl2sql_in_flight", "in_flight", "Distinct questions in flight."),
+            ("nl2sql_running", "running", "Pipeline runs holding a slot."),
+            ("nl2sql_waiting", "waiting", "Pipeline runs waiting for a slot."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {health[key]}"]
+        return "\n".join(lines) + "\n" + tracer.render_prometheus()
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, str, bytes]:
+        """(status, content type, body) of a request."""
+        routes = {"/query": "POST", "/health": "GET", "/metrics": "GET"}
+        path = path.split("?", 1)[0]
+        if path not in routes:
+            status, payload = 404, {"error": f"Unknown route {path}"}
+        elif method != routes[path]:
+            status, payload = 405, {"error": f"{path} expects {routes[path]}"}
+        elif path == "/metrics":
+            self.counters[f"requests:{path}:200"] += 1
+            return 200, "text/plain; version=0.0.4", self.render_metrics().encode("utf-8")
+        elif path == "/health":
+            status, payload = 200, self.health()
+        else:
+            status, payload = await self.handle_query(body)
+        self.counters[f"requests:{path}:{status}"] += 1
+        return status, "application/json", json.dumps(payload, default=str).encode("utf-8")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One HTTP/1.1 request per connection (the response closes it)."""
+        try:
+            try:
+                method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    status, content_type, body = 413, "application/json", b'{"error": "Request body too large"}'
+                else:
+                    status, content_type, body = await self.route(method.upper(), path, await reader.readexactly(length))
+            except (ValueError, asyncio.IncompleteReadError):
+                status, content_type, body = 400, "application/json", b'{"error": "Malformed HTTP request"}'
+
+            head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", f"Content-Type: {content_type}",
+                    f"Content-Length: {len(body)}", "Connection: close"]
+            if status == 429:
+                head.append("Retry-After: 1")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass  # The client went away
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "0.0.0.0", port: int = 8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port} (POST /query, GET /health, GET /metrics)")
+        async with server:
+            await server.serve_forever()
+
+
+def create_fake_pipeline(args) -> NLToSQLPipeline:
+    """A pipeline on the offline benchmark's fake models, fake embeddings and SQLite bike_store (no API key)."""
+    from benchmark.fakes import FakeEmbeddings, OracleResponder, make_models
+    from benchmark.run_benchmark import build_workspace
+    from model import Knowledge_Graph
+    from utilities.generate_embeddings.generate_db import configure_backend
+    from utilities.sql_executor import SQLExecutor, SQLiteAdapter
+
+    with open(args.fake_questions, "r", encoding="utf-8") as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+
+    embeddings = FakeEmbeddings(latency=args.fake_embed_latency)
+    catalog = build_workspace(args.work_dir, "docs", embeddings, scale=1.0, seed=0)
+    configure_backend("numpy", os.path.join(args.work_dir, "numpy_index"), embeddings=embeddings)
+
+    graph = Knowledge_Graph.load_graph("knowledge_graph.gml").graph
+    neighbours = {table: sorted(set(graph.successors(table)) | set(graph.predecessors(table)) - {table}) for table in graph.nodes}
+    models = make_models(OracleResponder(questions, catalog, neighbours), args.fake_llm_latency, args.fake_query_latency, 0.2)
+    executor = SQLExecutor(SQLiteAdapter(os.path.join(args.work_dir, "bike_store.sqlite")), pool_size=args.max_running)
+    return NLToSQLPipeline(verbose=False, max_concurrency=args.max_concurrency,
+                           embedding_cache_path=os.path.join(args.work_dir, "embedding_cache.sqlite"), embeddings=embeddings,
+                           executor=executor, validator=create_validator(args), max_repairs=args.max_repairs, **models)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the NL-to-SQL pipeline over HTTP.")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--max-running", type=int, default=4, help="Pipeline runs at once")
+    parser.add_argument("--max-waiting", type=int, default=32, help="Runs waiting for a slot before new questions get a 429")
+    parser.add_argument("--deadline", type=float, default=30.0, help="Seconds a request waits for its answer by default")
+    parser.add_argument("--max-deadline", type=float, default=120.0, help="Largest deadline a request may ask for")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Tables processed in parallel in Level 2")
+    parser.add_argument("--trace-dir", default=None, help="Also write the JSON trace of every question to this directory")
+    parser.add_argument("--fake", action="store_true", help="Serve the offline benchmark's fake models and SQLite bike_store")
+    parser.add_argument("--fake-questions", default="benchmark/questions.jsonl", help="Questions the fake models can answer")
+    parser.add_argument("--work-dir", default="db/bench", help="Directory of the fake mode's SQLite database and indexes")
+    parser.add_argument("--fake-llm-latency", type=float, default=0.3, help="Seconds per structured LLM call in fake mode")
+    parser.add_argument("--fake-query-latency", type=float, default=1.5, help="Seconds per SQL generation call in fake mode")
+    parser.add_argument("--fake-embed-latency", type=float, default=0.05, help="Seconds per embedding call in fake mode")
+    add_execution_arguments(parser)
+    add_validation_arguments(parser)
+    add_router_arguments(parser)
+    add_schema_arguments(parser)
+    args = parser.parse_args()
+
+    # The stage metrics of /metrics come from the tracing spans
+    tracer.configure(enabled=True, trace_dir=args.trace_dir, metrics_path=None)
+
+    if args.fake:
+        pipeline = create_fake_pipeline(args)
+    else:
+        # With --schemas, every request may name its database, and every database has its own executor and validator
+        schemas = create_schema_registry(args)
+        pipeline = NLToSQLPipeline(verbose=False, max_concurrency=args.max_concurrency,
+                                   executor=create_executor(args) if schemas is None else None,
+                                   validator=create_validator(args) if schemas is None else None,
+                                   max_repairs=args.max_repairs, model_router=create_model_router(args), schemas=schemas)
+
+    service = NLToSQLService(pipeline, max_running=args.max_running, max_waiting=args.max_waiting,
+                             default_deadline=args.deadline, max_deadline=args.max_deadline)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
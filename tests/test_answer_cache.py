@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from utilities.answer_cache import DEFAULT_WATCH_PATHS, REPO_DIR, SemanticAnswerCache
+
+
+@pytest.fixture
+def watched(tmp_path):
+    kg = tmp_path / "knowledge_graph.gml"
+    kg.write_text("graph []")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "orders.md").write_text("# orders")
+    return kg, docs
+
+
+def make_cache(tmp_path, watched, **kwargs):
+    return SemanticAnswerCache(str(tmp_path / "cache.sqlite"), watch_paths=watched, **kwargs)
+
+
+def test_default_watch_paths_do_not_depend_on_the_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = SemanticAnswerCache(str(tmp_path / "cache.sqlite"))
+    assert cache.watch_paths == list(DEFAULT_WATCH_PATHS)
+    assert all(path.startswith(REPO_DIR) for path in cache.watch_paths)
+    cache.close()
+
+
+def test_relative_watch_paths_are_resolved_once(tmp_path, watched, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = make_cache(tmp_path, ("knowledge_graph.gml", "docs"))
+    assert cache.watch_paths == [str(path) for path in watched]
+    cache.close()
+
+
+def test_docs_change_clears_the_cache(tmp_path, watched):
+    cache = make_cache(tmp_path, watched, check_interval=0)
+    cache.store("how many orders", [1.0, 0.0], {"sql": "SELECT COUNT(*) FROM orders"})
+    assert cache.lookup([1.0, 0.0]) == {"sql": "SELECT COUNT(*) FROM orders"}
+
+    (watched[1] / "customers.md").write_text("# customers")
+    assert cache.lookup([1.0, 0.0]) is None
+    assert cache.stats()["entries"] == 0
+    cache.close()
+
+
+def test_fingerprint_check_is_throttled(tmp_path, watched, monkeypatch):
+    cache = make_cache(tmp_path, watched, check_interval=60)
+    cache.store("how many orders", [1.0, 0.0], {"sql": "SELECT COUNT(*) FROM orders"})
+
+    walks = []
+    monkeypatch.setattr(os, "walk", lambda *args, **kwargs: walks.append(args) or iter(()))
+    for _ in range(5):
+        assert cache.lookup([1.0, 0.0]) is not None
+    assert walks == []
+    cache.close()
@@ -0,0 +1,72 @@
+import os
+
+import networkx as nx
+import pytest
+
+from model import Knowledge_Graph
+from utilities.compiled_graph import CompiledGraph
+
+KG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge_graph.gml")
+
+
+def random_schema(seed: int, nodes: int = 12, p: float = 0.15) -> nx.DiGraph:
+    graph = nx.gnp_random_graph(nodes, p, seed=seed, directed=True)
+    graph = nx.relabel_nodes(graph, {node: f"t{node}" for node in graph})
+    for u, v in graph.edges:
+        graph.edges[u, v]["on_column"] = f"{v}_id"
+    graph.graph["name"] = f"schema {seed}"
+    return graph
+
+
+def old_find_connected_tables(graph: nx.DiGraph, start_nodes, max_depth=None):
+    # find_connected_tables before the graph was compiled: one networkx BFS per start node and direction
+    connected_nodes = set()
+    for start_node in start_nodes:
+        if start_node not in graph:
+            continue
+        connected_nodes.update(nx.bfs_tree(graph, start_node, depth_limit=max_depth))
+        connected_nodes.update(nx.bfs_tree(graph.reverse(), start_node, depth_limit=max_depth))
+    return connected_nodes
+
+
+def assert_same_graph(actual: nx.DiGraph, expected: nx.DiGraph):
+    assert list(actual.nodes) == list(expected.nodes)
+    assert sorted(actual.edges(data=True)) == sorted(expected.edges(data=True))
+    assert actual.graph.get("name") == expected.graph.get("name")
+
+
+def test_gml_kgb_round_trip(tmp_path):
+    gml = Knowledge_Graph.load_graph(KG_FILE)
+    kgb_file = str(tmp_path / "knowledge_graph.kgb")
+    gml.save_graph(kgb_file)
+
+    kgb = Knowledge_Graph.load_graph(kgb_file)
+    assert kgb.compiled.nbytes() == gml.compiled.nbytes()
+    assert_same_graph(kgb.graph, gml.graph)
+    assert kgb.validate_path(["customers", "products"]) == gml.validate_path(["customers", "products"])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_graph_round_trip(tmp_path, seed):
+    graph = random_schema(seed)
+    file_path = str(tmp_path / "schema.kgb")
+    CompiledGraph.from_networkx(graph).save(file_path)
+    assert_same_graph(CompiledGraph.load(file_path).to_networkx(), graph)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_depth", [None, 0, 1, 2])
+def test_compiled_bfs_matches_networkx(seed, max_depth):
+    graph = random_schema(seed)
+    kg = Knowledge_Graph()
+    kg.graph = graph
+    nodes = list(graph.nodes)
+    for start_nodes in ([nodes[0]], nodes[:3], [nodes[-1], "missing"], ["missing"]):
+        assert kg.find_connected_tables(start_nodes, max_depth) == old_find_connected_tables(graph, start_nodes, max_depth)
+
+
+def test_compiled_bfs_on_the_schema():
+    kg = Knowledge_Graph.load_graph(KG_FILE)
+    for table in kg.graph.nodes:
+        for max_depth in (None, 1, 2):
+            assert kg.find_connected_tables([table], max_depth) == old_find_connected_tables(kg.graph, [table], max_depth)
@@ -0,0 +1,68 @@
+import itertools
+import random
+
+import networkx as nx
+import pytest
+
+from model import JoinIndex
+
+
+def random_schema(seed: int, nodes: int = 9, p: float = 0.3) -> nx.DiGraph:
+    graph = nx.gnp_random_graph(nodes, p, seed=seed, directed=True)
+    return nx.relabel_nodes(graph, {node: f"t{node}" for node in graph})
+
+
+def brute_force_steiner_size(graph: nx.Graph, terminals) -> int:
+    """Fewest edges of a tree spanning the terminals: the smallest connected node set containing them, minus one."""
+    others = [node for node in graph if node not in terminals]
+    for extra in range(len(others) + 1):
+        for chosen in itertools.combinations(others, extra):
+            if nx.is_connected(graph.subgraph(list(terminals) + list(chosen))):
+                return len(terminals) + extra - 1
+    raise AssertionError("terminals are not connected")
+
+
+def assert_spanning_tree(edges, terminals):
+    tree = nx.Graph(edges)
+    tree.add_nodes_from(terminals)
+    assert nx.is_tree(tree)
+    assert set(terminals) <= set(tree)
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_steiner_tree_is_optimal(seed):
+    graph = random_schema(seed)
+    index = JoinIndex(graph)
+    component = max(nx.connected_components(index.undirected), key=len)
+    rng = random.Random(seed)
+    for size in range(2, min(6, len(component)) + 1):
+        terminals = rng.sample(sorted(component), size)
+        edges = index.steiner_tree(frozenset(terminals))
+        assert_spanning_tree(edges, terminals)
+        assert len(edges) == brute_force_steiner_size(index.undirected, terminals)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_shortest_paths_are_computed_per_source(seed):
+    graph = random_schema(seed)
+    index = JoinIndex(graph)
+    assert index._predecessors == {}
+
+    lengths = dict(nx.all_pairs_shortest_path_length(index.undirected))
+    for source, target in itertools.product(index.undirected, repeat=2):
+        path = index.shortest_path(source, target)
+        if target in lengths[source]:
+            assert path[0] == source and path[-1] == target
+            assert len(path) - 1 == lengths[source][target]
+            assert all(index.undirected.has_edge(u, v) for u, v in zip(path, path[1:]))
+        else:
+            assert path is None
+    assert index.shortest_path("missing", "t0") is None
+
+
+def test_seeds_in_different_components_get_one_tree_each():
+    graph = nx.DiGraph([("a", "b"), ("b", "c"), ("x", "y"), ("y", "z")])
+    index = JoinIndex(graph)
+    edges = index.steiner_tree(frozenset(["a", "c", "x", "z"]))
+    assert sorted(map(frozenset, edges), key=sorted) == sorted(
+        map(frozenset, [("a", "b"), ("b", "c"), ("x", "y"), ("y", "z")]), key=sorted)
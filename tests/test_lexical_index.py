@@ -0,0 +1,77 @@
+import json
+import os
+import re
+
+import pytest
+
+from model import Knowledge_Graph
+from utilities.generate_embeddings.lexical_index import DEFAULT_THRESHOLD, LexicalRouter, LexicalTableIndex
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    index_path = str(tmp_path_factory.mktemp("lexical") / "lexical_index.json")
+    LexicalTableIndex.build(os.path.join(REPO_DIR, "docs", "overview.md"), os.path.join(REPO_DIR, "docs", "table_docs"), index_path)
+    return LexicalTableIndex(index_path)
+
+
+@pytest.fixture(scope="module")
+def questions(index):
+    """The benchmark questions, with the tables of their gold SQL."""
+    with open(os.path.join(REPO_DIR, "benchmark", "questions.jsonl"), "r", encoding="utf-8") as file:
+        questions = [json.loads(line) for line in file if line.strip()]
+    for question in questions:
+        question["tables"] = {table for table in index.tables if re.search(rf"\b{table}\b", question["gold_sql"])}
+    return questions
+
+
+def _joined_tables(graph: Knowledge_Graph, seeds):
+    """The tables the pipeline joins for these seed tables."""
+    _, path = graph.validate_path(seeds)
+    return set(seeds) | {source for source, _, _ in path} | {target for _, _, target in path}
+
+
+def test_fast_path_is_right_whenever_it_fires(index, questions):
+    graph = Knowledge_Graph.load_graph(os.path.join(REPO_DIR, "knowledge_graph.gml"))
+    fired = 0
+    for question in questions:
+        proposal = index.propose(question["question"])
+        if proposal["confidence"] >= DEFAULT_THRESHOLD and proposal["seed_tables"]:
+            fired += 1
+            assert _joined_tables(graph, proposal["seed_tables"]) == question["tables"], question["question"]
+    # The fast path is worth having: it still fires on a good share of the questions
+    assert fired >= len(questions) // 4
+
+
+@pytest.mark.parametrize("question, seeds", [
+    # 'product' only qualifies 'categories'
+    ("How many product categories are there?", ["categories"]),
+    # 'first' and 'last' also match customers.first_name / last_name: single words do not add a table
+    ("List the first and last names of active staff members.", ["staffs"]),
+    ("List every product name together with its brand name.", ["brands", "products"]),
+])
+def test_seed_tables(index, question, seeds):
+    assert sorted(index.propose(question)["seed_tables"]) == seeds
+
+
+def test_confidence_is_the_margin_over_the_other_tables(index):
+    proposal = index.propose("How many product categories are there?")
+    scores = proposal["scores"]
+    assert proposal["margin"] == pytest.approx(1 - scores["products"] / scores["categories"])
+    assert proposal["confidence"] == pytest.approx(proposal["margin"] * proposal["coverage"])
+    # Words the index does not know lower the confidence, a question about no table has none
+    assert index.propose("How many product categories are there in Zanzibar?")["confidence"] < proposal["confidence"]
+    assert index.propose("Tell me about the weather")["confidence"] == 0.0
+
+
+def test_calibrate(index):
+    router = LexicalRouter(index, threshold=1.0)
+    assert router.calibrate(min_samples=1) is None
+    for confidence, agreed in [(0.9, True), (0.6, True), (0.5, True), (0.5, False), (0.3, True), (0.1, False)]:
+        router.record({"seed_tables": ["a"], "fire": False, "confidence": confidence}, ["a"] if agreed else ["b"])
+    # 0.5 fires one question that disagrees; 0.6 is the lowest level with full agreement
+    assert router.calibrate(min_samples=1) == 0.6
+    assert router.calibrate(min_agreement=0.75, min_samples=1) == 0.3
+    assert router.calibrate(min_samples=100) is None
@@ -0,0 +1,179 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmark.fakes import FakeChatModel
+from utilities.model_router import CircuitBreaker, LatencyWindow, ModelRouter, ProviderUnavailableError
+
+
+def _model(name: str, latency: float = 0.0, error_rate: float = 0.0) -> FakeChatModel:
+    return FakeChatModel(responder=lambda messages: name, latency=latency, error_rate=error_rate, model_name=name)
+
+
+def _routed(providers, **stage) -> ModelRouter:
+    stages = {"default": {"providers": [name for name in providers], **stage}}
+    return ModelRouter(providers, stages, failure_threshold=2, reset_after=60)
+
+
+def _run(router: ModelRouter, mode: str) -> str:
+    stage = router.stage("query")
+    if mode == "sync":
+        return stage.invoke("question").content
+    return asyncio.run(stage.ainvoke("question")).content
+
+
+def _router(slow_latency: float) -> ModelRouter:
+    # "slow" answers after slow_latency seconds, "fast" at once: every hedge of "slow" loses
+    providers = {
+        "slow": FakeChatModel(responder=lambda messages: "slow", latency=slow_latency, model_name="slow"),
+        "fast": FakeChatModel(responder=lambda messages: "fast", model_name="fast"),
+    }
+    stages = {"default": {"providers": ["slow", "fast"], "hedge_after": 0.01}}
+    return ModelRouter(providers, stages, failure_threshold=1, reset_after=0.05)
+
+
+def _open_circuit(router: ModelRouter, name: str):
+    router.breakers[name].record(False)
+    assert router.breakers[name].state == "open"
+    time.sleep(router.breakers[name].reset_after)
+
+
+def test_cancelled_probe_releases_the_circuit():
+    router = _router(slow_latency=0.5)
+    _open_circuit(router, "slow")
+    stage = router.stage("query")
+
+    # The probe of "slow" loses the hedge to "fast" and is cancelled
+    assert asyncio.run(stage.ainvoke("question")).content == "fast"
+    breaker = router.breakers["slow"]
+    assert not breaker.probing
+    assert breaker.state == "half_open"
+
+    # The next request may probe again, and its success closes the circuit
+    router.providers["slow"].latency = 0.0
+    stage = router.stage("query")
+    assert asyncio.run(stage.ainvoke("question")).content == "slow"
+    assert breaker.state == "closed"
+    assert "circuit_skips" not in router.stats()["stages"]["query"]
+    router.close()
+
+
+def test_cancelled_streaming_probe_releases_the_circuit():
+    router = _router(slow_latency=0.5)
+    _open_circuit(router, "slow")
+
+    async def first_chunk():
+        async for chunk in router.stage("query").astream("question"):
+            return chunk.content
+
+    assert asyncio.run(first_chunk()).startswith("fast")
+    assert not router.breakers["slow"].probing
+    router.close()
+
+
+def test_probe_cancelled_before_it_starts():
+    router = _router(slow_latency=0.5)
+    _open_circuit(router, "slow")
+
+    async def cancelled_call():
+        task = asyncio.ensure_future(router.stage("query").ainvoke("question"))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(cancelled_call())
+    assert not router.breakers["slow"].probing
+    router.close()
+
+
+# -----------------------------------------ROUTING------------------------------------------------
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_first_provider_answers_without_hedging(mode):
+    router = _routed({"a": _model("a"), "b": _model("b")}, hedge_after=1.0)
+    assert _run(router, mode) == "a"
+    assert router.stats()["stages"]["query"] == {"calls": 1, "wins:a": 1}
+    router.close()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_slow_provider_is_hedged_and_the_first_response_wins(mode):
+    router = _routed({"slow": _model("slow", latency=0.5), "fast": _model("fast")}, hedge_after=0.02)
+    started = time.perf_counter()
+    assert _run(router, mode) == "fast"
+    assert time.perf_counter() - started < 0.4
+    counters = router.stats()["stages"]["query"]
+    assert counters["hedges"] == 1 and counters["wins:fast"] == 1
+    router.close()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_failing_provider_falls_back_at_once(mode):
+    router = _routed({"broken": _model("broken", error_rate=1.0), "ok": _model("ok")}, hedge_after=1.0)
+    assert _run(router, mode) == "ok"
+    counters = router.stats()["stages"]["query"]
+    assert counters["fallbacks"] == 1 and counters["failures:broken"] == 1
+    router.close()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_repeated_failures_open_the_circuit(mode):
+    router = _routed({"broken": _model("broken", error_rate=1.0), "ok": _model("ok")}, hedge_after=1.0)
+    for _ in range(3):
+        assert _run(router, mode) == "ok"
+    assert router.stats()["circuits"]["broken"] == {"state": "open", "trips": 1}
+    # Once open, the provider is skipped instead of called
+    assert router.stats()["stages"]["query"]["circuit_skips"] == 1
+    assert router.stats()["stages"]["query"]["failures:broken"] == 2
+    router.close()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_every_circuit_open(mode):
+    router = _routed({"a": _model("a")})
+    router.breakers["a"].record(False)
+    router.breakers["a"].record(False)
+    with pytest.raises(ProviderUnavailableError):
+        _run(router, mode)
+    router.close()
+
+
+@pytest.mark.parametrize("mode", ["sync", "async"])
+def test_stage_budget(mode):
+    router = _routed({"slow": _model("slow", latency=0.5)}, budget=0.05)
+    with pytest.raises(TimeoutError):
+        _run(router, mode)
+    assert router.stats()["stages"]["query"]["timeouts"] == 1
+    router.close()
+
+
+def test_streaming_hedge_wins_on_the_first_chunk():
+    router = _routed({"slow": _model("slow", latency=0.5), "fast": _model("fast")}, hedge_after=0.02)
+
+    async def content():
+        return "".join([chunk.content async for chunk in router.stage("query").astream("question")])
+
+    assert asyncio.run(content()) == "fast"
+    router.close()
+
+
+def test_hedge_delay_follows_the_latency_quantile():
+    window = LatencyWindow(size=10)
+    assert window.quantile(0.95, min_samples=5) is None
+    for seconds in range(1, 11):
+        window.add(seconds / 10)
+    assert window.quantile(0.95, min_samples=5) == 1.0
+    assert window.quantile(0.5, min_samples=5) == 0.6
+
+
+def test_failed_probe_keeps_the_circuit_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.0)
+    breaker.record(False)
+    assert breaker.acquire() == "probe"
+    assert breaker.acquire() is None
+    breaker.record(False)
+    assert breaker.trips == 2 and not breaker.probing
+    assert breaker.acquire() == "probe"
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.acquire() == "call"
@@ -0,0 +1,45 @@
+import re
+
+import pytest
+
+from utilities.sql_executor import ReadOnlyViolation, check_read_only
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM orders;",
+    "SELECT order_id, status AS set FROM orders",
+    "SELECT s.set, `into`, SUM(set) FROM settings s GROUP BY s.set",
+    "SELECT load, handler FROM jobs ORDER BY load DESC",
+    "SELECT REPLACE(name, 'a', 'b'), INSERT(name, 1, 2, 'x') FROM customers",
+    "SELECT * FROM orders WHERE note = 'DROP TABLE orders; UPDATE x SET y = 1'",
+    "SELECT * FROM orders -- DELETE FROM orders",
+    "WITH recent AS (SELECT * FROM orders WHERE order_date > '2018-01-01') SELECT COUNT(*) FROM recent",
+    "SELECT * FROM orders WHERE customer_id IN (SELECT customer_id FROM customers)",
+    "SHOW TABLES",
+    "DESCRIBE orders",
+    "EXPLAIN SELECT * FROM orders",
+])
+def test_reads_are_allowed(sql):
+    assert check_read_only(sql) == sql.strip().rstrip(";").strip()
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("UPDATE orders SET status = 1", "UPDATE statements are not allowed"),
+    ("SET GLOBAL read_only = 0", "SET statements are not allowed"),
+    ("DROP TABLE orders", "DROP statements are not allowed"),
+    ("SELECT * FROM orders INTO OUTFILE '/tmp/orders.csv'", "SELECT ... INTO"),
+    ("SELECT * INTO DUMPFILE '/tmp/orders' FROM orders", "SELECT ... INTO"),
+    ("SELECT COUNT(*) INTO @total FROM orders", "SELECT ... INTO"),
+    ("SELECT * INTO orders_copy FROM orders", "SELECT ... INTO"),
+    ("WITH gone AS (DELETE FROM orders RETURNING *) SELECT * FROM gone", "DELETE is not allowed"),
+    ("WITH recent AS (SELECT 1) UPDATE orders SET status = 1", "UPDATE is not allowed"),
+    ("EXPLAIN ANALYZE DELETE FROM orders", "DELETE is not allowed"),
+    ("SELECT * FROM orders FOR UPDATE", "Locking reads"),
+    ("SELECT * FROM orders; DROP TABLE orders", "single statement"),
+    ("SELECT 1; SELECT 2;", "single statement"),
+    ("", "Empty statement"),
+    ("-- only a comment", "Empty statement"),
+])
+def test_writes_are_rejected(sql, message):
+    with pytest.raises(ReadOnlyViolation, match=re.escape(message)):
+        check_read_only(sql)
@@ -0,0 +1,63 @@
+import pytest
+
+from utilities.sql_stream import SQLStreamExtractor, extract_sql_statements
+
+
+def _streamed(text: str, chunk_size: int):
+    """The statements of a model output streamed chunk_size characters at a time, in order of completion."""
+    extractor = SQLStreamExtractor()
+    statements = []
+    for start in range(0, len(text), chunk_size):
+        statements.extend(extractor.feed(text[start:start + chunk_size]))
+    statements.extend(extractor.finish())
+    assert statements == extractor.statements
+    return statements
+
+
+def _fenced(sql: str) -> str:
+    return f"<think>\nThe tables are orders and customers.\n</think>\nHere is the query:\n```sql\n{sql}\n```\nDone; it's simple."
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT 1;\nSELECT 2;", ["SELECT 1;", "SELECT 2;"]),
+    # Comments with quotes and ';' in them do not open strings nor end statements
+    ("-- don't count the staff\nSELECT 1;\nSELECT 2;", ["-- don't count the staff\nSELECT 1;", "SELECT 2;"]),
+    ("# it's the 'first'; query\nSELECT 1;", ["# it's the 'first'; query\nSELECT 1;"]),
+    ("SELECT /* the 'active'; ones */ 1;\nSELECT 2;", ["SELECT /* the 'active'; ones */ 1;", "SELECT 2;"]),
+    ("SELECT 1 - 2;\nSELECT 4 / 2;", ["SELECT 1 - 2;", "SELECT 4 / 2;"]),
+    # Escaped and doubled quotes stay inside the string
+    ("SELECT 'it\\'s; fine';\nSELECT 2;", ["SELECT 'it\\'s; fine';", "SELECT 2;"]),
+    ("SELECT 'it''s; fine';\nSELECT 2;", ["SELECT 'it''s; fine';", "SELECT 2;"]),
+    ('SELECT "a;b" AS `x;y`;', ['SELECT "a;b" AS `x;y`;']),
+    # The last statement may omit its ';'
+    ("SELECT 1;\nSELECT 2", ["SELECT 1;", "SELECT 2"]),
+    ("SELECT 1; -- the count\n/* done */", ["SELECT 1;"]),
+])
+def test_fenced_statements(sql, expected, chunk_size):
+    assert _streamed(_fenced(sql), chunk_size) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_unterminated_string_ends_at_the_fence(chunk_size):
+    statements = _streamed(_fenced("SELECT 1;\nSELECT 'oops FROM t;"), chunk_size)
+    assert statements == ["SELECT 1;", "SELECT 'oops FROM t;"]
+
+
+def test_statements_are_returned_as_soon_as_they_end():
+    extractor = SQLStreamExtractor()
+    assert extractor.feed("```sql\nSELECT 1;") == ["SELECT 1;"]
+    assert extractor.feed(" SELECT 'a;") == []
+    assert extractor.feed("b';\n") == ["SELECT 'a;b';"]
+    assert extractor.feed("```") == []
+    assert extractor.finish() == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("SELECT 1; SELECT 2", ["SELECT 1;", "SELECT 2;"]),
+    ("SELECT 1; SELECT 2;", ["SELECT 1;", "SELECT 2;"]),
+    ("<think>SELECT nothing</think>\nSELECT 'a;b' FROM t; -- it's done\n", ["SELECT 'a;b' FROM t;"]),
+    ("No query here.", []),
+])
+def test_unfenced_statements(text, expected):
+    assert extract_sql_statements(text) == expected
@@ -0,0 +1,84 @@
+import os
+
+import networkx as nx
+import pytest
+
+from utilities.sql_validator import SQLValidator
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VALID_QUERY = ("SELECT c.first_name, COUNT(*) AS orders FROM customers c "
+               "JOIN orders o ON o.customer_id = c.customer_id GROUP BY c.first_name")
+WRONG_JOIN = "SELECT * FROM orders o JOIN customers c ON o.order_id = c.customer_id"
+
+
+@pytest.fixture(scope="module")
+def validator():
+    graph = nx.read_gml(os.path.join(REPO_DIR, "knowledge_graph.gml"))
+    return SQLValidator.from_files(graph, os.path.join(REPO_DIR, "docs", "table_docs"))
+
+
+@pytest.mark.parametrize("sql", [
+    VALID_QUERY,
+    "SELECT p.product_name FROM products p JOIN order_items i ON i.product_id = p.product_id "
+    "JOIN orders o ON o.order_id = i.order_id WHERE o.order_status = 4",
+    # A join on plain attributes is not a foreign key join
+    "SELECT * FROM customers c JOIN stores s ON c.state = s.state",
+    "WITH totals AS (SELECT store_id, COUNT(*) AS n FROM orders GROUP BY store_id) SELECT MAX(n) FROM totals",
+])
+def test_valid_queries(validator, sql):
+    assert validator.validate(sql) == []
+
+
+def test_unknown_table(validator):
+    errors = validator.validate("SELECT * FROM invoices")
+    assert len(errors) == 1
+    assert errors[0].startswith("Unknown table invoices: the tables are brands, categories")
+
+
+@pytest.mark.parametrize("sql, error", [
+    ("SELECT o.order_total FROM orders o",
+     "Unknown column o.order_total: orders has no column order_total (did you mean orders.order_status?)"),
+    ("SELECT order_total FROM orders",
+     "Unknown column order_total: no table of the query has it (did you mean orders.order_status?)"),
+    ("SELECT product_name FROM orders",
+     "Unknown column product_name: no table of the query has it (it is a column of products, which the query does not join)"),
+])
+def test_unknown_column(validator, sql, error):
+    assert validator.validate(sql) == [error]
+
+
+@pytest.mark.parametrize("sql, error", [
+    (WRONG_JOIN, "Wrong join condition o.order_id = c.customer_id: "
+                 "orders joins customers on orders.customer_id = customers.customer_id"),
+    ("SELECT * FROM orders o JOIN products p ON o.order_id = p.product_id",
+     "Wrong join condition o.order_id = p.product_id: orders and products have no foreign key between them; "
+     "join them through orders -> order_items -> products"),
+])
+def test_join_inconsistent_with_the_foreign_keys(validator, sql, error):
+    assert validator.validate(sql) == [error]
+
+
+def test_no_statement(validator):
+    assert validator.validate_all([]) == ["No SQL statement found in the answer: write the query in a ```sql block"]
+
+
+def test_repair_succeeds(validator):
+    # The query model fixes the join once the validation error is in the conversation
+    RAG_pipeline = pytest.importorskip("RAG_pipeline")
+    from benchmark.fakes import FakeChatModel
+
+    prompts = []
+
+    def responder(messages):
+        prompts.append(str(messages[-1].content))
+        return f"```sql\n{VALID_QUERY};\n```"
+
+    pipeline = RAG_pipeline.NLToSQLPipeline(query_model=FakeChatModel(responder=responder), validator=validator,
+                                            max_repairs=2, verbose=False)
+    inputs = pipeline._query_inputs("How many orders did each customer place?", ["orders", "customers"],
+                                    ["orders.customer_id -> customers.customer_id"], ["customers.first_name"])
+    sql, statements, errors, repairs = pipeline.repair_query(inputs, f"```sql\n{WRONG_JOIN};\n```")
+
+    assert (statements, errors, repairs) == ([VALID_QUERY + ";"], [], 1)
+    assert len(prompts) == 1
+    assert "orders joins customers on orders.customer_id = customers.customer_id" in prompts[0]
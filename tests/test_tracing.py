@@ -0,0 +1,30 @@
+import pytest
+
+from utilities.tracing import MODEL_PRICES, Span, model_price
+
+
+@pytest.mark.parametrize("model, price", [
+    ("gpt-4o-mini", MODEL_PRICES["gpt-4o-mini"]),
+    # Providers report dated snapshots and provider prefixes
+    ("gpt-4o-mini-2024-07-18", MODEL_PRICES["gpt-4o-mini"]),
+    ("openai/gpt-4o-mini-2024-07-18", MODEL_PRICES["gpt-4o-mini"]),
+    ("qwen-qwq-32b", MODEL_PRICES["qwen-qwq-32b"]),
+    ("gpt-4o-minimal", None),
+    ("unknown-model", None),
+])
+def test_model_price(model, price):
+    assert model_price(model) == price
+
+
+def test_longest_prefix_wins(monkeypatch):
+    monkeypatch.setitem(MODEL_PRICES, "gpt-4o", (2.5, 10.0))
+    assert model_price("gpt-4o-2024-08-06") == (2.5, 10.0)
+    assert model_price("gpt-4o-mini-2024-07-18") == MODEL_PRICES["gpt-4o-mini"]
+
+
+def test_span_cost_of_a_dated_model():
+    span = Span("query")
+    span.llm_usage("gpt-4o-mini-2024-07-18", 1_000_000, 1_000_000)
+    prompt_price, completion_price = MODEL_PRICES["gpt-4o-mini"]
+    assert span.cost == pytest.approx(prompt_price + completion_price)
+    assert span.to_dict()["cost_usd"] == pytest.approx(prompt_price + completion_price)
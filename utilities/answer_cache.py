@@ -0,0 +1,208 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import hashlib
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# The knowledge graph and docs of the default schema live at the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WATCH_PATHS = (os.path.join(REPO_DIR, "knowledge_graph.gml"), os.path.join(REPO_DIR, "docs"))
+
+
+def get_fingerprint(watch_paths: Sequence[str]) -> str:
+    """
+    Fingerprint of the files the cached answers depend on (knowledge graph, docs).
+    Built from the path, size and modification time of every file, so it is cheap to recompute.
+    """
+    entries = []
+    for watch_path in watch_paths:
+        if os.path.isfile(watch_path):
+            files = [watch_path]
+        elif os.path.isdir(watch_path):
+            files = [os.path.join(root, name) for root, _, names in os.walk(watch_path) for name in names]
+        else:
+            entries.append(f"{watch_path}:missing")
+            continue
+
+        for file_path in sorted(files):
+            stat = os.stat(file_path)
+            entries.append(f"{file_path}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return hashlib.sha256("\n".join(entries).encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    def __init__(self, db_path: str, threshold: float = 0.92, max_entries: int = 1000, ttl: Optional[float] = None,
+                 watch_paths: Sequence[str] = DEFAULT_WATCH_PATHS, check_interval: float = 5.0):
+        """
+        Caches whole pipeline results and matches new questions against past ones by
+        cosine similarity of their embeddings.
+
+        Args:
+            db_path (str): Path of the sqlite file holding the cache.
+            threshold (float): Minimum cosine similarity for a past question to be reused.
+            max_entries (int): Maximum number of cached answers, least recently used evicted first.
+            ttl (float, optional): Seconds after which an answer expires. None keeps answers forever.
+            watch_paths (Sequence[str]): Files / directories whose change invalidates the whole cache,
+                normally the knowledge graph and docs the pipeline is configured with. Relative paths are
+                resolved against the working directory once, at construction.
+            check_interval (float): Minimum seconds between two fingerprint checks, so lookups do not
+                walk the watched directories every time. 0 checks on every lookup and store.
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.watch_paths = [os.path.abspath(watch_path) for watch_path in watch_paths]
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   question TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   result TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        # In-memory copy of the vectors, normalised, for one matrix product per lookup
+        self._ids: List[int] = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._fingerprint = None
+        self._checked_at = None
+        self._load()
+
+        for watch_path in self.watch_paths:
+            if not os.path.exists(watch_path):
+                print(f"[ERROR] Answer cache watch path {watch_path} does not exist, changes to it cannot clear the cache")
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, vector FROM answers ORDER BY id").fetchall()
+        self._ids = [row[0] for row in rows]
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        self._fingerprint = row[0] if row else None
+
+    def _check_fingerprint(self):
+        # Drop every answer if the knowledge graph or the docs changed since they were cached
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        fingerprint = get_fingerprint(self.watch_paths)
+        if fingerprint == self._fingerprint:
+            return
+
+        if self._ids:
+            print("Knowledge graph or docs changed, clearing the answer cache.")
+        self._conn.execute("DELETE FROM answers")
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+        self._conn.commit()
+        self._fingerprint = fingerprint
+        self._ids = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        cursor = self._conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,))
+        if cursor.rowcount:
+            self._conn.commit()
+            self._load()
+
+    @staticmethod
+    def _normalise(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query_vector: Sequence[float]) -> Optional[dict]:
+        """
+        Find the most similar past question above the threshold.
+
+        Returns:
+            dict: The stored result (a PipelineResult dump), or None on a miss.
+        """
+        with self._lock:
+            self._check_fingerprint()
+            self._expire()
+
+            if not self._ids:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ self._normalise(query_vector)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            answer_id = self._ids[best]
+            row = self._conn.execute("SELECT result FROM answers WHERE id = ?", (answer_id,)).fetchone()
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), answer_id))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def store(self, question: str, query_vector: Sequence[float], result: dict):
+        """Store a result and evict the least recently used answers above max_entries."""
+        vector = self._normalise(query_vector)
+        now = time.time()
+
+        with self._lock:
+            self._check_fingerprint()
+            inserted = self._conn.execute(
+                "INSERT INTO answers (question, vector, result, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (question, vector.tobytes(), json.dumps(result), now, now),
+            )
+            cursor = self._conn.execute(
+                """DELETE FROM answers WHERE id IN (
+                       SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                   )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+            if cursor.rowcount:
+                self._load()
+            else:
+                self._ids.append(inserted.lastrowid)
+                self._matrix = vector[None, :] if self._matrix.size == 0 else np.vstack([self._matrix, vector])
+
+    def clear(self):
+        """Remove every cached answer."""
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._ids = []
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._ids)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,128 @@
+import argparse
+import os
+import sys
+from typing import Iterable, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IPC_EXTENSIONS = (".arrow", ".feather", ".ipc")
+
+
+def _unique_names(names: Sequence[str]) -> List[str]:
+    # A join can return the same column name twice (e.g. two customer_id), which Parquet refuses
+    seen = {}
+    unique = []
+    for name in names:
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        unique.append(name if count == 0 else f"{name}_{count}")
+    return unique
+
+
+def _settle_type(data_type: pa.DataType) -> pa.DataType:
+    """The type a column keeps for the whole stream, from the type inferred on its first batch."""
+    if pa.types.is_null(data_type):
+        return pa.string()  # Only NULLs so far: the later values are cast to text
+    if pa.types.is_decimal(data_type):
+        return pa.decimal128(38, data_type.scale)  # The precision of the first batch may be too small later
+    return data_type
+
+
+class RecordBatchBuilder:
+    def __init__(self, names: Sequence[str], schema: Optional[pa.Schema] = None):
+        """
+        Turns the row tuples of one fetchmany call into an Arrow record batch. Without a schema,
+        the column types are inferred from the first batch and every later batch is converted to
+        them, so the batches of one stream always share a schema.
+        """
+        self.names = _unique_names(names)
+        self.schema = schema
+
+    def _array(self, values: Sequence, field: pa.Field) -> pa.Array:
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        try:
+            return pa.array(values).cast(field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            raise ValueError(f"Column {field.name} no longer fits the type {field.type} of the first batch; "
+                             f"pass an explicit schema ({e})")
+
+    def build(self, rows: Sequence[tuple]) -> pa.RecordBatch:
+        columns = list(zip(*rows)) if rows else [() for _ in self.names]
+        if self.schema is None:
+            arrays = [pa.array(column) for column in columns]
+            self.schema = pa.schema([pa.field(name, _settle_type(array.type)) for name, array in zip(self.names, arrays)])
+            arrays = [array if array.type == field.type else self._array(column, field)
+                      for array, column, field in zip(arrays, columns, self.schema)]
+        else:
+            arrays = [self._array(column, field) for column, field in zip(columns, self.schema)]
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def empty(self) -> pa.RecordBatch:
+        """A batch without rows, so an empty result still has its columns."""
+        return self.build([])
+
+
+def write_batches(batches: Iterable[pa.RecordBatch], path: str, compression: str = "zstd") -> dict:
+    """
+    Write record batches to a Parquet file (.parquet) or an Arrow IPC file (.arrow, .feather,
+    .ipc) as they arrive; only one batch is held in memory at a time.
+
+    Returns:
+        dict: {"path", "rows", "batches", "bytes"}.
+    """
+    ipc = path.endswith(IPC_EXTENSIONS)
+    if not ipc and not path.endswith(".parquet"):
+        raise ValueError(f"Unknown output format: {path} (expected .parquet or one of {', '.join(IPC_EXTENSIONS)})")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    writer = None
+    rows = count = 0
+    try:
+        for batch in batches:
+            # The schema is only known once the first batch arrives
+            if writer is None:
+                writer = (pa.ipc.new_file(path, batch.schema) if ipc
+                          else pq.ParquetWriter(path, batch.schema, compression=compression))
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            count += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return {"path": path, "rows": rows, "batches": count, "bytes": os.path.getsize(path) if writer is not None else 0}
+
+
+def main():
+    from utilities.sql_executor import SQLExecutor, load_db_config
+
+    parser = argparse.ArgumentParser(description="Stream the result of a query into a Parquet or Arrow IPC file.")
+    parser.add_argument("sql", help="Read-only SQL statement")
+    parser.add_argument("output", help="Output file (.parquet, .arrow, .feather or .ipc)")
+    parser.add_argument("--batch-rows", type=int, default=65536, help="Rows per record batch")
+    parser.add_argument("--timeout", type=float, default=0, help="Seconds allowed for the whole export (0: no limit)")
+    parser.add_argument("--db-config", default=None, help="JSON file of the database settings")
+    parser.add_argument("--db-backend", choices=["mysql", "sqlite"], default=None, help="Database backend")
+    parser.add_argument("--db-path", default=None, help="SQLite database file of the sqlite backend")
+    args = parser.parse_args()
+
+    executor = SQLExecutor.from_config(load_db_config(args.db_config, backend=args.db_backend, path=args.db_path, pool_size=1))
+    try:
+        summary = executor.export(args.sql, args.output, batch_rows=args.batch_rows, timeout=args.timeout)
+    finally:
+        executor.close()
+    print(f"{summary['rows']} rows in {summary['batches']} batches written to {summary['path']} "
+          f"({summary['bytes'] / 1e6:.1f} MB, {summary['seconds']:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
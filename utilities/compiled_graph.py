@@ -0,0 +1,212 @@
+import json
+import struct
+from typing import Dict, Iterable, List, Optional, Set
+
+import networkx as nx
+import numpy as np
+
+MAGIC = b"KGB1"
+ALIGNMENT = 64
+
+
+class CompiledGraph:
+    def __init__(self, arrays: Dict[str, np.ndarray], name: str = ""):
+        """
+        Array-backed, read-only representation of the schema knowledge graph.
+
+        Tables are interned: table i is the i-th entry of the string table, which also holds
+        the column names and predicates of the edges. Forward (FK -> PK) and reverse (PK -> FK)
+        adjacency are stored in CSR form, and the edge attributes in arrays parallel to the
+        forward edges. Use save() / load() to write and memory-map the binary file.
+
+        Args:
+            arrays (Dict[str, np.ndarray]): The arrays described in from_networkx().
+            name (str): Name of the graph.
+        """
+        self.arrays = arrays
+        self.name = name
+        self.num_nodes = len(arrays["fwd_indptr"]) - 1
+        self.num_edges = len(arrays["fwd_indices"])
+        self._ids = None
+
+    # ------------------------------------------BUILDING------------------------------------------
+
+    @classmethod
+    def from_networkx(cls, graph: nx.DiGraph) -> "CompiledGraph":
+        """Compile a networkx graph (edge attributes kept: 'predicate' and 'on_column')."""
+        nodes = list(graph.nodes)
+        ids = {node: i for i, node in enumerate(nodes)}
+        strings = [str(node) for node in nodes]
+        interned = {s: i for i, s in enumerate(strings)}
+
+        def intern(value) -> int:
+            if value is None:
+                return -1
+            value = str(value)
+            if value not in interned:
+                interned[value] = len(strings)
+                strings.append(value)
+            return interned[value]
+
+        edges = sorted((ids[u], ids[v], data) for u, v, data in graph.edges(data=True))
+        sources = np.array([u for u, _, _ in edges], dtype=np.int32)
+        targets = np.array([v for _, v, _ in edges], dtype=np.int32)
+        on_column = np.array([intern(data.get("on_column")) for _, _, data in edges], dtype=np.int32)
+        predicate = np.array([intern(data.get("predicate")) for _, _, data in edges], dtype=np.int32)
+
+        # Reverse CSR points back to the forward edge ids, so the attributes are not duplicated
+        reverse_order = np.lexsort((sources, targets)).astype(np.int32)
+
+        encoded = [s.encode("utf-8") for s in strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        string_offsets[1:] = np.cumsum([len(b) for b in encoded])
+
+        arrays = {
+            "string_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "string_offsets": string_offsets,
+            "fwd_indptr": cls._indptr(sources, len(nodes)),
+            "fwd_indices": targets,
+            "rev_indptr": cls._indptr(targets, len(nodes)),
+            "rev_indices": sources[reverse_order],
+            "rev_edge_ids": reverse_order,
+            "edge_on_column": on_column,
+            "edge_predicate": predicate,
+        }
+        return cls(arrays, name=graph.graph.get("name", ""))
+
+    @staticmethod
+    def _indptr(rows: np.ndarray, num_nodes: int) -> np.ndarray:
+        indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+        return indptr
+
+    def to_networkx(self) -> nx.DiGraph:
+        """Materialize the graph back into a networkx DiGraph."""
+        graph = nx.DiGraph()
+        graph.graph["name"] = self.name
+        graph.add_nodes_from(self.node_name(i) for i in range(self.num_nodes))
+
+        indptr, indices = self.arrays["fwd_indptr"], self.arrays["fwd_indices"]
+        for u in range(self.num_nodes):
+            for edge_id in range(indptr[u], indptr[u + 1]):
+                attributes = {}
+                predicate = self.string(int(self.arrays["edge_predicate"][edge_id]))
+                on_column = self.string(int(self.arrays["edge_on_column"][edge_id]))
+                if predicate is not None:
+                    attributes["predicate"] = predicate
+                if on_column is not None:
+                    attributes["on_column"] = on_column
+                graph.add_edge(self.node_name(u), self.node_name(int(indices[edge_id])), **attributes)
+        return graph
+
+    # ------------------------------------------FILE FORMAT------------------------------------------
+
+    def save(self, file_path: str):
+        """
+        Write the graph as: magic, header length, JSON header (offsets / dtypes / lengths),
+        then every array aligned to 64 bytes so it can be memory-mapped in place.
+        """
+        layout = {}
+        offset = 0
+        for key, array in self.arrays.items():
+            layout[key] = {"dtype": array.dtype.str, "length": int(array.size), "offset": offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+        header = json.dumps({"name": self.name, "arrays": layout}).encode("utf-8")
+        data_start = -(-(len(MAGIC) + 4 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        with open(file_path, "wb") as file:
+            file.write(MAGIC)
+            file.write(struct.pack("<I", len(header)))
+            file.write(header)
+            for key, array in self.arrays.items():
+                file.seek(data_start + layout[key]["offset"])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, file_path: str, mmap: bool = True) -> "CompiledGraph":
+        """Load a compiled graph; with mmap=True the arrays are memory-mapped, not read."""
+        with open(file_path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{file_path} is not a compiled knowledge graph.")
+            (header_len,) = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(header_len).decode("utf-8"))
+
+        data_start = -(-(len(MAGIC) + 4 + header_len) // ALIGNMENT) * ALIGNMENT
+        raw = np.memmap(file_path, dtype=np.uint8, mode="r") if mmap else np.fromfile(file_path, dtype=np.uint8)
+
+        arrays = {}
+        for key, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            start = data_start + spec["offset"]
+            arrays[key] = raw[start:start + spec["length"] * dtype.itemsize].view(dtype)
+        return cls(arrays, name=header.get("name", ""))
+
+    # ------------------------------------------LOOKUPS------------------------------------------
+
+    def string(self, string_id: int) -> Optional[str]:
+        """Interned string by id (-1 means missing)."""
+        if string_id < 0:
+            return None
+        offsets = self.arrays["string_offsets"]
+        return bytes(self.arrays["string_blob"][offsets[string_id]:offsets[string_id + 1]]).decode("utf-8")
+
+    def node_name(self, node_id: int) -> str:
+        return self.string(node_id)
+
+    def node_id(self, name: str) -> Optional[int]:
+        """Id of a table, or None if it is not in the graph."""
+        if self._ids is None:
+            self._ids = {self.node_name(i): i for i in range(self.num_nodes)}
+        return self._ids.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return self.node_id(name) is not None
+
+    def successors(self, node_id: int) -> np.ndarray:
+        """Tables referenced by node_id (FK -> PK)."""
+        indptr = self.arrays["fwd_indptr"]
+        return self.arrays["fwd_indices"][indptr[node_id]:indptr[node_id + 1]]
+
+    def predecessors(self, node_id: int) -> np.ndarray:
+        """Tables referencing node_id (PK -> FK)."""
+        indptr = self.arrays["rev_indptr"]
+        return self.arrays["rev_indices"][indptr[node_id]:indptr[node_id + 1]]
+
+    def multi_source_bfs(self, start_ids: Iterable[int], max_depth: Optional[int] = None, reverse: bool = False) -> Set[int]:
+        """
+        Ids of all nodes reachable from any of the start nodes within max_depth hops,
+        following the forward edges (or the reverse edges with reverse=True).
+        """
+        prefix = "rev" if reverse else "fwd"
+        indptr, indices = self.arrays[f"{prefix}_indptr"], self.arrays[f"{prefix}_indices"]
+
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        frontier = np.unique(np.asarray(list(start_ids), dtype=np.int32))
+        visited[frontier] = True
+        depth = 0
+
+        while frontier.size and (max_depth is None or depth < max_depth):
+            neighbours = [indices[indptr[u]:indptr[u + 1]] for u in frontier]
+            if not neighbours:
+                break
+            candidates = np.unique(np.concatenate(neighbours))
+            frontier = candidates[~visited[candidates]]
+            visited[frontier] = True
+            depth += 1
+
+        return set(np.flatnonzero(visited).tolist())
+
+    def find_connected(self, start_nodes: List[str], max_depth: Optional[int] = None) -> Set[str]:
+        """Union of the forward and reverse multi-source BFS from the start tables."""
+        start_ids = [self.node_id(node) for node in start_nodes]
+        start_ids = [i for i in start_ids if i is not None]
+        if not start_ids:
+            return set()
+
+        reached = self.multi_source_bfs(start_ids, max_depth) | self.multi_source_bfs(start_ids, max_depth, reverse=True)
+        return {self.node_name(i) for i in reached}
+
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
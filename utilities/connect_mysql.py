@@ -1,11 +1,23 @@
 import mysql.connector
 
+try:
+   from sql_executor import load_db_config
+except ImportError:
+   from utilities.sql_executor import load_db_config
 
-def get_connection():
+
+def get_connection(config_path=None):
+   """
+   Connection to the MySQL database (and a cursor), with the settings of load_db_config:
+   the DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and DB_NAME environment variables or a JSON config file.
+   The caller closes it.
+   """
+   config = load_db_config(config_path)
    conn = mysql.connector.connect(
-               host = "localhost",
-               user = "root",
-               password = "pranjal123",
-               database = "bike_store"
+               host = config["host"],
+               port = config["port"],
+               user = config["user"],
+               password = config["password"],
+               database = config["database"]
       )
    return conn , conn.cursor()
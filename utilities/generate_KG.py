@@ -10,6 +10,8 @@ from connect_mysql import get_connection
 conn , cursor = get_connection()
 cursor.execute("show tables;")
 tables = cursor.fetchall()
+cursor.close()
+conn.close()
 
 nodes = [table[0] for table in tables]
 
@@ -43,5 +45,6 @@ table_KG = Knowledge_Graph(
 
 table_KG.draw_graph()
 table_KG.save_graph("/home/pranjalgoyal/GenAI/assgn2/knowledge_graph.gml")
+table_KG.save_graph("/home/pranjalgoyal/GenAI/assgn2/knowledge_graph.kgb")
                
 
@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_db import registry
+from numpy_index import NumpyVectorIndex
+
+
+def percentile_ms(timings, q):
+    return float(np.percentile(np.asarray(timings) * 1000, q))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Chroma and numpy retrieval backends.")
+    parser.add_argument("--overview-db", default="db/overview_db", help="Persist directory of the overview collection")
+    parser.add_argument("--table-db", default="db/table_db", help="Persist directory of the table collections")
+    parser.add_argument("--index-dir", default="db/numpy_index", help="Directory of the numpy index")
+    parser.add_argument("--queries", type=int, default=200, help="Number of query vectors")
+    parser.add_argument("--k", type=int, default=7, help="Chunks retrieved per collection")
+    args = parser.parse_args()
+
+    index = NumpyVectorIndex(args.index_dir)
+    names = list(index.collections)
+
+    # Queries: stored chunk embeddings with some noise, so no embedding API call is needed
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, len(index.matrix), size=args.queries)
+    queries = np.asarray(index.matrix[rows]) + rng.normal(0, 0.01, size=(args.queries, index.matrix.shape[1])).astype(np.float32)
+
+    chroma_times, numpy_times, numpy_all_times = [], [], []
+    mismatches = 0
+    for query in queries:
+        vector = query.tolist()
+        for name in names:
+            db_path = args.overview_db if name == "overview" else args.table_db
+            store = registry.get(name, db_path)
+
+            started = time.perf_counter()
+            chroma_ids = [doc.id for doc in store.similarity_search_by_vector(vector, k=args.k)]
+            chroma_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            numpy_ids = [doc.id for doc in index.store(name).similarity_search_by_vector(vector, k=args.k)]
+            numpy_times.append(time.perf_counter() - started)
+
+            mismatches += chroma_ids != numpy_ids
+
+        # Every collection answered by one matrix product
+        started = time.perf_counter()
+        index.search([vector], {name: args.k for name in names})
+        numpy_all_times.append(time.perf_counter() - started)
+
+    searches = len(queries) * len(names)
+    print(f"{len(queries)} queries x {len(names)} collections ({len(index.matrix)} chunks)")
+    print(f"chroma per collection : p50 {percentile_ms(chroma_times, 50):.3f} ms, p95 {percentile_ms(chroma_times, 95):.3f} ms")
+    print(f"numpy per collection  : p50 {percentile_ms(numpy_times, 50):.3f} ms, p95 {percentile_ms(numpy_times, 95):.3f} ms")
+    print(f"numpy all collections : p50 {percentile_ms(numpy_all_times, 50):.3f} ms, p95 {percentile_ms(numpy_all_times, 95):.3f} ms")
+    print(f"ranking mismatches    : {mismatches}/{searches}")
+
+
+if __name__ == "__main__":
+    main()
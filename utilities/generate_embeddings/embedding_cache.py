@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str, max_entries: int = 10000):
+        """
+        A persistent, size-bounded cache of embedding vectors stored in sqlite.
+        Entries are keyed by (model, sha256 of the text) and evicted least recently used first.
+
+        Args:
+            db_path (str): Path of the sqlite file holding the cache.
+            max_entries (int): Maximum number of vectors kept in the cache.
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   model TEXT NOT NULL,
+                   text_hash TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   last_used REAL NOT NULL,
+                   PRIMARY KEY (model, text_hash)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Hash of the text used as part of the cache key."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Return the cached vector for the text, or None."""
+        key = self.text_hash(text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE model = ? AND text_hash = ?", (model, key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?", (time.time(), model, key)
+            )
+            self._conn.commit()
+        return array("f", row[0]).tolist()
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Store a vector and evict the least recently used entries above max_entries."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                (model, self.text_hash(text), array("f", vector).tobytes(), time.time()),
+            )
+            self._conn.execute(
+                """DELETE FROM embeddings WHERE rowid IN (
+                       SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                   )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        """
+        Wraps an embeddings client so that query embeddings are served from an EmbeddingCache.
+        Document embeddings are passed straight through to the wrapped client.
+
+        Args:
+            embeddings (Embeddings): The client doing the actual embedding calls.
+            cache (EmbeddingCache): The cache to read from and write to.
+            model (str): Name of the embedding model, part of the cache key.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries, sending all the cache misses in a single batched call."""
+        vectors = [self.cache.get(self.model, text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self.cache.put(self.model, texts[i], vector)
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # The sqlite lookups run in a worker thread, off the event loop
+        vector = await asyncio.to_thread(self.cache.get, self.model, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, self.model, text, vector)
+        return vector
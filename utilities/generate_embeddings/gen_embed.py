@@ -1,6 +1,13 @@
 import os
+import argparse
 from generate_db import get_vector_store
 from retrieve_doc import get_doc_content, get_chunks
+from incremental_index import IncrementalIndexer, print_report
+from lexical_index import LexicalTableIndex
+
+parser = argparse.ArgumentParser(description="Incrementally (re-)embed the overview docs.")
+parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+args = parser.parse_args()
 
 dir  = "/home/pranjalgoyal/GenAI/assgn2/docs"
 db_dir = "/home/pranjalgoyal/GenAI/assgn2/db"
@@ -17,10 +24,17 @@ for item in os.listdir(dir):
         file_name = os.path.splitext(item)[0].lower()
         db_name = file_name + "_db"
         db_path = os.path.join(db_dir, db_name)
-        print(f"Creating vector store for: {file_name} at {db_path}")
+        print(f"Syncing vector store for: {file_name} at {db_path}")
         
-        # Initialize the vector store
+        # Only embed the new / changed chunks, and delete the removed ones
+        indexer = IncrementalIndexer(os.path.join(db_path, "manifest.json"))
         vector_store = get_vector_store(file_name, db_path)
-        vector_store.add_documents(chunks)
+        print_report(indexer.sync(file_name, vector_store, chunks, dry_run=args.dry_run), args.dry_run)
     else:
-        print(f"Skipping non-file or non-md item: {item_path}")
\ No newline at end of file
+        print(f"Skipping non-file or non-md item: {item_path}")
+
+# The lexical index of the tables (fast path of the pipeline) is rebuilt from the same docs
+if not args.dry_run:
+    lexical_index_path = os.path.join(db_dir, "lexical_index.json")
+    LexicalTableIndex.build(os.path.join(dir, "overview.md"), os.path.join(dir, "table_docs"), lexical_index_path)
+    print(f"Lexical index written to {lexical_index_path}")
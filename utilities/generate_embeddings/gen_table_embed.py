@@ -1,44 +1,64 @@
 import os
 import sys
+import argparse
 
 # Add the parent directory to Python path FIRST
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
 
-from generate_db import get_vector_store
-from retrieve_doc import get_doc_content, get_chunks
+from generate_db import get_vector_store, get_embeddings
 from connect_mysql import get_connection
+from incremental_index import IncrementalIndexer
+from parallel_index import build_index
 
-# Initialize database connection
-conn, cursor = get_connection()
-
-# Get all table names
-cursor.execute("SHOW TABLES;")
-tables = cursor.fetchall()
-table_names = [table[0] for table in tables]
-
-# Define directory paths
-doc_dir = "/home/pranjalgoyal/GenAI/assgn2/docs/table_docs"
-db_dir = "/home/pranjalgoyal/GenAI/assgn2/db/table_db"
-
-# Build a mapping of normalized filenames (without .md) to file paths
-filename_map = {}
-for file in os.listdir(doc_dir):
-    if file.endswith(".md"):
-        name_without_ext = os.path.splitext(file)[0].lower()
-        filename_map[name_without_ext] = os.path.join(doc_dir, file)
-
-# Iterate over the actual table names
-for table_name in table_names:
-    normalized_name = table_name.lower()
-
-    if normalized_name in filename_map:
-        file_path = filename_map[normalized_name]
-        doc_content = get_doc_content(file_path)
-        chunks = get_chunks(doc_content)
-
-        # Init the vector store
-        print(f"Processing: Table '{table_name}' from File '{file_path}'")
-        vector_store = get_vector_store(table_name, db_dir)
-        vector_store.add_documents(chunks, file_name=table_name)
-    else:
-        print(f"Warning: No file found for table '{table_name}'")
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally (re-)embed the table docs.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--processes", type=int, default=4, help="Worker processes reading and splitting the docs")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent embedding requests")
+    parser.add_argument("--token-budget", type=int, default=100000, help="Maximum tokens per embedding request")
+    parser.add_argument("--layout", choices=["per_table", "single"], default="per_table",
+                        help="One collection per table, or a single collection with a 'table' metadata")
+    args = parser.parse_args()
+
+    # Initialize database connection
+    conn, cursor = get_connection()
+
+    # Get all table names
+    cursor.execute("SHOW TABLES;")
+    tables = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    table_names = [table[0] for table in tables]
+
+    # Define directory paths
+    doc_dir = "/home/pranjalgoyal/GenAI/assgn2/docs/table_docs"
+    db_dir = "/home/pranjalgoyal/GenAI/assgn2/db/table_db"
+
+    # The manifest of chunk hashes of every table collection
+    indexer = IncrementalIndexer(os.path.join(db_dir, "manifest.json"))
+
+    # Build a mapping of normalized filenames (without .md) to file paths
+    filename_map = {}
+    for file in os.listdir(doc_dir):
+        if file.endswith(".md"):
+            name_without_ext = os.path.splitext(file)[0].lower()
+            filename_map[name_without_ext] = os.path.join(doc_dir, file)
+
+    # Match the actual table names with their docs
+    table_files = {}
+    for table_name in table_names:
+        normalized_name = table_name.lower()
+
+        if normalized_name in filename_map:
+            table_files[table_name] = filename_map[normalized_name]
+        else:
+            print(f"Warning: No file found for table '{table_name}'")
+
+    build_index(table_files, db_dir, indexer, get_vector_store, get_embeddings(),
+                processes=args.processes, threads=args.threads, token_budget=args.token_budget,
+                dry_run=args.dry_run, layout=args.layout)
+
+
+if __name__ == "__main__":
+    main()
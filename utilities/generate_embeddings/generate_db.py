@@ -1,23 +1,224 @@
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
 from dotenv import load_dotenv
 
+try:
+    from utilities.generate_embeddings.numpy_index import NumpyVectorIndex, NumpyVectorStore
+except ImportError:  # Run as a script from this directory
+    from numpy_index import NumpyVectorIndex, NumpyVectorStore
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utilities.tracing import tracer
+
 load_dotenv()
 
-def get_vector_store(name:str, db_path: str) -> Chroma:
-    """Get the vector store instance."""
-    
-    embeddings = OpenAIEmbeddings(model = "text-embedding-3-large")
+EMBEDDING_MODEL = "text-embedding-3-large"
 
-    vector_store = Chroma(
-        collection_name=name,
-        persist_directory=db_path,
-        embedding_function = embeddings,
-    )
-    return vector_store
+# Collection holding the chunks of every table (tagged with a 'table' metadata) in the single-collection layout
+TABLES_COLLECTION = "all_tables"
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> "OpenAIEmbeddings":
+    """Get the embeddings client used for the documents and the queries (shared by the whole process)."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            # Imported on first use: a numpy index with its own embeddings never needs the OpenAI client
+            from langchain_openai import OpenAIEmbeddings
+            _embeddings = OpenAIEmbeddings(model = EMBEDDING_MODEL)
+        return _embeddings
+
+
+class VectorStoreRegistry:
+    def __init__(self, max_size: int = 64):
+        """
+        A process-wide pool of Chroma collection handles keyed by (collection name, db path).
+        One persistent client is opened per db path and one embeddings client is shared by
+        every handle. The least recently used handles are dropped once max_size is exceeded,
+        except the ones an owner retains (see retain).
+
+        Args:
+            max_size (int): Maximum number of collection handles kept open (retained ones may exceed it).
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stores: "OrderedDict[Tuple[str, str], Chroma]" = OrderedDict()
+        self._clients: Dict[str, "chromadb.ClientAPI"] = {}
+        self._owners: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.RLock()
+
+    def get(self, name: str, db_path: str) -> "Chroma":
+        """Get the shared handle of a collection, opening it on first use."""
+        from langchain_chroma import Chroma
+
+        key = (name, os.path.abspath(db_path))
+
+        with self._lock:
+            if key in self._stores:
+                self.hits += 1
+                self._stores.move_to_end(key)
+                return self._stores[key]
+
+            self.misses += 1
+            vector_store = Chroma(
+                collection_name=name,
+                client=self._get_client(key[1]),
+                embedding_function = get_embeddings(),
+            )
+            self._stores[key] = vector_store
+
+            evictable = [other for other in self._stores if other != key and other not in self._owners]
+            while len(self._stores) > self.max_size and evictable:
+                evicted_key = evictable.pop(0)
+                del self._stores[evicted_key]
+                self.evictions += 1
+                self._release_client(evicted_key[1])
+
+            return vector_store
+
+    def _get_client(self, db_path: str) -> "chromadb.ClientAPI":
+        if db_path not in self._clients:
+            import chromadb
+            self._clients[db_path] = chromadb.PersistentClient(path=db_path)
+        return self._clients[db_path]
 
+    def _release_client(self, db_path: str):
+        # Forget the persistent client once no collection of its directory is pooled anymore. It is
+        # not closed: a thread may still be searching a dropped handle, which keeps it alive
+        if not any(path == db_path for _, path in self._stores):
+            self._clients.pop(db_path, None)
 
+    def stats(self) -> dict:
+        """Hit/miss counters of the registry."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "open_handles": len(self._stores),
+                "retained_handles": len(self._owners),
+                "open_clients": len(self._clients),
+            }
 
+    def retain(self, name: str, db_path: str):
+        """Hold a collection for an owner (a schema bundle) until it calls release."""
+        key = (name, os.path.abspath(db_path))
+        with self._lock:
+            self._owners[key] = self._owners.get(key, 0) + 1
 
+    def release(self, name: str, db_path: str):
+        """Give back a retained collection; the last owner drops its handle, and the client once no
+        handle of the db path is left (they are reopened on next use)."""
+        key = (name, os.path.abspath(db_path))
+        with self._lock:
+            owners = self._owners.pop(key, 0) - 1
+            if owners > 0:
+                self._owners[key] = owners
+                return
+            if self._stores.pop(key, None) is not None:
+                self._release_client(key[1])
+
+    def clear(self):
+        """Drop every pooled handle and client."""
+        with self._lock:
+            paths = {path for _, path in self._stores}
+            self._stores.clear()
+            self._owners.clear()
+            for path in paths:
+                self._release_client(path)
+
+
+registry = VectorStoreRegistry()
+
+# Retrieval backend: "chroma" (default) or "numpy" (see configure_backend)
+_backend = {"name": os.getenv("VECTOR_BACKEND", "chroma"), "index_dir": os.getenv("NUMPY_INDEX_DIR", "db/numpy_index"),
+            "index": None, "embeddings": None}
+_backend_lock = threading.Lock()
+
+def configure_backend(name: str, index_dir: str = "db/numpy_index", embeddings=None):
+    """
+    Select the retrieval backend behind get_vector_store.
+
+    Args:
+        name (str): "chroma" for the persistent Chroma collections, or "numpy" for the in-process
+            NumpyVectorIndex exported by numpy_index.py (every collection in one memory-mapped matrix).
+        index_dir (str): Directory of the numpy index.
+        embeddings: Embeddings client of the numpy index text queries (defaults to get_embeddings()).
+    """
+    if name not in ("chroma", "numpy"):
+        raise ValueError(f"Unknown vector backend '{name}'. Use 'chroma' or 'numpy'.")
+    with _backend_lock:
+        _backend.update(name=name, index_dir=index_dir, index=None, embeddings=embeddings)
+
+def vector_backend() -> str:
+    """The retrieval backend behind get_vector_store: "chroma" or "numpy"."""
+    return _backend["name"]
+
+def get_vector_store(name:str, db_path: str) -> "Chroma":
+    """
+    Get the vector store instance: a pooled Chroma handle (see VectorStoreRegistry), or with the
+    numpy backend a handle on the collection inside the shared NumpyVectorIndex. The numpy index
+    records the Chroma directory of every exported collection, and refuses a collection of another
+    db_path (an index built from documents records none, and serves its collections for any path).
+    """
+    with tracer.span("get_vector_store", collection=name):
+        if _backend["name"] == "numpy":
+            with _backend_lock:
+                if _backend["index"] is None:
+                    _backend["index"] = NumpyVectorIndex(_backend["index_dir"], embeddings=_backend["embeddings"] or get_embeddings())
+                return _backend["index"].store(name, db_path)
+
+        return registry.get(name, db_path)
+
+def similarity_search_by_vectors(vector_store: "Chroma", vectors: List[List[float]], k: int) -> List[List[Document]]:
+    """Top-k documents for many query vectors with a single query to the collection."""
+    if not vectors:
+        return []
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.similarity_search_by_vectors(vectors, k)
+
+    results = vector_store._collection.query(
+        query_embeddings=vectors, n_results=k, include=["documents", "metadatas"]
+    )
+    return [
+        [Document(page_content=doc, metadata=meta or {}) for doc, meta in zip(docs, metas)]
+        for docs, metas in zip(results["documents"], results["metadatas"])
+    ]
+
+def search_tables(vector_store: "Chroma", query_vector: List[float], tables: List[str], k: int) -> Dict[str, List[Document]]:
+    """
+    Top-k chunks of every table with one filtered query of the single multi-table collection.
+    If a few tables took all the returned slots, the others are topped up with a per-table query.
+    """
+    if not tables:
+        return {}
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.search_tables(query_vector, tables, k)
+
+    where = {"table": tables[0]} if len(tables) == 1 else {"table": {"$in": list(tables)}}
+    n_results = k * len(tables)
+    results = vector_store._collection.query(
+        query_embeddings=[query_vector], n_results=n_results, where=where, include=["documents", "metadatas"]
+    )
+    docs, metas = results["documents"][0], results["metadatas"][0]
 
+    found = {table: [] for table in tables}
+    for doc, meta in zip(docs, metas):
+        table = (meta or {}).get("table")
+        if table in found and len(found[table]) < k:
+            found[table].append(Document(page_content=doc, metadata=meta))
 
+    if len(docs) == n_results:
+        for table in tables:
+            if len(found[table]) < k:
+                found[table] = vector_store.similarity_search_by_vector(query_vector, k=k, filter={"table": table})
+    return found
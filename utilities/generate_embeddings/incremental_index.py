@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+
+
+def get_section_key(chunk: Document) -> str:
+    """The header path of a chunk, e.g. '2. Table Summaries > a. brands'."""
+    return " > ".join(str(value) for _, value in sorted(chunk.metadata.items()) if value)
+
+
+def get_chunk_ids(collection_name: str, chunks: List[Document]) -> List[str]:
+    """
+    Stable ids of the chunks of a document: one per header section, so an edited
+    section keeps its id and a removed section's id disappears.
+    """
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        section = get_section_key(chunk)
+        occurrence = seen.get(section, 0)
+        seen[section] = occurrence + 1
+        ids.append(hashlib.sha256(f"{collection_name}\n{section}\n{occurrence}".encode("utf-8")).hexdigest())
+    return ids
+
+
+def get_content_hash(chunk: Document) -> str:
+    payload = json.dumps([chunk.page_content, chunk.metadata], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IncrementalIndexer:
+    def __init__(self, manifest_path: str):
+        """
+        Keeps a manifest of the content hash of every chunk of every collection, so that
+        re-indexing only embeds new or changed chunks and deletes the chunks of removed sections.
+
+        Args:
+            manifest_path (str): Path of the JSON manifest ({collection: {chunk_id: content_hash}}).
+        """
+        self.manifest_path = manifest_path
+        self.manifest: Dict[str, Dict[str, str]] = {}
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+
+    def save(self):
+        directory = os.path.dirname(self.manifest_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.manifest_path, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+
+    def diff(self, collection_name: str, vector_store, chunks: List[Document], where: Optional[dict] = None) -> dict:
+        """
+        Compare the current chunks of a document with the manifest and the collection.
+        When several documents share a collection, where selects the chunks of this document.
+
+        Returns:
+            dict: The ids of the added, changed and removed chunks, the number unchanged, plus
+            "ids", "hashes" and "to_embed" (indices of the chunks to embed) used to apply it.
+        """
+        ids = get_chunk_ids(collection_name, chunks)
+        hashes = [get_content_hash(chunk) for chunk in chunks]
+        previous = self.manifest.get(collection_name, {})
+
+        # The collection itself is the reference for deletions, so duplicates of older runs are cleaned up too
+        existing_ids = set(vector_store.get(where=where, include=[])["ids"])
+
+        added = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing_ids]
+        changed = [i for i, chunk_id in enumerate(ids)
+                   if chunk_id in existing_ids and previous.get(chunk_id) != hashes[i]]
+
+        return {
+            "collection": collection_name,
+            "added": [ids[i] for i in added],
+            "changed": [ids[i] for i in changed],
+            "removed": sorted(existing_ids - set(ids)),
+            "unchanged": len(ids) - len(added) - len(changed),
+            "ids": ids,
+            "hashes": hashes,
+            "to_embed": sorted(added + changed),
+        }
+
+    def record(self, report: dict):
+        """Save the chunk hashes of a collection once its changes have been written."""
+        self.manifest[report["collection"]] = dict(zip(report["ids"], report["hashes"]))
+        self.save()
+
+    def sync(self, collection_name: str, vector_store, chunks: List[Document], dry_run: bool = False, **kwargs) -> dict:
+        """
+        Bring a collection in line with the given chunks.
+
+        Args:
+            collection_name (str): Name of the collection (key in the manifest).
+            vector_store: The Chroma collection to update.
+            chunks (List[Document]): The current chunks of the source document.
+            dry_run (bool): Only report what would change, without embedding or deleting anything.
+            **kwargs: Passed to vector_store.add_documents.
+
+        Returns:
+            dict: The report of diff().
+        """
+        report = self.diff(collection_name, vector_store, chunks)
+        if dry_run:
+            return report
+
+        if report["removed"] or report["changed"]:
+            vector_store.delete(ids=report["removed"] + report["changed"])
+
+        to_embed = report["to_embed"]
+        if to_embed:
+            # A single add_documents call: the embeddings are requested in batches, not one by one
+            vector_store.add_documents([chunks[i] for i in to_embed], ids=[report["ids"][i] for i in to_embed], **kwargs)
+
+        self.record(report)
+        return report
+
+
+def print_report(report: dict, dry_run: bool = False):
+    prefix = "[DRY RUN] " if dry_run else ""
+    print(f"{prefix}{report['collection']}: {len(report['added'])} added, {len(report['changed'])} changed, "
+          f"{len(report['removed'])} removed, {report['unchanged']} unchanged")
@@ -0,0 +1,339 @@
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict, deque
+from typing import Dict, List, Optional
+
+# Weight of every field of a table in the term frequencies (BM25F style)
+FIELD_WEIGHTS = {"name": 3.0, "keywords": 2.0, "columns": 1.0}
+
+# Confidence the fast path needs by default, calibrated on benchmark/questions.jsonl (see LexicalRouter.calibrate)
+DEFAULT_THRESHOLD = 0.2
+
+# Words of the question that say nothing about the tables
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "for", "to", "from", "by", "with", "and", "or", "not", "no",
+    "is", "are", "was", "were", "be", "been", "has", "have", "had", "do", "does", "did", "it", "its", "their",
+    "this", "that", "these", "those", "there", "than", "then", "as", "into", "per", "each", "every", "any",
+    "all", "some", "more", "most", "less", "least", "many", "much", "what", "which", "who", "whose", "where",
+    "when", "how", "why", "list", "show", "find", "get", "give", "display", "return", "me", "us", "we", "i",
+    "along", "also", "only", "between", "over", "under", "above", "below", "top", "both", "same", "s",
+}
+
+
+def _stem(token: str) -> str:
+    """Light plural stripping, applied to the index and the question alike."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("sses"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased, stemmed words of a text; snake_case names are split into their words."""
+    return [_stem(token) for token in re.findall(r"[a-z0-9]+", text.lower()) if not token.isdigit()]
+
+
+def parse_overview(overview_text: str) -> Dict[str, dict]:
+    """
+    Fields of every table summary of the overview doc ('### a. brands' sections): its name,
+    the **Keywords** line, the backticked important fields and the tables of its **Connects to** part.
+    """
+    tables = {}
+    for section in re.split(r"^### ", overview_text, flags=re.MULTILINE)[1:]:
+        name_match = re.search(r"\*\*name\*\*\s*:\s*(\w+)", section)
+        if name_match is None:
+            continue
+        name = name_match.group(1).lower()
+
+        keywords = re.search(r"\*\*Keywords\*\*:\s*(.+)", section)
+        connects = re.search(r"\*\*Connects to\*\*:(.*?)(?=^- \*\*|\Z)", section, flags=re.MULTILINE | re.DOTALL)
+        tables[name] = {
+            "keywords": keywords.group(1) if keywords else "",
+            "columns": re.findall(r"`(\w+)`", section.split("**Connects to**")[0]),
+            "connects": connects.group(1) if connects else "",
+        }
+    return tables
+
+
+def parse_table_doc(doc_text: str) -> List[str]:
+    """Column names of the Columns table of a table doc."""
+    return re.findall(r"^\|\s*`(\w+)`\s*\|", doc_text, flags=re.MULTILINE)
+
+
+class LexicalTableIndex:
+    def __init__(self, index_path: str):
+        """
+        BM25 index over the curated table descriptions (name, Keywords line and column names),
+        used to propose the broad and seed tables of a question without an LLM call.
+
+        Args:
+            index_path (str): JSON file written by build().
+        """
+        with open(index_path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+
+        self.tables: List[str] = index["tables"]
+        self.connects: Dict[str, List[str]] = index["connects"]
+        self.term_freqs: Dict[str, Dict[str, float]] = index["term_freqs"]
+        self.lengths: Dict[str, float] = index["lengths"]
+        self.avg_length = sum(self.lengths.values()) / max(1, len(self.lengths))
+
+        doc_freq = Counter(term for freqs in self.term_freqs.values() for term in freqs)
+        n = len(self.tables)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+        # An unknown word is as specific as a word of a single table
+        self.max_idf = math.log(1 + (n - 0.5) / 1.5) if n else 0.0
+
+    @staticmethod
+    def build(overview_path: str, table_docs_dir: str, index_path: str):
+        """
+        Build the index from the overview doc and the table docs, and write it to index_path.
+
+        Args:
+            overview_path (str): Path of docs/overview.md.
+            table_docs_dir (str): Directory of the table docs (<table>.md).
+            index_path (str): Output JSON file.
+        """
+        with open(overview_path, "r", encoding="utf-8") as file:
+            tables = parse_overview(file.read())
+
+        if os.path.isdir(table_docs_dir):
+            for file_name in sorted(os.listdir(table_docs_dir)):
+                name = os.path.splitext(file_name)[0].lower()
+                if name in tables and file_name.endswith(".md"):
+                    with open(os.path.join(table_docs_dir, file_name), "r", encoding="utf-8") as file:
+                        tables[name]["columns"] = list(dict.fromkeys(tables[name]["columns"] + parse_table_doc(file.read())))
+
+        term_freqs = {}
+        lengths = {}
+        connects = {}
+        for name, fields in tables.items():
+            freqs = defaultdict(float)
+            for field, text in (("name", name), ("keywords", fields["keywords"]), ("columns", " ".join(fields["columns"]))):
+                for term in tokenize(text):
+                    freqs[term] += FIELD_WEIGHTS[field]
+            term_freqs[name] = dict(freqs)
+            lengths[name] = sum(freqs.values())
+
+            # 'Order Items (via `order_id`)' -> order_items
+            linked = {match.strip().lower().replace(" ", "_") for match in re.findall(r"([A-Za-z][A-Za-z ]*?)\s*\(via", fields["connects"])}
+            connects[name] = [other for other in tables if other != name and other in linked]
+
+        directory = os.path.dirname(index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(index_path, "w", encoding="utf-8") as file:
+            json.dump({"tables": sorted(tables), "connects": connects, "term_freqs": term_freqs, "lengths": lengths},
+                      file, indent=2, sort_keys=True)
+
+    def _term_score(self, table: str, term: str, k1: float = 1.2, b: float = 0.75) -> float:
+        tf = self.term_freqs[table].get(term, 0.0)
+        if not tf:
+            return 0.0
+        norm = k1 * (1 - b + b * self.lengths[table] / self.avg_length)
+        return self.idf[term] * tf * (k1 + 1) / (tf + norm)
+
+    def propose(self, question: str, min_share: float = 0.3, min_votes: int = 2, distinct: float = 2.0) -> dict:
+        """
+        Propose the tables of a question.
+
+        A table named in the question ('order items', 'brands') is a seed, unless its name only
+        qualifies the next one ('product categories'). Every other specific word of the question
+        (found in at most half of the tables) votes for the table it scores highest in, when it
+        scores at least `distinct` times lower in every other table; a table with min_votes votes
+        is a seed too. The broad tables are the seeds, the tables they connect to, and any table
+        scoring at least min_share of the best score.
+
+        The confidence is the margin between the seeds and the other tables (1 - the best other
+        score / the weakest seed score), times the idf-weighted share of the question's words
+        found in the index (the coverage).
+
+        Returns:
+            dict: {"broad_tables", "seed_tables", "confidence", "margin", "coverage", "scores"}
+        """
+        words = tokenize(question)
+        terms = [term for term in words if term not in STOPWORDS]
+        matched = [term for term in dict.fromkeys(terms) if term in self.idf]
+
+        total_weight = sum(self.idf.get(term, self.max_idf) for term in terms)
+        coverage = sum(self.idf[term] for term in terms if term in self.idf) / total_weight if total_weight else 0.0
+
+        contributions = {table: {term: self._term_score(table, term) for term in matched} for table in self.tables}
+        scores = {table: sum(terms_score.values()) for table, terms_score in contributions.items()}
+
+        seeds = []
+        unused = Counter(terms)
+        names = {table: tokenize(table) for table in self.tables}
+        first_terms = {name_terms[0] for name_terms in names.values() if name_terms}
+        # Longest names first, so 'order items' is not also read as 'orders'
+        for table in sorted(self.tables, key=lambda name: -len(names[name])):
+            name_terms = Counter(names[table])
+            if not all(unused[term] >= count for term, count in name_terms.items()):
+                continue
+            unused -= name_terms
+            last = names[table][-1]
+            if not any(word == last and following in first_terms and following != last
+                       for word, following in zip(words, words[1:])):
+                seeds.append(table)
+
+        votes = Counter()
+        for term in matched:
+            # A generic word (e.g. 'name', 'id') does not point to a table
+            if not unused[term] or sum(1 for table in self.tables if contributions[table][term] > 0) > len(self.tables) / 2:
+                continue
+            ranked = sorted(self.tables, key=lambda table: -contributions[table][term])
+            second = contributions[ranked[1]][term] if len(ranked) > 1 else 0.0
+            if contributions[ranked[0]][term] >= distinct * second:
+                votes[ranked[0]] += 1
+        # A single word (e.g. 'last' of last_name) is too weak to add a table
+        seeds.extend(table for table, count in votes.items() if count >= min_votes and table not in seeds)
+        seeds.sort(key=scores.get, reverse=True)
+
+        weakest = min((scores[table] for table in seeds), default=0.0)
+        runner_up = max((score for table, score in scores.items() if table not in seeds), default=0.0)
+        margin = max(0.0, 1 - runner_up / weakest) if weakest > 0 else 0.0
+
+        top = max(scores.values(), default=0.0)
+        broad = list(seeds)
+        for table in seeds:
+            broad.extend(other for other in self.connects.get(table, []) if other not in broad)
+        broad.extend(table for table in sorted(scores, key=scores.get, reverse=True)
+                     if table not in broad and top > 0 and scores[table] >= min_share * top)
+
+        return {"broad_tables": broad, "seed_tables": seeds, "confidence": margin * coverage, "margin": margin,
+                "coverage": coverage, "scores": {table: score for table, score in scores.items() if score > 0}}
+
+
+class LexicalRouter:
+    def __init__(self, index: LexicalTableIndex, threshold: float = DEFAULT_THRESHOLD, audit_rate: float = 0.0,
+                 max_samples: int = 10000):
+        """
+        Decides, question by question, whether the lexical proposal replaces the Level 1 and
+        seed table LLM calls, and keeps the report of how often it fires and agrees with the LLM.
+
+        Args:
+            index (LexicalTableIndex): The lexical index of the tables.
+            threshold (float): Confidence needed to skip the LLM calls.
+            audit_rate (float): Share of the fast-path questions for which the LLM still runs,
+                only to measure the agreement (its answer is not used).
+            max_samples (int): Compared questions kept to calibrate the threshold (see calibrate).
+        """
+        self.index = index
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.questions = 0
+        self.fired = 0
+        self.compared = {True: 0, False: 0}
+        self.agreed = {True: 0, False: 0}
+        self.overlap = {True: 0.0, False: 0.0}
+        # (confidence, agreed with the LLM) of the compared questions, to calibrate the threshold
+        self.samples = deque(maxlen=max_samples)
+        self._audit_credit = 0.0
+        self._lock = threading.Lock()
+
+    def route(self, question: str, known_tables=None) -> dict:
+        """
+        The lexical proposal of a question, with "fire" set when it is confident enough and
+        "audit" set when the LLM must run anyway to check it. Tables missing from known_tables
+        (the knowledge graph) are dropped.
+        """
+        proposal = self.index.propose(question)
+        if known_tables is not None:
+            proposal["seed_tables"] = [table for table in proposal["seed_tables"] if table in known_tables]
+            proposal["broad_tables"] = [table for table in proposal["broad_tables"] if table in known_tables]
+
+        fire = proposal["confidence"] >= self.threshold and bool(proposal["seed_tables"])
+        with self._lock:
+            self.questions += 1
+            self.fired += fire
+            audit = False
+            if fire and self.audit_rate > 0:
+                # Deterministic sampling: every 1/audit_rate-th fast-path question is audited
+                self._audit_credit += self.audit_rate
+                if self._audit_credit >= 1.0:
+                    self._audit_credit -= 1.0
+                    audit = True
+
+        proposal["fire"] = fire
+        proposal["audit"] = audit
+        return proposal
+
+    def record(self, proposal: dict, llm_seed_tables: List[str]):
+        """Compare a proposal with the seed tables the LLM picked for the same question."""
+        lexical = set(proposal["seed_tables"])
+        llm = set(llm_seed_tables)
+        union = lexical | llm
+        with self._lock:
+            self.compared[proposal["fire"]] += 1
+            self.agreed[proposal["fire"]] += lexical == llm
+            self.overlap[proposal["fire"]] += len(lexical & llm) / len(union) if union else 1.0
+            self.samples.append((proposal["confidence"], lexical == llm))
+
+    def calibrate(self, min_agreement: float = 1.0, min_samples: int = 20) -> Optional[float]:
+        """
+        The lowest threshold at which the compared questions that would have fired agreed with the
+        LLM at least min_agreement of the time (None below min_samples compared questions, or if
+        no threshold reaches it). The questions that fell back are compared on every run, so a run
+        with a high threshold (or audit_rate=1) measures every confidence level.
+        """
+        with self._lock:
+            samples = sorted(self.samples, key=lambda sample: -sample[0])
+        if len(samples) < min_samples:
+            return None
+
+        best = None
+        agreed = 0
+        for i, (confidence, agrees) in enumerate(samples):
+            agreed += agrees
+            # A threshold fires every question of its confidence, so only cut between two levels
+            last_of_level = i + 1 == len(samples) or samples[i + 1][0] < confidence
+            if confidence > 0 and last_of_level and agreed / (i + 1) >= min_agreement:
+                best = confidence
+        return best
+
+    def stats(self) -> dict:
+        """Fire rate of the fast path, its agreement with the LLM for fired and not fired questions, and the
+        threshold calibrated on the compared questions."""
+        with self._lock:
+            stats = {
+                "questions": self.questions,
+                "fired": self.fired,
+                "fire_rate": self.fired / self.questions if self.questions else 0.0,
+            }
+            for fire, label in ((True, "fired"), (False, "fallback")):
+                compared = self.compared[fire]
+                stats[label + "_compared"] = compared
+                stats[label + "_agreement"] = self.agreed[fire] / compared if compared else None
+                stats[label + "_jaccard"] = self.overlap[fire] / compared if compared else None
+        stats["calibrated_threshold"] = self.calibrate()
+        return stats
+
+
+def load_router(index_path: str, threshold: float = DEFAULT_THRESHOLD, audit_rate: float = 0.0) -> Optional[LexicalRouter]:
+    """The router of the lexical index at index_path, or None if it has not been built."""
+    if not os.path.exists(index_path):
+        print(f"[ERROR] No lexical index at {index_path}, the lexical fast path is disabled")
+        return None
+    return LexicalRouter(LexicalTableIndex(index_path), threshold=threshold, audit_rate=audit_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the lexical (BM25) index of the tables.")
+    parser.add_argument("--overview", default="docs/overview.md", help="Path of the overview doc")
+    parser.add_argument("--table-docs", default="docs/table_docs", help="Directory of the table docs")
+    parser.add_argument("--out", default="db/lexical_index.json", help="Output JSON file")
+    args = parser.parse_args()
+
+    LexicalTableIndex.build(args.overview, args.table_docs, args.out)
+    print(f"Lexical index written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+
+class NumpyVectorIndex:
+    def __init__(self, index_dir: str, embeddings=None):
+        """
+        In-process vector index holding the chunks of every collection (overview and tables).
+
+        All chunk embeddings are one float32 matrix (vectors.npy, memory-mapped) and index.json
+        maps each row to its collection and chunk. The rows of a collection are contiguous, so
+        a query over any set of collections is a single matrix-vector product.
+
+        Args:
+            index_dir (str): Directory written by build_from_chroma().
+            embeddings: Embeddings client, only needed for text queries (similarity_search).
+        """
+        self.index_dir = index_dir
+        self.embeddings = embeddings
+        self.matrix = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+
+        with open(os.path.join(index_dir, "index.json"), "r", encoding="utf-8") as file:
+            index = json.load(file)
+        self.collections: Dict[str, dict] = index["collections"]
+        self.chunks: List[dict] = index["chunks"]
+
+        # Squared norms, for the l2 distance used by Chroma by default
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self._stores = {}
+
+    @staticmethod
+    def build_from_chroma(collections: Dict[str, str], index_dir: str):
+        """
+        Export Chroma collections into a numpy index.
+
+        Args:
+            collections (Dict[str, str]): Collection name -> Chroma persist directory.
+            index_dir (str): Output directory.
+        """
+        import chromadb
+
+        vectors = []
+        chunks = []
+        layout = {}
+        clients = {}
+        for name, db_path in collections.items():
+            if db_path not in clients:
+                clients[db_path] = chromadb.PersistentClient(path=db_path)
+            collection = clients[db_path].get_collection(name)
+            data = collection.get(include=["embeddings", "documents", "metadatas"])
+
+            start = len(chunks)
+            for chunk_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+                chunks.append({"collection": name, "id": chunk_id, "document": document, "metadata": metadata or {}})
+            if len(data["ids"]):
+                vectors.append(np.asarray(data["embeddings"], dtype=np.float32))
+            space = (collection.metadata or {}).get("hnsw:space", "l2")
+            layout[name] = {"start": start, "end": len(chunks), "space": space, "source": os.path.abspath(db_path)}
+            print(f"Exported {name}: {len(chunks) - start} chunks ({space})")
+
+        NumpyVectorIndex._write(index_dir, vectors, layout, chunks)
+
+    @staticmethod
+    def build_from_documents(collections: Dict[str, List[Document]], embeddings, index_dir: str, space: str = "l2"):
+        """
+        Embed documents straight into a numpy index, without Chroma.
+
+        Args:
+            collections (Dict[str, List[Document]]): Collection name -> its chunks.
+            embeddings: Embeddings client (embed_documents is called once per collection).
+            index_dir (str): Output directory.
+            space (str): Distance of every collection ("l2", "cosine" or "ip").
+        """
+        vectors = []
+        chunks = []
+        layout = {}
+        for name, documents in collections.items():
+            start = len(chunks)
+            for i, document in enumerate(documents):
+                chunks.append({"collection": name, "id": document.id or f"{name}-{i}",
+                               "document": document.page_content, "metadata": document.metadata or {}})
+            if documents:
+                vectors.append(np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]), dtype=np.float32))
+            layout[name] = {"start": start, "end": len(chunks), "space": space}
+
+        NumpyVectorIndex._write(index_dir, vectors, layout, chunks)
+
+    @staticmethod
+    def _write(index_dir: str, vectors: List[np.ndarray], layout: Dict[str, dict], chunks: List[dict]):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, "vectors.npy"), np.vstack(vectors) if vectors else np.empty((0, 0), np.float32))
+        with open(os.path.join(index_dir, "index.json"), "w", encoding="utf-8") as file:
+            json.dump({"collections": layout, "chunks": chunks}, file)
+
+    def _scores(self, name: str, dots: np.ndarray) -> np.ndarray:
+        """Distances of the rows of a collection (lower is closer), matching the collection's Chroma space."""
+        spec = self.collections[name]
+        rows = slice(spec["start"], spec["end"])
+        if spec["space"] == "ip":
+            return 1.0 - dots[rows]
+        if spec["space"] == "cosine":
+            return 1.0 - dots[rows] / np.sqrt(np.maximum(self.sq_norms[rows], 1e-12))
+        return self.sq_norms[rows] - 2.0 * dots[rows]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if k >= len(scores):
+            return np.argsort(scores, kind="stable")
+        top = np.argpartition(scores, k)[:k]
+        return top[np.argsort(scores[top], kind="stable")]
+
+    def _document(self, row: int) -> Document:
+        chunk = self.chunks[row]
+        return Document(page_content=chunk["document"], metadata=chunk["metadata"], id=chunk["id"])
+
+    def search(self, query_vectors: Sequence[Sequence[float]], k_per_collection: Dict[str, int],
+               filters: Optional[Dict[str, dict]] = None) -> List[Dict[str, List[Document]]]:
+        """
+        Top-k chunks of several collections for several query vectors, with one matrix product.
+
+        Args:
+            query_vectors: The query embeddings.
+            k_per_collection (Dict[str, int]): Number of chunks wanted from each collection.
+            filters (Dict[str, dict], optional): Per collection metadata equality filter, e.g. {"table": "brands"}.
+
+        Returns:
+            List[Dict[str, List[Document]]]: For each query, the ranked chunks of each collection.
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        dots = queries @ self.matrix.T if len(self.matrix) else np.empty((len(queries), 0), np.float32)
+
+        results = []
+        for query_dots in dots:
+            found = {}
+            for name, k in k_per_collection.items():
+                if name not in self.collections:
+                    found[name] = []
+                    continue
+                start = self.collections[name]["start"]
+                scores = self._scores(name, query_dots)
+
+                where = (filters or {}).get(name)
+                if where:
+                    rows = [i for i in range(len(scores))
+                            if all(self.chunks[start + i]["metadata"].get(key) == value for key, value in where.items())]
+                    rows = np.asarray(rows, dtype=np.int64)
+                    order = rows[self._top_k(scores[rows], k)] if len(rows) else rows
+                else:
+                    order = self._top_k(scores, k)
+                found[name] = [self._document(start + int(i)) for i in order]
+            results.append(found)
+        return results
+
+    def store(self, name: str, db_path: Optional[str] = None) -> "NumpyVectorStore":
+        """
+        Vector-store style handle of one collection. With db_path, the collection must have been
+        exported from that Chroma directory (collections of the same name in other directories
+        are other collections).
+        """
+        source = self.collections.get(name, {}).get("source")
+        if db_path is not None and source is not None and source != os.path.abspath(db_path):
+            raise ValueError(f"The numpy index at {self.index_dir} holds the {name} collection of {source}, "
+                             f"not the one of {os.path.abspath(db_path)}")
+        if name not in self._stores:
+            self._stores[name] = NumpyVectorStore(self, name)
+        return self._stores[name]
+
+
+class NumpyVectorStore:
+    def __init__(self, index: NumpyVectorIndex, name: str):
+        """The subset of the Chroma vector store API used by the pipeline, served by a NumpyVectorIndex."""
+        self.index = index
+        self.name = name
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Document]:
+        filters = {self.name: filter} if filter else None
+        return self.index.search([embedding], {self.name: k}, filters)[0][self.name]
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(embedding, k=k, filter=filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs) -> List[Document]:
+        return self.similarity_search_by_vector(self.index.embeddings.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vectors(self, vectors: List[List[float]], k: int) -> List[List[Document]]:
+        """Top-k chunks for many query vectors (one matrix product)."""
+        if not vectors:
+            return []
+        return [found[self.name] for found in self.index.search(vectors, {self.name: k})]
+
+    def search_tables(self, query_vector: List[float], tables: List[str], k: int) -> Dict[str, List[Document]]:
+        """Top-k chunks of every table of a single multi-table collection (one matrix product)."""
+        spec = self.index.collections.get(self.name)
+        if spec is None:
+            return {table: [] for table in tables}
+
+        start = spec["start"]
+        scores = self.index._scores(self.name, np.asarray(self.index.matrix @ np.asarray(query_vector, dtype=np.float32)))
+        rows_by_table = self._rows_by_table()
+
+        found = {}
+        for table in tables:
+            rows = rows_by_table.get(table, np.empty(0, dtype=np.int64))
+            order = rows[self.index._top_k(scores[rows], k)] if len(rows) else rows
+            found[table] = [self.index._document(start + int(i)) for i in order]
+        return found
+
+    def _rows_by_table(self) -> Dict[str, np.ndarray]:
+        # Rows (relative to the collection start) of every table, computed once
+        if not hasattr(self, "_table_rows"):
+            spec = self.index.collections[self.name]
+            rows = {}
+            for i, chunk in enumerate(self.index.chunks[spec["start"]:spec["end"]]):
+                rows.setdefault(chunk["metadata"].get("table"), []).append(i)
+            self._table_rows = {table: np.asarray(indices, dtype=np.int64) for table, indices in rows.items()}
+        return self._table_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Chroma collections into a numpy vector index.")
+    parser.add_argument("--overview-db", default="db/overview_db", help="Persist directory of the overview collection")
+    parser.add_argument("--table-db", default="db/table_db", help="Persist directory of the table collections")
+    parser.add_argument("--out", default="db/numpy_index", help="Output directory of the numpy index")
+    args = parser.parse_args()
+
+    import chromadb
+
+    collections = {"overview": args.overview_db}
+    for collection in chromadb.PersistentClient(path=args.table_db).list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        collections[name] = args.table_db
+
+    NumpyVectorIndex.build_from_chroma(collections, args.out)
+
+
+if __name__ == "__main__":
+    main()
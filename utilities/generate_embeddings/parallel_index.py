@@ -0,0 +1,164 @@
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from retrieve_doc import get_doc_content, get_chunks
+from incremental_index import IncrementalIndexer, print_report
+from generate_db import TABLES_COLLECTION
+
+# Maximum number of inputs the embeddings API accepts in one request
+MAX_BATCH_INPUTS = 2048
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token), good enough to size the batches."""
+    return max(1, len(text) // 4)
+
+
+def parse_table_doc(item: Tuple[str, str]) -> Tuple[str, List[Document]]:
+    """Read and split the doc of one table (runs in a worker process)."""
+    table_name, file_path = item
+    return table_name, get_chunks(get_doc_content(file_path))
+
+
+def pack_batches(items: List[Tuple[str, int, str]], token_budget: int) -> List[List[Tuple[str, int, str]]]:
+    """
+    Pack (table, chunk index, text) items from many tables into embedding batches that
+    stay under token_budget tokens and MAX_BATCH_INPUTS inputs.
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for item in items:
+        tokens = estimate_tokens(item[2])
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= MAX_BATCH_INPUTS):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Progress:
+    def __init__(self, total_chunks: int, total_batches: int):
+        self.total_chunks = total_chunks
+        self.total_batches = total_batches
+        self.chunks = 0
+        self.tokens = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def update(self, batch: List[Tuple[str, int, str]]):
+        with self._lock:
+            self.chunks += len(batch)
+            self.tokens += sum(estimate_tokens(text) for _, _, text in batch)
+            self.batches += 1
+            elapsed = time.perf_counter() - self.started
+            print(f"Embedded batch {self.batches}/{self.total_batches}: {self.chunks}/{self.total_chunks} chunks, "
+                  f"{self.chunks / elapsed:.1f} chunks/s, {self.tokens / elapsed:.0f} tokens/s")
+
+
+def build_index(table_files: Dict[str, str], db_dir: str, indexer: IncrementalIndexer, get_vector_store, embeddings,
+                processes: int = 4, threads: int = 4, token_budget: int = 100000, dry_run: bool = False,
+                layout: str = "per_table") -> List[dict]:
+    """
+    Builds the table collections in parallel.
+
+    1. A process pool reads and splits every table doc.
+    2. The chunks to (re-)embed are found with the incremental manifest.
+    3. A bounded thread pool embeds them in large batches packed across tables under token_budget.
+    4. Every collection gets a single bulk write (delete of stale ids + upsert of new vectors).
+
+    With layout="single" every chunk goes to the TABLES_COLLECTION collection, tagged with
+    a 'table' metadata, instead of one collection per table.
+
+    Args:
+        table_files (Dict[str, str]): Table name -> path of its markdown doc.
+        db_dir (str): Persist directory of the table collections.
+        indexer (IncrementalIndexer): The manifest of the table collections.
+        get_vector_store: Function (name, db_path) -> Chroma collection.
+        embeddings: The embeddings client (embed_documents is called once per batch).
+        processes (int): Worker processes parsing the docs.
+        threads (int): Concurrent embedding requests.
+        token_budget (int): Maximum estimated tokens per embedding request.
+        dry_run (bool): Only report what would change.
+        layout (str): "per_table" (one collection per table) or "single" (one collection for all tables).
+
+    Returns:
+        List[dict]: The incremental report of every table.
+    """
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        parsed = dict(pool.map(parse_table_doc, sorted(table_files.items())))
+    print(f"Parsed {len(parsed)} table docs in {time.perf_counter() - started:.2f}s")
+
+    reports = {}
+    stores = {}
+    for table_name, chunks in parsed.items():
+        if layout == "single":
+            for chunk in chunks:
+                chunk.metadata["table"] = table_name
+            stores[table_name] = get_vector_store(TABLES_COLLECTION, db_dir)
+            reports[table_name] = indexer.diff(f"{TABLES_COLLECTION}/{table_name}", stores[table_name], chunks,
+                                               where={"table": table_name})
+        else:
+            stores[table_name] = get_vector_store(table_name, db_dir)
+            reports[table_name] = indexer.diff(table_name, stores[table_name], chunks)
+        print_report(reports[table_name], dry_run)
+
+    if dry_run:
+        return list(reports.values())
+
+    items = [(table_name, i, parsed[table_name][i].page_content)
+             for table_name, report in reports.items() for i in report["to_embed"]]
+    batches = pack_batches(items, token_budget)
+    progress = Progress(len(items), len(batches))
+    vectors = {}
+
+    def _embed(batch):
+        return batch, embeddings.embed_documents([text for _, _, text in batch])
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in as_completed([pool.submit(_embed, batch) for batch in batches]):
+            batch, batch_vectors = future.result()
+            for (table_name, i, _), vector in zip(batch, batch_vectors):
+                vectors[(table_name, i)] = vector
+            progress.update(batch)
+
+    # Gather the writes per collection (all tables share one in the single layout)
+    writes = {}
+    for table_name, report in reports.items():
+        collection_name = TABLES_COLLECTION if layout == "single" else table_name
+        write = writes.setdefault(collection_name, {"store": stores[table_name], "stale": [], "ids": [],
+                                                    "embeddings": [], "documents": [], "metadatas": []})
+        write["stale"].extend(report["removed"] + report["changed"])
+        for i in report["to_embed"]:
+            chunk = parsed[table_name][i]
+            write["ids"].append(report["ids"][i])
+            write["embeddings"].append(vectors[(table_name, i)])
+            write["documents"].append(chunk.page_content)
+            write["metadatas"].append(chunk.metadata or None)
+
+    for write in writes.values():
+        collection = write["store"]._collection
+        if write["stale"]:
+            collection.delete(ids=write["stale"])
+        if write["ids"]:
+            collection.upsert(ids=write["ids"], embeddings=write["embeddings"],
+                              documents=write["documents"], metadatas=write["metadatas"])
+
+    for report in reports.values():
+        indexer.record(report)
+
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {len(items)} chunks from {len(parsed)} tables in {elapsed:.2f}s "
+          f"({len(items) / elapsed:.1f} chunks/s)")
+    return list(reports.values())
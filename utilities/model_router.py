@@ -0,0 +1,459 @@
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable
+
+from utilities.tracing import tracer
+
+# Stage settings used when a stage (or the "default" entry) does not set them
+DEFAULT_STAGE_CONFIG = {
+    "providers": [],
+    "budget": None,          # Seconds allowed for the stage call (to the first chunk when streaming)
+    "hedge": True,           # Send a duplicate request to the next provider when the first one is slow
+    "hedge_after": None,     # Seconds before hedging; None uses the observed hedge_quantile latency
+    "hedge_quantile": 0.95,
+    "min_samples": 20,       # Calls of a provider observed before its quantile is trusted
+}
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Every provider of a stage is refused by its circuit breaker."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        """
+        Stops sending requests to a provider after failure_threshold consecutive failures. After
+        reset_after seconds a single probe request is let through: its success closes the circuit
+        again, its failure keeps it open for another reset_after seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing or time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self) -> bool:
+        return self.acquire() is not None
+
+    def acquire(self) -> Optional[str]:
+        """Let a request through: "call" when the circuit is closed, "probe" for the single probe of
+        a half-open circuit, None when it is refused."""
+        with self._lock:
+            if self.opened_at is None:
+                return "call"
+            if self.probing or time.monotonic() - self.opened_at < self.reset_after:
+                return None
+            self.probing = True
+            return "probe"
+
+    def abandon(self):
+        """The probe ended without an outcome (cancelled): the next request may probe again."""
+        with self._lock:
+            self.probing = False
+
+    def record(self, success: bool):
+        with self._lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+                return
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 200):
+        """The latencies of the last `size` successful calls of a provider for a stage."""
+        self.values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.values.append(seconds)
+
+    def quantile(self, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self.values) < max(1, min_samples):
+                return None
+            values = sorted(self.values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StageRouter(Runnable):
+    def __init__(self, router: "ModelRouter", stage: str, models: List[Tuple[str, Any]], config: dict):
+        """
+        The model of one pipeline stage, sending every call to the first provider whose circuit is
+        closed. A provider that fails hands over to the next one at once; one that is slower than
+        the hedge delay gets a duplicate request on the next provider, and the first response wins
+        (the async calls of the loser are cancelled, the sync ones are left to finish in the
+        background). A call still unanswered after the stage budget raises TimeoutError.
+        """
+        self.router = router
+        self.stage = stage
+        self.models = models
+        self.config = config
+
+    @property
+    def model_name(self) -> str:
+        # Part of the stage cache key: any provider of the stage may have produced a result
+        return "router:" + ",".join(getattr(model, "model_name", name) for name, model in self.models)
+
+    @property
+    def temperature(self) -> Optional[float]:
+        return getattr(self.models[0][1], "temperature", None) if self.models else None
+
+    def with_structured_output(self, schema, **kwargs) -> "StageRouter":
+        models = [(name, model.with_structured_output(schema, **kwargs)) for name, model in self.models]
+        return StageRouter(self.router, self.stage, models, self.config)
+
+    # -----------------------------------------ROUTING------------------------------------------------
+
+    def _candidates(self):
+        """The providers in order of preference, skipping the ones whose circuit is open (and whether
+        the request is the probe of a half-open circuit)."""
+        for name, model in self.models:
+            allowed = self.router.breakers[name].acquire()
+            if allowed is not None:
+                yield name, model, allowed == "probe"
+            else:
+                self.router._count(self.stage, "circuit_skips")
+
+    def _hedge_delay(self, name: str, kind: str) -> Optional[float]:
+        if not self.config["hedge"] or len(self.models) < 2:
+            return None
+        if self.config["hedge_after"] is not None:
+            return self.config["hedge_after"]
+        return self.router.window(self.stage, name, kind).quantile(self.config["hedge_quantile"], self.config["min_samples"])
+
+    def _timeout(self, started: float, next_hedge: Optional[float]) -> Optional[float]:
+        """Seconds until the next hedge or the end of the budget (None: wait for a response)."""
+        limits = [limit for limit in (next_hedge, started + self.config["budget"] if self.config["budget"] else None)
+                  if limit is not None]
+        return max(0.0, min(limits) - time.perf_counter()) if limits else None
+
+    def _over_budget(self, started: float) -> bool:
+        return bool(self.config["budget"]) and time.perf_counter() - started >= self.config["budget"]
+
+    def _budget_error(self) -> TimeoutError:
+        self.router._count(self.stage, "timeouts")
+        return TimeoutError(f"Stage {self.stage} got no response within its {self.config['budget']}s budget")
+
+    def _release_probe(self, name: str, task: asyncio.Future):
+        # A probe cancelled before its outcome (lost hedge, over budget, caller cancelled) records
+        # neither success nor failure: give the probe back, or the circuit would never close again
+        breaker = self.router.breakers[name]
+        task.add_done_callback(lambda task: task.cancelled() and breaker.abandon())
+
+    def _won(self, name: str, launched: List[str]):
+        self.router._count(self.stage, f"wins:{name}")
+        tracer.current().set(provider=name, providers_tried=launched)
+
+    def _call(self, name: str, model, input, config, kwargs):
+        started = time.perf_counter()
+        try:
+            result = model.invoke(input, config, **kwargs)
+        except Exception:
+            self.router._failed(self.stage, name)
+            raise
+        self.router._succeeded(self.stage, name, "call", time.perf_counter() - started)
+        return result
+
+    def invoke(self, input, config=None, **kwargs):
+        started = time.perf_counter()
+        candidates = self._candidates()
+        pending = {}
+        launched = []
+        last_error = None
+
+        def _launch(reason: str) -> Optional[float]:
+            """Start the next provider; returns the time of the next hedge."""
+            name, model, _ = next(candidates, (None, None, False))
+            if name is None:
+                return None
+            self.router._count(self.stage, reason)
+            launched.append(name)
+            context = contextvars.copy_context()
+            pending[self.router.pool.submit(context.run, self._call, name, model, input, config, kwargs)] = name
+            delay = self._hedge_delay(name, "call")
+            return time.perf_counter() + delay if delay is not None else None
+
+        next_hedge = _launch("calls")
+        if not pending:
+            raise ProviderUnavailableError(f"Every provider of stage {self.stage} has an open circuit")
+
+        while pending:
+            done, _ = wait(list(pending), timeout=self._timeout(started, next_hedge), return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                if future.exception() is None:
+                    self._won(name, launched)
+                    return future.result()
+                last_error = future.exception()
+                next_hedge = _launch("fallbacks") or next_hedge
+
+            if self._over_budget(started):
+                raise self._budget_error()
+            if next_hedge is not None and time.perf_counter() >= next_hedge:
+                next_hedge = _launch("hedges")
+
+        raise last_error
+
+    async def _acall(self, name: str, model, input, config, kwargs):
+        started = time.perf_counter()
+        try:
+            result = await model.ainvoke(input, config, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.router._failed(self.stage, name)
+            raise
+        self.router._succeeded(self.stage, name, "call", time.perf_counter() - started)
+        return result
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        started = time.perf_counter()
+        candidates = self._candidates()
+        pending = {}
+        launched = []
+        last_error = None
+
+        def _launch(reason: str) -> Optional[float]:
+            name, model, probe = next(candidates, (None, None, False))
+            if name is None:
+                return None
+            self.router._count(self.stage, reason)
+            launched.append(name)
+            task = asyncio.ensure_future(self._acall(name, model, input, config, kwargs))
+            if probe:
+                self._release_probe(name, task)
+            pending[task] = name
+            delay = self._hedge_delay(name, "call")
+            return time.perf_counter() + delay if delay is not None else None
+
+        next_hedge = _launch("calls")
+        if not pending:
+            raise ProviderUnavailableError(f"Every provider of stage {self.stage} has an open circuit")
+
+        try:
+            while pending:
+                done, _ = await asyncio.wait(list(pending), timeout=self._timeout(started, next_hedge),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        self._won(name, launched)
+                        return task.result()
+                    last_error = task.exception()
+                    next_hedge = _launch("fallbacks") or next_hedge
+
+                if self._over_budget(started):
+                    raise self._budget_error()
+                if next_hedge is not None and time.perf_counter() >= next_hedge:
+                    next_hedge = _launch("hedges")
+        finally:
+            # First response wins: the other requests are cancelled
+            for task in pending:
+                task.cancel()
+
+        raise last_error
+
+    async def astream(self, input, config=None, **kwargs) -> AsyncIterator:
+        """
+        Stream from the provider whose first chunk arrives first (the hedge delay and the budget
+        apply to the first chunk). An error after the first chunk is raised, not retried.
+        """
+        started = time.perf_counter()
+        candidates = self._candidates()
+        pending = {}
+        launched = []
+        last_error = None
+
+        def _launch(reason: str) -> Optional[float]:
+            name, model, probe = next(candidates, (None, None, False))
+            if name is None:
+                return None
+            self.router._count(self.stage, reason)
+            launched.append(name)
+            stream = model.astream(input, config, **kwargs).__aiter__()
+            task = asyncio.ensure_future(stream.__anext__())
+            if probe:
+                self._release_probe(name, task)
+            pending[task] = (name, stream)
+            delay = self._hedge_delay(name, "first_chunk")
+            return time.perf_counter() + delay if delay is not None else None
+
+        next_hedge = _launch("calls")
+        if not pending:
+            raise ProviderUnavailableError(f"Every provider of stage {self.stage} has an open circuit")
+
+        winner = None
+        try:
+            while pending and winner is None:
+                done, _ = await asyncio.wait(list(pending), timeout=self._timeout(started, next_hedge),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name, stream = pending.pop(task)
+                    error = task.exception()
+                    if error is None or isinstance(error, StopAsyncIteration):
+                        self.router._succeeded(self.stage, name, "first_chunk", time.perf_counter() - started)
+                        winner = (name, stream, task)
+                        break
+                    self.router._failed(self.stage, name)
+                    last_error = error
+                    next_hedge = _launch("fallbacks") or next_hedge
+
+                if winner is None and self._over_budget(started):
+                    raise self._budget_error()
+                if winner is None and next_hedge is not None and time.perf_counter() >= next_hedge:
+                    next_hedge = _launch("hedges")
+        finally:
+            for task, (_, stream) in pending.items():
+                task.cancel()
+                try:
+                    await stream.aclose()
+                except Exception:
+                    pass
+
+        if winner is None:
+            raise last_error
+        name, stream, task = winner
+        self._won(name, launched)
+        if isinstance(task.exception(), StopAsyncIteration):
+            return
+        yield task.result()
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            self.router._failed(self.stage, name)
+            raise
+
+
+class ModelRouter:
+    def __init__(self, providers: Dict[str, Any], stages: Dict[str, dict], failure_threshold: int = 5,
+                 reset_after: float = 30.0, window: int = 200, max_workers: int = 64):
+        """
+        Routes the model calls of every pipeline stage over several providers, with per-stage
+        latency budgets, hedged requests after a latency quantile, fast fallback on errors and
+        a circuit breaker per provider (shared by all stages).
+
+        Args:
+            providers (Dict[str, BaseChatModel]): Name -> chat model.
+            stages (Dict[str, dict]): Stage name (lvl1, seed, columns, filter, query) -> settings
+                (see DEFAULT_STAGE_CONFIG); a "default" entry applies to the stages not listed.
+            failure_threshold (int): Consecutive failures that open the circuit of a provider.
+            reset_after (float): Seconds before an open circuit lets a probe request through.
+            window (int): Successful calls per provider and stage kept to estimate the hedge delay.
+            max_workers (int): Threads of the sync calls (hedged requests included).
+        """
+        self.providers = providers
+        self.stages = stages
+        self.window_size = window
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_after) for name in providers}
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-router")
+        self._windows: Dict[Tuple[str, str, str], LatencyWindow] = {}
+        self._counters: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+        for stage, config in stages.items():
+            unknown = [name for name in config.get("providers", []) if name not in providers]
+            if unknown:
+                raise ValueError(f"Stage {stage} uses unknown providers: {', '.join(unknown)}")
+
+    def stage_config(self, stage: str) -> dict:
+        config = {**DEFAULT_STAGE_CONFIG, **self.stages.get("default", {}), **self.stages.get(stage, {})}
+        if not config["providers"]:
+            raise ValueError(f"No providers configured for stage {stage} (and no default)")
+        return config
+
+    def stage(self, stage: str) -> StageRouter:
+        """The routed model of a stage."""
+        config = self.stage_config(stage)
+        return StageRouter(self, stage, [(name, self.providers[name]) for name in config["providers"]], config)
+
+    def window(self, stage: str, provider: str, kind: str) -> LatencyWindow:
+        key = (stage, provider, kind)
+        with self._lock:
+            if key not in self._windows:
+                self._windows[key] = LatencyWindow(self.window_size)
+            return self._windows[key]
+
+    def _count(self, stage: str, counter: str):
+        with self._lock:
+            self._counters[stage][counter] += 1
+
+    def _succeeded(self, stage: str, provider: str, kind: str, seconds: float):
+        self.breakers[provider].record(True)
+        self.window(stage, provider, kind).add(seconds)
+
+    def _failed(self, stage: str, provider: str):
+        self.breakers[provider].record(False)
+        self._count(stage, f"failures:{provider}")
+
+    def stats(self) -> dict:
+        """Per stage: calls, hedges, fallbacks, timeouts, circuit skips, wins and failures per provider;
+        and the circuit state of every provider."""
+        with self._lock:
+            stages = {stage: dict(counters) for stage, counters in self._counters.items()}
+        return {
+            "stages": stages,
+            "circuits": {name: {"state": breaker.state, "trips": breaker.trips} for name, breaker in self.breakers.items()},
+        }
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def from_config(cls, config_path: str, responder=None) -> "ModelRouter":
+        """
+        Build a router from a JSON file:
+
+            {"providers": {"openai-mini": {"type": "openai", "model": "gpt-4o-mini", "temperature": 0},
+                           "groq-llama": {"type": "groq", "model": "llama-3.3-70b-versatile"}},
+             "stages": {"default": {"providers": ["openai-mini", "groq-llama"], "budget": 20},
+                        "query": {"providers": ["groq-llama", "openai-mini"], "hedge_after": 8}},
+             "breaker": {"failure_threshold": 5, "reset_after": 30}}
+
+        A provider of type "fake" is a local model with injected latency and failures (see
+        benchmark/fakes.py), answering with `responder` (or an empty structured output).
+        """
+        with open(config_path, "r", encoding="utf-8") as file:
+            config = json.load(file)
+        providers = {name: create_provider(spec, responder) for name, spec in config["providers"].items()}
+        return cls(providers, config["stages"], **config.get("breaker", {}))
+
+
+def create_provider(spec: dict, responder=None):
+    """The chat model of a provider entry of the router config (the client libraries are imported on use)."""
+    spec = dict(spec)
+    kind = spec.pop("type")
+    if kind == "openai":
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(**spec)
+    if kind == "groq":
+        from langchain_groq import ChatGroq
+        return ChatGroq(**spec)
+    if kind == "fake":
+        from benchmark.fakes import FakeChatModel, empty_responder
+        return FakeChatModel(responder=responder or empty_responder, **spec)
+    raise ValueError(f"Unknown provider type: {kind} (expected openai, groq or fake)")
@@ -97,7 +97,7 @@ COLUMNS INITIALLY FOUND RELEVANT
 """
 
 query_generation_prompt = """
-You are a professional SQL Analyst, working on a MySQL database named **bike_store**.
+You are a professional SQL Analyst, working on a MySQL database named **{database}**.
 **IT IS VERY IMPORTANT THAT YOU ONLY USE FUNCTIONS USED IN MYSQL DATABASES.**
 
 You are provided with:
@@ -130,3 +130,11 @@ Your task is to:
 ---
 
 """
+
+query_repair_prompt = """
+The query you wrote was checked against the database schema and has these errors:
+{errors}
+
+Fix **only these errors** and keep everything else of the query as it is. Use only the tables, columns and relationships provided above, and only MySQL functions.
+Return the whole corrected query in a ```sql block.
+"""
@@ -0,0 +1,421 @@
+import json
+import sys
+import threading
+import types
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from model import Knowledge_Graph
+from utilities.answer_cache import SemanticAnswerCache
+from utilities.generate_embeddings.generate_db import get_vector_store, registry as vector_store_registry, vector_backend
+from utilities.generate_embeddings.lexical_index import DEFAULT_THRESHOLD as LEXICAL_THRESHOLD, load_router
+from utilities.generate_embeddings.numpy_index import NumpyVectorIndex, NumpyVectorStore
+from utilities.sql_executor import SQLExecutor, load_db_config
+from utilities.tracing import tracer
+
+# Objects the footprint walk never enters: shared by the whole process, or code
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+           types.CodeType, threading.Thread)
+
+_MISSING = object()
+
+# The bundle of the question being answered (see SchemaRegistry.use)
+_current_bundle: ContextVar[Optional["SchemaBundle"]] = ContextVar("schema_bundle", default=None)
+
+
+class UnknownSchemaError(KeyError):
+    """A question asked for a database the registry has no bundle for."""
+
+    def __str__(self):
+        # KeyError would quote the message
+        return str(self.args[0]) if self.args else ""
+
+
+def measure_bytes(objects: Iterable[Any]) -> List[int]:
+    """
+    Deep size in bytes of each object: the object, its containers and attributes, and the data
+    of its numpy arrays (memory-mapped ones included, a search touches every page). An object
+    reachable from an earlier one of the list is only counted for the earlier one.
+    """
+    seen = set()
+    sizes = []
+    for root in objects:
+        total = 0
+        stack = [root]
+        while stack:
+            current = stack.pop()
+            if id(current) in seen or isinstance(current, _OPAQUE):
+                continue
+            seen.add(id(current))
+
+            if isinstance(current, np.ndarray):
+                total += current.nbytes if current.flags.owndata or isinstance(current, np.memmap) else sys.getsizeof(current)
+                continue
+            total += sys.getsizeof(current)
+
+            if isinstance(current, dict):
+                stack.extend(current.keys())
+                stack.extend(current.values())
+            elif isinstance(current, (list, tuple, set, frozenset, deque)):
+                stack.extend(current)
+            elif not isinstance(current, (str, bytes, int, float)):
+                attributes = getattr(current, "__dict__", None)
+                if isinstance(attributes, dict):
+                    stack.append(attributes)
+                for slot in getattr(type(current), "__slots__", ()):
+                    if isinstance(slot, str) and hasattr(current, slot):
+                        stack.append(getattr(current, slot))
+        sizes.append(total)
+    return sizes
+
+
+def _chroma_bytes(store) -> int:
+    """Estimated resident size of a Chroma collection: its vectors, held in memory by the HNSW index."""
+    try:
+        count = store._collection.count()
+        embeddings = store._collection.peek(1)["embeddings"]
+        return count * len(embeddings[0]) * 4 if count and len(embeddings) else 0
+    except Exception as e:
+        print(f"[ERROR] Could not size the collection {getattr(store, '_collection', store)}\n{e}")
+        return 0
+
+
+class SchemaBundle:
+    def __init__(self, name: str, kg_file_path: str = "knowledge_graph.gml", overview_db_path: str = "db/overview_db",
+                 table_db_path: str = "db/table_db", table_docs_dir: str = "docs/table_docs",
+                 numpy_index_dir: Optional[str] = None, db: Any = None, lexical_index: Optional[str] = None,
+                 lexical_threshold: float = LEXICAL_THRESHOLD, answer_cache_path: Optional[str] = None, cache_threshold: float = 0.92,
+                 validate: bool = False, execute: bool = False, db_overrides: Optional[dict] = None,
+                 components: Optional[Dict[str, Any]] = None):
+        """
+        Everything the pipeline knows about one database: its knowledge graph, overview and table
+        indexes, column catalog (through the validator), connection settings, and optionally its
+        lexical index and answer cache. Nothing is loaded before a question needs it. The size of
+        every loaded component is measured, so the registry can evict whole bundles by footprint.
+
+        Args:
+            name (str): Name of the database, as asked for by the requests and given to the query prompt.
+            kg_file_path (str): Knowledge graph of the schema (.gml, .graphml, .gpickle or .kgb).
+            overview_db_path (str): Chroma persist directory of the overview collection.
+            table_db_path (str): Chroma persist directory of the table collections.
+            table_docs_dir (str): Table docs the column catalog of the validator is read from.
+            numpy_index_dir (str, optional): NumPy index of this database (see numpy_index.py), searched
+                instead of Chroma. Without it the process-wide backend of get_vector_store is used.
+            db (dict or str, optional): Connection settings (any DEFAULT_DB_CONFIG key), or a JSON file of them.
+                The database defaults to the bundle's name.
+            lexical_index (str, optional): Lexical index enabling the fast path for this database.
+            lexical_threshold (float): Confidence the lexical fast path needs.
+            answer_cache_path (str, optional): sqlite file of this database's semantic answer cache.
+            cache_threshold (float): Cosine similarity needed to reuse a cached answer.
+            validate (bool): Build a validator from the knowledge graph and the table docs.
+            execute (bool): Build a pooled executor from the connection settings.
+            db_overrides (dict, optional): Execution settings of every bundle (pool_size, max_rows...),
+                below the bundle's own settings.
+            components (dict, optional): Already built components ("table_KG", "executor", "validator",
+                "lexical_router", "answer_cache"). They belong to the caller: used as they are, never unloaded.
+        """
+        self.name = name
+        self.kg_file_path = kg_file_path
+        self.overview_db_path = overview_db_path
+        self.table_db_path = table_db_path
+        self.table_docs_dir = table_docs_dir
+        self.numpy_index_dir = numpy_index_dir
+        self.db = db
+        self.lexical_index = lexical_index
+        self.lexical_threshold = lexical_threshold
+        self.answer_cache_path = answer_cache_path
+        self.cache_threshold = cache_threshold
+        self.validate = validate
+        self.execute = execute
+        self.db_overrides = db_overrides or {}
+        self.registry: Optional["SchemaRegistry"] = None
+        self.leases = 0
+
+        self._given = dict(components or {})
+        self._loaded: Dict[str, Any] = {}
+        self._sizes: Dict[str, int] = {}
+        self._collections: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    # -----------------------------------------LOADING-----------------------------------------------
+
+    def _component(self, name: str, loader: Callable[[], Any]) -> Any:
+        """A component, loaded on first use and measured. Loaders must not load other components."""
+        if name in self._given:
+            return self._given[name]
+        component = self._loaded.get(name, _MISSING)
+        if component is not _MISSING:
+            return component
+        with self._lock:
+            if name in self._loaded:
+                return self._loaded[name]
+            with tracer.span("schema_load", database=self.name, component=name):
+                component = loader()
+            self._loaded[name] = component
+            self._measure()
+        # Outside the lock: the registry may unload other bundles
+        if self.registry is not None:
+            self.registry._loaded(self)
+        return component
+
+    def _measure(self):
+        names = list(self._loaded)
+        self._sizes = dict(zip(names, measure_bytes(self._loaded[name] for name in names)))
+
+    def _load_graph(self) -> Knowledge_Graph:
+        table_KG = Knowledge_Graph.load_graph(self.kg_file_path)
+        if table_KG is None:
+            raise ValueError(f"Could not load the knowledge graph of {self.name} from {self.kg_file_path}")
+        return table_KG
+
+    def db_config(self) -> Dict[str, Any]:
+        """
+        Connection settings: the bundle's own, then db_overrides, then the environment and the
+        defaults. The database is the bundle's name unless its own settings name another one.
+        """
+        settings = self.db or {}
+        if isinstance(settings, str):
+            with open(settings, "r", encoding="utf-8") as file:
+                settings = json.load(file)
+        return load_db_config(**{**self.db_overrides, "database": self.name, **settings})
+
+    # ----------------------------------------COMPONENTS---------------------------------------------
+
+    @property
+    def table_KG(self) -> Knowledge_Graph:
+        return self._component("table_KG", self._load_graph)
+
+    @property
+    def validator(self):
+        """Checks the SQL against the knowledge graph and the column catalog (None unless validate)."""
+        if "validator" in self._given or not self.validate:
+            return self._given.get("validator")
+        graph = self.table_KG.graph
+
+        def _load():
+            from utilities.sql_validator import SQLValidator  # sqlglot is only imported with validation
+            return SQLValidator.from_files(graph, self.table_docs_dir)
+        return self._component("validator", _load)
+
+    @property
+    def executor(self) -> Optional[SQLExecutor]:
+        """Runs the SQL on this database (None unless execute)."""
+        if "executor" in self._given or not self.execute:
+            return self._given.get("executor")
+        return self._component("executor", lambda: SQLExecutor.from_config(self.db_config()))
+
+    @property
+    def lexical_router(self):
+        if "lexical_router" in self._given or not self.lexical_index:
+            return self._given.get("lexical_router")
+        return self._component("lexical_router", lambda: load_router(self.lexical_index, threshold=self.lexical_threshold))
+
+    @property
+    def answer_cache(self) -> Optional[SemanticAnswerCache]:
+        if "answer_cache" in self._given or not self.answer_cache_path:
+            return self._given.get("answer_cache")
+        return self._component("answer_cache", lambda: SemanticAnswerCache(
+            self.answer_cache_path, threshold=self.cache_threshold, watch_paths=(self.kg_file_path, self.table_docs_dir)))
+
+    @property
+    def overview_store(self):
+        return self.store("overview")
+
+    def store(self, name: str):
+        """The vector store of a collection ("overview", a table, or the single tables collection)."""
+        if self.numpy_index_dir:
+            return self._component("numpy_index", lambda: NumpyVectorIndex(self.numpy_index_dir)).store(name)
+
+        if vector_backend() == "numpy" and self.registry is not None and len(self.registry.bundles) > 1:
+            # The process-wide numpy index holds the collections of a single database
+            raise ValueError(f"Database {self.name} has no numpy_index_dir: with several databases, the numpy "
+                             f"backend needs an index per database")
+        vector_store = get_vector_store(name, self._db_path(name))
+        # The process-wide numpy index is shared by every bundle, so it is not theirs to account for
+        if name not in self._collections and not isinstance(vector_store, NumpyVectorStore):
+            size = _chroma_bytes(vector_store)
+            with self._lock:
+                opened = name not in self._collections
+                if opened:
+                    self._collections[name] = size
+                    # Held until unload: bundles sharing a db path must not close each other's handles
+                    vector_store_registry.retain(name, self._db_path(name))
+            if opened and self.registry is not None:
+                self.registry._loaded(self)
+        return vector_store
+
+    def _db_path(self, name: str) -> str:
+        return self.overview_db_path if name == "overview" else self.table_db_path
+
+    # -----------------------------------------FOOTPRINT---------------------------------------------
+
+    @property
+    def resident(self) -> bool:
+        return bool(self._loaded or self._collections)
+
+    def memory_bytes(self) -> int:
+        """Measured size of the loaded components and estimated size of the opened Chroma collections."""
+        with self._lock:
+            return sum(self._sizes.values()) + sum(self._collections.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": sum(self._sizes.values()) + sum(self._collections.values()),
+                "components": dict(self._sizes),
+                "collections": len(self._collections),
+                "leases": self.leases,
+            }
+
+    def unload(self):
+        """Drop every loaded component (closing the executor and answer cache, releasing the Chroma handles); they load again on next use."""
+        with self._lock:
+            loaded, self._loaded, self._sizes = self._loaded, {}, {}
+            collections, self._collections = self._collections, {}
+
+        for name in ("executor", "answer_cache"):
+            if name in loaded:
+                loaded[name].close()
+        for name in collections:
+            vector_store_registry.release(name, self._db_path(name))
+
+
+class SchemaRegistry:
+    def __init__(self, bundles: Iterable[SchemaBundle], default: Optional[str] = None,
+                 max_memory_mb: Optional[float] = None):
+        """
+        The schema bundles one process can answer on, selected per question. A bundle loads its
+        components on first use; once the measured footprint of the loaded bundles exceeds the
+        budget, the least recently used bundles no question is using are unloaded.
+
+        Args:
+            bundles (Iterable[SchemaBundle]): The databases.
+            default (str, optional): Database of the questions that do not name one (default: the first bundle).
+            max_memory_mb (float, optional): Memory budget of the loaded bundles. None never unloads.
+        """
+        self.bundles: Dict[str, SchemaBundle] = {}
+        for bundle in bundles:
+            bundle.registry = self
+            self.bundles[bundle.name] = bundle
+        if not self.bundles:
+            raise ValueError("A schema registry needs at least one bundle")
+        self.default = default or next(iter(self.bundles))
+        if self.default not in self.bundles:
+            raise ValueError(f"Unknown default database: {self.default}")
+        self.max_bytes = int(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._resident: "OrderedDict[str, SchemaBundle]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path: str, **bundle_options) -> "SchemaRegistry":
+        """
+        A registry from a JSON file:
+            {"default": "bike_store", "max_memory_mb": 512,
+             "databases": {"bike_store": {"kg_file_path": "knowledge_graph.gml", "db": {"database": "bike_store"}, ...}}}
+        Every database takes the SchemaBundle arguments; bundle_options (validate, execute,
+        db_overrides) apply to all of them. Every database must name its own knowledge graph, table
+        docs and indexes (numpy_index_dir, or overview_db_path and table_db_path): the defaults of
+        SchemaBundle are the files of the bike_store database.
+        """
+        with open(config_path, "r", encoding="utf-8") as file:
+            config = json.load(file)
+        for name, spec in config["databases"].items():
+            required = ["kg_file_path", "table_docs_dir"]
+            if not spec.get("numpy_index_dir"):
+                required += ["overview_db_path", "table_db_path"]
+            missing = [key for key in required if not spec.get(key)]
+            if missing:
+                raise ValueError(f"Database {name} of {config_path} does not set {', '.join(missing)}")
+        bundles = [SchemaBundle(name, **{**bundle_options, **spec}) for name, spec in config["databases"].items()]
+        return cls(bundles, default=config.get("default"), max_memory_mb=config.get("max_memory_mb"))
+
+    def names(self) -> List[str]:
+        return list(self.bundles)
+
+    def get(self, name: Optional[str] = None) -> SchemaBundle:
+        """The bundle of a database (the default one if name is None). Nothing is loaded."""
+        bundle = self.bundles.get(name or self.default)
+        if bundle is None:
+            raise UnknownSchemaError(f"Unknown database: {name} (expected one of {', '.join(self.bundles)})")
+        return bundle
+
+    def current(self) -> SchemaBundle:
+        """The bundle of the question being answered, else the default one."""
+        bundle = _current_bundle.get()
+        if bundle is not None and bundle.registry is self:
+            return bundle
+        return self.get()
+
+    @contextmanager
+    def use(self, name: Optional[str] = None):
+        """Answer on a database: its bundle is current (see current()) and is not unloaded until the block ends."""
+        bundle = self.get(name)
+        with self._lock:
+            bundle.leases += 1
+            if bundle.name in self._resident:
+                self.hits += 1
+                self._resident.move_to_end(bundle.name)
+
+        token = _current_bundle.set(bundle)
+        try:
+            yield bundle
+        finally:
+            try:
+                _current_bundle.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. an async generator closed by its caller)
+                _current_bundle.set(None)
+            with self._lock:
+                bundle.leases -= 1
+                self._enforce()
+
+    def _loaded(self, bundle: SchemaBundle):
+        # A component of the bundle was loaded: it is the most recently used, and may push others out
+        with self._lock:
+            if bundle.name not in self._resident:
+                self.loads += 1
+            self._resident[bundle.name] = bundle
+            self._resident.move_to_end(bundle.name)
+            self._enforce()
+
+    def _enforce(self):
+        # Called with the lock held. A bundle in use is never unloaded, even above the budget
+        if self.max_bytes is None:
+            return
+        while sum(bundle.memory_bytes() for bundle in self._resident.values()) > self.max_bytes:
+            victim = next((bundle for bundle in self._resident.values() if bundle.leases == 0), None)
+            if victim is None:
+                return
+            del self._resident[victim.name]
+            self.evictions += 1
+            victim.unload()
+
+    def stats(self) -> dict:
+        """Loads, hits and evictions, and the measured footprint of every loaded bundle."""
+        with self._lock:
+            bundles = {name: bundle.stats() for name, bundle in self._resident.items()}
+            return {
+                "databases": len(self.bundles),
+                "resident": list(bundles),
+                "resident_bytes": sum(stats["bytes"] for stats in bundles.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "bundles": bundles,
+            }
+
+    def close(self):
+        """Unload every bundle."""
+        with self._lock:
+            resident, self._resident = list(self._resident.values()), OrderedDict()
+            for bundle in resident:
+                bundle.unload()
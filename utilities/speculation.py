@@ -0,0 +1,208 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Sequence
+
+from utilities.tracing import Span, tracer
+
+
+def _span_tokens(span) -> tuple:
+    """(prompt, completion) tokens of a span and all its children (0 while tracing is off)."""
+    if not isinstance(span, Span):
+        return 0, 0
+    prompt_tokens = completion_tokens = 0
+    stack = [span]
+    while stack:
+        current = stack.pop()
+        prompt_tokens += current.prompt_tokens
+        completion_tokens += current.completion_tokens
+        with current._lock:
+            stack.extend(current.children)
+    return prompt_tokens, completion_tokens
+
+
+class SpeculativeTask:
+    def __init__(self, key: str, after: Sequence["SpeculativeTask"]):
+        """One unit of work of a plan: its future, the tasks it depends on and its timings."""
+        self.key = key
+        self.after = list(after)
+        self.future = Future()
+        self.started = None
+        self.finished = None
+        self.claimed = False
+        self.discarded = False
+        self.counted = False
+        self.span = None
+
+
+class SpeculationPlan:
+    def __init__(self, scheduler: "SpeculativeScheduler"):
+        """
+        The speculative work of one question: a small dependency graph of tasks keyed by name
+        (e.g. "retrieval:orders", "columns:orders"). A task starts once the tasks it depends on
+        are done and receives their results after its own arguments. Later stages claim the
+        results they need; close() discards everything that was never claimed.
+        """
+        self.scheduler = scheduler
+        self.tasks: Dict[str, SpeculativeTask] = {}
+        self._context = contextvars.copy_context()
+
+    def has(self, key: str) -> bool:
+        return key in self.tasks
+
+    def start(self, key: str, fn: Callable, *args, after: Sequence[str] = ()) -> SpeculativeTask:
+        """Start fn(*args, *results of `after`) as soon as its dependencies are done (once per key)."""
+        if key in self.tasks:
+            return self.tasks[key]
+        task = SpeculativeTask(key, [self.tasks[dependency] for dependency in after])
+        self.tasks[key] = task
+        self.scheduler._started()
+
+        # Run in the context of the question, so the spans of the task join its trace
+        context = self._context.copy()
+        pending = [len(task.after)]
+        lock = threading.Lock()
+
+        def _submit():
+            self.scheduler._pool.submit(context.run, self._run, task, fn, args)
+
+        def _dependency_done(_):
+            with lock:
+                pending[0] -= 1
+                ready = pending[0] == 0
+            if ready:
+                _submit()
+
+        if not task.after:
+            _submit()
+        for dependency in task.after:
+            dependency.future.add_done_callback(_dependency_done)
+        return task
+
+    def _run(self, task: SpeculativeTask, fn: Callable, args: tuple):
+        if not task.future.set_running_or_notify_cancel():
+            return  # Discarded while it was queued
+        task.started = time.perf_counter()
+        try:
+            results = [dependency.future.result() for dependency in task.after]
+            with tracer.span("speculative", key=task.key) as span:
+                task.span = span
+                result = fn(*args, *results)
+        except BaseException as e:
+            task.finished = time.perf_counter()
+            task.future.set_exception(e)
+        else:
+            task.finished = time.perf_counter()
+            task.future.set_result(result)
+        if task.discarded:
+            self.scheduler._wasted(task)
+
+    def claim(self, key: str) -> Any:
+        """The result of a task a later stage needs (waits for it if it is still running)."""
+        task = self.tasks[key]
+        asked = time.perf_counter()
+        result = task.future.result()
+        self._use(task, asked)
+        return result
+
+    def _use(self, task: SpeculativeTask, asked: float):
+        # The dependencies of a claimed task were used through it
+        if task.claimed:
+            return
+        task.claimed = True
+        self.scheduler._used(task, asked)
+        for dependency in task.after:
+            self._use(dependency, asked)
+
+    def discard(self, key: str):
+        """Drop a task the later stages ruled out: cancelled if it has not started, else its result is ignored."""
+        task = self.tasks.get(key)
+        if task is None or task.claimed or task.discarded:
+            return
+        task.discarded = True
+        if task.future.cancel():
+            self.scheduler._cancelled()
+        elif task.future.done():
+            self.scheduler._wasted(task)
+        # Still running: counted as wasted when it finishes (see _run)
+
+    def close(self):
+        """Discard every task that was not claimed."""
+        # Dependants first, so they are cancelled before their dependencies finish
+        for key in reversed(list(self.tasks)):
+            self.discard(key)
+
+
+class SpeculativeScheduler:
+    def __init__(self, max_workers: int = 8):
+        """
+        Runs the likely-needed work of later stages while earlier stages are still waiting on the
+        LLM, on a shared thread pool. It keeps the score: tasks used or discarded, the wall time
+        the used tasks ran ahead of the stage that needed them, and the time and tokens spent on
+        discarded ones (tokens are only known while tracing is on, see utilities/tracing.py).
+
+        Args:
+            max_workers (int): Speculative tasks running at once, across all questions.
+        """
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.wasted = 0
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+
+    def plan(self) -> SpeculationPlan:
+        """A new plan for one question (call it from inside the question's trace)."""
+        return SpeculationPlan(self)
+
+    def _started(self):
+        with self._lock:
+            self.started += 1
+
+    def _used(self, task: SpeculativeTask, asked: float):
+        # The part of the task that ran before the stage asked for it is wall time saved
+        saved = 0.0
+        if task.started is not None and task.finished is not None:
+            saved = max(0.0, min(asked, task.finished) - task.started)
+        with self._lock:
+            self.used += 1
+            self.saved_seconds += saved
+
+    def _cancelled(self):
+        with self._lock:
+            self.cancelled += 1
+
+    def _wasted(self, task: SpeculativeTask):
+        prompt_tokens, completion_tokens = _span_tokens(task.span)
+        with self._lock:
+            # discard() and the end of the task can both see a finished, discarded task
+            if task.counted:
+                return
+            task.counted = True
+            self.wasted += 1
+            self.wasted_seconds += (task.finished or time.perf_counter()) - (task.started or time.perf_counter())
+            self.wasted_prompt_tokens += prompt_tokens
+            self.wasted_completion_tokens += completion_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "used": self.used,
+                "cancelled": self.cancelled,
+                "wasted": self.wasted,
+                "use_rate": self.used / self.started if self.started else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "wasted_seconds": self.wasted_seconds,
+                "wasted_prompt_tokens": self.wasted_prompt_tokens,
+                "wasted_completion_tokens": self.wasted_completion_tokens,
+            }
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,495 @@
+import contextvars
+import datetime
+import decimal
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    from utilities.tracing import tracer
+except ImportError:  # Imported flat by the scripts of utilities/
+    from tracing import tracer
+
+# Connection settings, lowest priority first: DEFAULT_DB_CONFIG, the JSON config file, the environment
+DEFAULT_DB_CONFIG = {
+    "backend": "mysql",
+    "host": "localhost",
+    "port": 3306,
+    "user": "root",
+    "password": "",
+    "database": "bike_store",
+    "path": "db/bike_store.sqlite",
+    "pool_size": 4,
+    "statement_timeout": 30.0,
+    "max_rows": 1000,
+}
+
+DB_ENV_VARS = {
+    "backend": "DB_BACKEND",
+    "host": "DB_HOST",
+    "port": "DB_PORT",
+    "user": "DB_USER",
+    "password": "DB_PASSWORD",
+    "database": "DB_NAME",
+    "path": "DB_PATH",
+    "pool_size": "DB_POOL_SIZE",
+    "statement_timeout": "DB_STATEMENT_TIMEOUT",
+    "max_rows": "DB_MAX_ROWS",
+}
+
+# Statements the executor accepts. A write can still start inside them: the statement an EXPLAIN runs,
+# a data-modifying CTE body or the statement after a WITH list. Only there are the keywords checked,
+# so a column or alias named like a keyword ("set", "load") does not trip it
+READ_ONLY_STATEMENTS = ("SELECT", "WITH", "SHOW", "DESCRIBE", "DESC", "EXPLAIN")
+WRITE_STATEMENTS = (
+    "INSERT|UPDATE|DELETE|REPLACE|MERGE|UPSERT|DROP|ALTER|CREATE|TRUNCATE|RENAME|GRANT|REVOKE|"
+    "ATTACH|DETACH|PRAGMA|VACUUM|CALL|LOAD|HANDLER|LOCK|UNLOCK|SET"
+)
+WRITE_KEYWORDS = re.compile(
+    r"^(?:EXPLAIN|DESCRIBE|DESC)\b(?:\s+(?:ANALYZE|EXTENDED|PARTITIONS|VERBOSE|FORMAT\s*=\s*\w+))*"
+    rf"\s+({WRITE_STATEMENTS})\b"
+    r"|[()]\s*(INSERT|UPDATE|DELETE|REPLACE|MERGE(?=\s+INTO\b))\b(?!\s*\()",
+    re.IGNORECASE,
+)
+# SELECT ... INTO OUTFILE / DUMPFILE / @variable / new_table. INTO is reserved, so it is always the clause
+SELECT_INTO = re.compile(r"\bINTO\s+(OUTFILE|DUMPFILE|@|\w)", re.IGNORECASE)
+
+
+def load_db_config(config_path: Optional[str] = None, **overrides) -> Dict[str, Any]:
+    """
+    Connection and execution settings of the target database.
+
+    Args:
+        config_path (str, optional): JSON file with any of the DEFAULT_DB_CONFIG keys.
+        **overrides: Settings taking precedence over the file and the environment (None is ignored).
+
+    Returns:
+        Dict[str, Any]: DEFAULT_DB_CONFIG, updated by the file, then by the DB_* environment
+        variables (DB_BACKEND, DB_HOST, DB_PASSWORD, ...), then by the overrides.
+    """
+    config = dict(DEFAULT_DB_CONFIG)
+    if config_path:
+        with open(config_path, "r", encoding="utf-8") as file:
+            config.update(json.load(file))
+
+    for key, env_var in DB_ENV_VARS.items():
+        if os.getenv(env_var) is not None:
+            config[key] = os.getenv(env_var)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    config["port"] = int(config["port"])
+    config["pool_size"] = int(config["pool_size"])
+    config["max_rows"] = int(config["max_rows"])
+    config["statement_timeout"] = float(config["statement_timeout"]) if config["statement_timeout"] else None
+    return config
+
+
+class ReadOnlyViolation(ValueError):
+    """Raised for a statement that could write to (or lock) the database."""
+
+
+def check_read_only(sql: str) -> str:
+    """
+    Return the statement without its trailing ';' if it is a single read-only statement.
+    Strings, quoted identifiers and comments are blanked out before the keywords are checked,
+    so a column value such as 'DROP' does not trip it.
+    """
+    code = re.sub(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`", "''", sql)
+    code = re.sub(r"--[^\n]*|#[^\n]*|/\*.*?\*/", " ", code, flags=re.DOTALL).strip().rstrip(";").strip()
+    if not code:
+        raise ReadOnlyViolation("Empty statement")
+    if ";" in code:
+        raise ReadOnlyViolation("Only a single statement can be executed")
+
+    first = code.split(None, 1)[0].upper()
+    if first not in READ_ONLY_STATEMENTS:
+        raise ReadOnlyViolation(f"{first} statements are not allowed, only {', '.join(READ_ONLY_STATEMENTS)}")
+    if re.search(r"\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", code, re.IGNORECASE):
+        raise ReadOnlyViolation("Locking reads are not allowed")
+    write = WRITE_KEYWORDS.search(code)
+    if write:
+        raise ReadOnlyViolation(f"{(write.group(1) or write.group(2)).upper()} is not allowed in a read-only query")
+    if SELECT_INTO.search(code):
+        raise ReadOnlyViolation("SELECT ... INTO is not allowed in a read-only query")
+    return sql.strip().rstrip(";").strip()
+
+
+def _jsonable(value: Any) -> Any:
+    # Rows end up in JSON (batch output, answer cache), so driver types are converted
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
+
+
+# -----------------------------------------------ADAPTERS---------------------------------------------------
+
+class SQLiteAdapter:
+    name = "sqlite"
+    # Closing the cursor of a partly read result is enough to stop the query
+    discard_partial = False
+
+    def __init__(self, path: str):
+        """
+        SQLite database, opened read-only (mode=ro and PRAGMA query_only). The statement timeout is
+        enforced with a progress handler that interrupts the query once its deadline has passed.
+        """
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"SQLite database not found: {path}")
+        self.path = path
+
+    def connect(self):
+        # The pool hands a connection to one thread at a time, so it may move between threads
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def ping(self, conn) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @contextmanager
+    def limits(self, conn, settings: dict, timeout: Optional[float], max_rows: Optional[int]):
+        if timeout:
+            deadline = time.perf_counter() + timeout
+            conn.set_progress_handler(lambda: int(time.perf_counter() > deadline), 1000)
+        try:
+            yield
+        finally:
+            if timeout:
+                conn.set_progress_handler(None, 0)
+
+    def is_timeout(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.OperationalError) and "interrupted" in str(error)
+
+
+class MySQLAdapter:
+    name = "mysql"
+    # The rest of a partly read (unbuffered) result would be drained on the next command, so the
+    # connection is closed instead
+    discard_partial = True
+
+    def __init__(self, host: str, port: int, user: str, password: str, database: str):
+        """
+        MySQL database through mysql-connector. Every session is read-only (SET SESSION TRANSACTION
+        READ ONLY), the statement timeout is MAX_EXECUTION_TIME and the row cap sql_select_limit, so
+        the server stops the work instead of the client discarding it.
+        """
+        import mysql.connector  # Only needed with the MySQL backend
+        self._connector = mysql.connector
+        self.settings = {"host": host, "port": port, "user": user, "password": password, "database": database}
+
+    def connect(self):
+        conn = self._connector.connect(**self.settings, autocommit=True, consume_results=True)
+        cursor = conn.cursor()
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        cursor.close()
+        return conn
+
+    def ping(self, conn) -> bool:
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except self._connector.Error:
+            return False
+
+    @contextmanager
+    def limits(self, conn, settings: dict, timeout: Optional[float], max_rows: Optional[int]):
+        # The session variables are only sent again when they change for this connection
+        wanted = (int(timeout * 1000) if timeout else 0, max_rows + 1 if max_rows is not None else "DEFAULT")
+        if settings.get("limits") != wanted:
+            cursor = conn.cursor()
+            cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {wanted[0]}")
+            cursor.execute(f"SET SESSION sql_select_limit = {wanted[1]}")
+            cursor.close()
+            settings["limits"] = wanted
+        yield
+
+    def is_timeout(self, error: Exception) -> bool:
+        # ER_QUERY_TIMEOUT: "Query execution was interrupted, maximum statement execution time exceeded"
+        return getattr(error, "errno", None) == 3024
+
+
+def create_adapter(config: Dict[str, Any]):
+    """The adapter of config["backend"] ("mysql" or "sqlite")."""
+    if config["backend"] == "sqlite":
+        return SQLiteAdapter(config["path"])
+    if config["backend"] == "mysql":
+        return MySQLAdapter(config["host"], config["port"], config["user"], config["password"], config["database"])
+    raise ValueError(f"Unknown database backend: {config['backend']} (expected 'mysql' or 'sqlite')")
+
+
+# -----------------------------------------------POOL-------------------------------------------------------
+
+class _PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.settings = {}  # Session settings already applied to this connection
+        self.last_used = time.monotonic()
+        self.uses = 0
+        self.discard = False  # Set when the connection must not be reused (e.g. a result left unread)
+
+
+class ConnectionPool:
+    def __init__(self, adapter, size: int = 4, acquire_timeout: Optional[float] = None, ping_after: float = 30.0):
+        """
+        At most `size` open connections, created on first use and then reused, so the connection
+        setup is paid once per connection instead of once per query.
+
+        Args:
+            adapter: SQLiteAdapter or MySQLAdapter.
+            size (int): Maximum number of open connections (= queries running at the same time).
+            acquire_timeout (float, optional): Seconds to wait for a free connection. None waits forever.
+            ping_after (float): Idle seconds after which a connection is checked before being reused.
+        """
+        self.adapter = adapter
+        self.size = max(1, size)
+        self.acquire_timeout = acquire_timeout
+        self.ping_after = ping_after
+        self._idle = queue.LifoQueue()  # Most recently used first, so the spare connections can time out
+        self._lock = threading.Lock()
+        self._opened = 0
+        self.created = 0
+        self.reused = 0
+
+    def _open(self) -> Optional[_PooledConnection]:
+        with self._lock:
+            if self._opened >= self.size:
+                return None
+            self._opened += 1
+        try:
+            pooled = _PooledConnection(self.adapter.connect())
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+        with self._lock:
+            self.created += 1
+        return pooled
+
+    def _discard(self, pooled: _PooledConnection):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _get(self) -> _PooledConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        pooled = self._open()
+        if pooled is not None:
+            return pooled
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection free after {self.acquire_timeout}s (pool size {self.size})")
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection; it is discarded instead of returned if it no longer answers after an error."""
+        pooled = self._get()
+        if time.monotonic() - pooled.last_used > self.ping_after and not self.adapter.ping(pooled.conn):
+            self._discard(pooled)
+            pooled = self._open() or self._get()
+        if pooled.uses:
+            with self._lock:
+                self.reused += 1
+        pooled.uses += 1
+        healthy = True
+        try:
+            yield pooled
+        except Exception:
+            healthy = self.adapter.ping(pooled.conn)
+            raise
+        finally:
+            pooled.last_used = time.monotonic()
+            if healthy and not pooled.discard:
+                self._idle.put(pooled)
+            else:
+                self._discard(pooled)
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+# -----------------------------------------------EXECUTOR---------------------------------------------------
+
+class SQLExecutor:
+    def __init__(self, adapter, pool_size: int = 4, statement_timeout: Optional[float] = 30.0, max_rows: int = 1000,
+                 acquire_timeout: Optional[float] = None):
+        """
+        Runs the generated SQL on the target database through a connection pool.
+
+        Args:
+            adapter: SQLiteAdapter or MySQLAdapter (see create_adapter).
+            pool_size (int): Maximum number of open connections, i.e. of queries running at once.
+            statement_timeout (float, optional): Seconds a query may run before it is interrupted.
+            max_rows (int): Rows returned per query; the result is marked truncated beyond it.
+            acquire_timeout (float, optional): Seconds to wait for a free connection.
+        """
+        self.adapter = adapter
+        self.pool = ConnectionPool(adapter, size=pool_size, acquire_timeout=acquire_timeout)
+        self.statement_timeout = statement_timeout
+        self.max_rows = max_rows
+        self.executed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SQLExecutor":
+        """An executor for the settings of load_db_config."""
+        return cls(create_adapter(config), pool_size=config["pool_size"],
+                   statement_timeout=config["statement_timeout"], max_rows=config["max_rows"])
+
+    def execute(self, sql: str, timeout: Optional[float] = None, max_rows: Optional[int] = None) -> dict:
+        """
+        Execute a single read-only statement.
+
+        Returns:
+            dict: {"sql", "columns", "rows", "row_count", "truncated", "seconds", "error"}. A rejected,
+            timed out or failed statement is reported in "error" instead of raising.
+        """
+        timeout = timeout if timeout is not None else self.statement_timeout
+        max_rows = max_rows if max_rows is not None else self.max_rows
+        result = {"sql": sql, "columns": [], "rows": [], "row_count": 0, "truncated": False, "seconds": 0.0, "error": None}
+        started = time.perf_counter()
+
+        with tracer.span("execute", backend=self.adapter.name) as span:
+            try:
+                statement = check_read_only(sql)
+                with self.pool.connection() as pooled:
+                    with self.adapter.limits(pooled.conn, pooled.settings, timeout, max_rows):
+                        cursor = pooled.conn.cursor()
+                        try:
+                            cursor.execute(statement)
+                            rows = cursor.fetchmany(max_rows + 1) if cursor.description else []
+                            result["columns"] = [column[0] for column in cursor.description or []]
+                        finally:
+                            cursor.close()
+                result["truncated"] = len(rows) > max_rows
+                result["rows"] = [[_jsonable(value) for value in row] for row in rows[:max_rows]]
+                result["row_count"] = len(result["rows"])
+            except ReadOnlyViolation as e:
+                result["error"] = f"Rejected: {e}"
+            except Exception as e:
+                result["error"] = f"Timed out after {timeout}s" if self.adapter.is_timeout(e) else f"{type(e).__name__}: {e}"
+            result["seconds"] = time.perf_counter() - started
+            span.set(rows=result["row_count"], truncated=result["truncated"], error=result["error"])
+
+        with self._lock:
+            self.executed += 1
+            self.failed += result["error"] is not None
+        return result
+
+    def execute_all(self, statements: List[str]) -> List[dict]:
+        """Execute the statements of one answer in order."""
+        return [self.execute(statement) for statement in statements]
+
+    def execute_many(self, batches: List[List[str]], max_concurrency: Optional[int] = None) -> List[List[dict]]:
+        """
+        Execute the statements of many answers concurrently (one answer per worker, at most the
+        pool size at once), keeping the order of the batches.
+        """
+        workers = min(max_concurrency or self.pool.size, self.pool.size)
+        # Each worker runs in a copy of the caller's context, so its spans join the caller's trace
+        contexts = [contextvars.copy_context() for _ in batches]
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(lambda context, batch: context.run(self.execute_all, batch), contexts, batches))
+
+    def stream(self, sql: str, batch_rows: int = 65536, timeout: Optional[float] = None, schema=None) -> Iterator:
+        """
+        Stream the whole result of a read-only statement as Arrow record batches of at most
+        batch_rows rows (no row cap), so memory stays bounded whatever the size of the result.
+        The rows are read with fetchmany from an unbuffered (server-side) cursor, and a pooled
+        connection is held until the generator is exhausted or closed. Needs pyarrow.
+
+        Args:
+            sql (str): The statement.
+            batch_rows (int): Rows per record batch.
+            timeout (float, optional): Seconds allowed for the whole read. Defaults to the statement
+                timeout; 0 disables it.
+            schema (pyarrow.Schema, optional): Schema of the batches, inferred from the first batch if omitted.
+
+        Raises:
+            ReadOnlyViolation: If the statement is not a single read-only statement.
+            TimeoutError: If the read takes longer than the timeout.
+        """
+        from utilities.arrow_stream import RecordBatchBuilder  # Only needed for streaming
+
+        statement = check_read_only(sql)
+        timeout = timeout if timeout is not None else self.statement_timeout
+        with tracer.span("stream", backend=self.adapter.name) as span:
+            rows = batches = 0
+            with self.pool.connection() as pooled:
+                with self.adapter.limits(pooled.conn, pooled.settings, timeout, None):
+                    cursor = pooled.conn.cursor()
+                    finished = False
+                    try:
+                        cursor.execute(statement)
+                        builder = RecordBatchBuilder([column[0] for column in cursor.description or []], schema)
+                        while True:
+                            chunk = cursor.fetchmany(batch_rows)
+                            if not chunk:
+                                break
+                            rows += len(chunk)
+                            batches += 1
+                            yield builder.build(chunk)
+                        if not batches:
+                            yield builder.empty()
+                        finished = True
+                    except Exception as e:
+                        if self.adapter.is_timeout(e):
+                            raise TimeoutError(f"Streaming timed out after {timeout}s ({rows} rows read)") from e
+                        raise
+                    finally:
+                        pooled.discard = not finished and self.adapter.discard_partial
+                        span.set(rows=rows, batches=batches, complete=finished)
+                        try:
+                            cursor.close()
+                        except Exception:
+                            pooled.discard = True
+
+    def export(self, sql: str, path: str, batch_rows: int = 65536, timeout: Optional[float] = None) -> dict:
+        """
+        Stream the result of a statement into a Parquet (.parquet) or Arrow IPC (.arrow, .feather,
+        .ipc) file, one record batch at a time.
+
+        Returns:
+            dict: {"path", "rows", "batches", "bytes", "seconds"}.
+        """
+        from utilities.arrow_stream import write_batches
+
+        started = time.perf_counter()
+        summary = write_batches(self.stream(sql, batch_rows=batch_rows, timeout=timeout), path)
+        summary["seconds"] = time.perf_counter() - started
+        return summary
+
+    def stats(self) -> dict:
+        return {"executed": self.executed, "failed": self.failed,
+                "connections_created": self.pool.created, "connections_reused": self.pool.reused}
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,145 @@
+import re
+from typing import List
+
+SQL_START = re.compile(r"\b(SELECT|WITH)\b", re.IGNORECASE)
+COMMENTS = re.compile(r"--[^\n]*|#[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+
+
+class SQLStreamExtractor:
+    def __init__(self):
+        """
+        Pulls the SQL statements out of the query model's output while it is being streamed.
+
+        The reasoning between <think> and </think> is skipped. The statements are read from the
+        first ```sql fenced block (or any ``` block), and each one is returned as soon as its
+        terminating ';' (outside quotes, escapes included, and -- # /* */ comments) or the closing
+        fence arrives. If the model writes no fenced block, finish() falls back to the text starting
+        at the first SELECT / WITH, split the same way.
+        """
+        self.buffer = ""
+        self.statements: List[str] = []
+        self._block_start = None  # Offset in buffer of the fenced block content
+        self._scan = 0            # Next offset of the block to scan
+        self._statement_start = 0
+        self._quote = None
+        self._closed = False
+
+    def _body_offset(self) -> int:
+        # Text after the reasoning; -1 while the model is still thinking
+        if "<think>" in self.buffer:
+            end = self.buffer.find("</think>")
+            return -1 if end == -1 else end + len("</think>")
+        return 0
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text, and return the statements completed by it."""
+        self.buffer += text
+        if self._closed:
+            return []
+
+        if self._block_start is None:
+            body = self._body_offset()
+            if body == -1:
+                return []
+            fence = self.buffer.find("```", body)
+            # The line of the opening fence (e.g. '```sql') must be complete
+            newline = self.buffer.find("\n", fence) if fence != -1 else -1
+            if newline == -1:
+                return []
+            self._block_start = self._scan = self._statement_start = newline + 1
+
+        return self._split()
+
+    def _split(self, final: bool = False, fenced: bool = True) -> List[str]:
+        """
+        Scan the block from _scan, and return the statements ended by a ';' outside quotes and
+        comments (or by the closing fence). Unless final, a token that may continue in the next
+        chunk ('-', '/', '*', a backslash escape, the start of a fence) waits for more text.
+        """
+        completed = []
+        buffer = self.buffer
+        while self._scan < len(buffer):
+            index = self._scan
+            char = buffer[index]
+            partial = not final and len(buffer) - index < 3
+
+            # The closing fence: anywhere outside a string or block comment, and at the start of a
+            # line inside one (an unterminated quote must not swallow the rest of the answer)
+            if char == "`" and fenced:
+                if partial:
+                    break
+                at_line_start = index == self._block_start or buffer[index - 1] == "\n"
+                if buffer.startswith("```", index) and (self._quote in (None, "--") or at_line_start):
+                    self._add(buffer[self._statement_start:index], completed)
+                    self._closed = True
+                    break
+
+            if self._quote == "--":
+                if char == "\n":
+                    self._quote = None
+            elif self._quote == "/*":
+                if char == "*" and index + 1 == len(buffer) and not final:
+                    break
+                if buffer.startswith("*/", index):
+                    self._quote = None
+                    self._scan += 1
+            elif self._quote:
+                if char == "\\" and self._quote != "`":
+                    if index + 1 == len(buffer) and not final:
+                        break
+                    self._scan += 1  # Escaped character
+                elif char == self._quote:
+                    self._quote = None  # A doubled quote ('') reopens it at the next character
+            elif char in ("-", "/") and index + 1 == len(buffer) and not final:
+                break
+            elif buffer.startswith("--", index) or char == "#":
+                self._quote = "--"
+            elif buffer.startswith("/*", index):
+                self._quote = "/*"
+                self._scan += 1
+            elif char in ("'", '"', "`"):
+                self._quote = char
+            elif char == ";":
+                self._add(buffer[self._statement_start:index + 1], completed)
+                self._statement_start = index + 1
+            self._scan += 1
+        return completed
+
+    def _add(self, statement: str, completed: List[str]):
+        statement = statement.strip()
+        # A trailing comment is not a statement
+        if COMMENTS.sub("", statement).strip() not in ("", ";"):
+            self.statements.append(statement)
+            completed.append(statement)
+
+    def finish(self) -> List[str]:
+        """Return the statements left once the stream has ended."""
+        completed = []
+        if self._closed:
+            return completed
+
+        if self._block_start is not None:
+            completed = self._split(final=True)
+            if not self._closed:
+                self._add(self.buffer[self._statement_start:], completed)
+            return completed
+
+        # No fenced block: take the SQL written after the reasoning, split on every ';' outside
+        # quotes and comments
+        body = max(self._body_offset(), 0)
+        match = SQL_START.search(self.buffer, body)
+        if match:
+            self._block_start = self._scan = self._statement_start = match.start()
+            completed = self._split(final=True, fenced=False)
+            rest = self.buffer[self._statement_start:].strip()
+            if rest:
+                self._add(rest if rest.endswith(";") else rest + ";", completed)
+        return completed
+
+
+def extract_sql_statements(text: str) -> List[str]:
+    """The SQL statements of a complete model output."""
+    extractor = SQLStreamExtractor()
+    extractor.feed(text)
+    extractor.finish()
+    return extractor.statements
@@ -0,0 +1,267 @@
+import difflib
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import networkx as nx
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+from sqlglot.tokens import TokenType
+
+# Functions of other dialects that models often write for MySQL, with the MySQL equivalent
+NON_MYSQL_FUNCTIONS = {
+    "STRFTIME": "DATE_FORMAT()",
+    "DATE_TRUNC": "DATE_FORMAT() or YEAR() / MONTH()",
+    "DATE_PART": "EXTRACT() or YEAR() / MONTH()",
+    "DATEPART": "EXTRACT() or YEAR() / MONTH()",
+    "DATETRUNC": "DATE_FORMAT() or YEAR() / MONTH()",
+    "TO_CHAR": "DATE_FORMAT() or CAST(... AS CHAR)",
+    "TO_DATE": "STR_TO_DATE()",
+    "TO_TIMESTAMP": "STR_TO_DATE()",
+    "JULIANDAY": "DATEDIFF()",
+    "AGE": "TIMESTAMPDIFF()",
+    "GETDATE": "NOW()",
+    "SYSDATETIME": "NOW()",
+    "DATEADD": "DATE_ADD()",
+    "EOMONTH": "LAST_DAY()",
+    "DATEFROMPARTS": "STR_TO_DATE() or MAKEDATE()",
+    "NVL": "IFNULL()",
+    "IIF": "IF()",
+    "TRY_CAST": "CAST()",
+    "LEN": "CHAR_LENGTH()",
+    "CHARINDEX": "LOCATE()",
+    "SPLIT_PART": "SUBSTRING_INDEX()",
+    "STRING_AGG": "GROUP_CONCAT()",
+    "LISTAGG": "GROUP_CONCAT()",
+    "ARRAY_AGG": "GROUP_CONCAT() or JSON_ARRAYAGG()",
+    "INITCAP": "CONCAT(UPPER(LEFT(...)), LOWER(SUBSTRING(...)))",
+    "MEDIAN": "a window function (ROW_NUMBER / COUNT)",
+    "PERCENTILE_CONT": "a window function (ROW_NUMBER / COUNT)",
+}
+
+
+def load_column_catalog(table_docs_dir: str) -> Dict[str, Dict[str, str]]:
+    """Table -> column -> data type, read from the Columns table of every table doc."""
+    catalog = {}
+    for file_name in sorted(os.listdir(table_docs_dir)):
+        if not file_name.endswith(".md"):
+            continue
+        with open(os.path.join(table_docs_dir, file_name), "r", encoding="utf-8") as file:
+            rows = re.findall(r"^\|\s*`(\w+)`\s*\|\s*`?(\w+)`?\s*\|", file.read(), flags=re.MULTILINE)
+        catalog[os.path.splitext(file_name)[0].lower()] = {column.lower(): data_type for column, data_type in rows}
+    return catalog
+
+
+class SQLValidator:
+    def __init__(self, graph: nx.DiGraph, catalog: Dict[str, Dict[str, str]]):
+        """
+        Checks generated SQL locally, before it reaches the database: MySQL syntax, functions and
+        clauses of other dialects, every table and column against the column catalog, and every
+        join between two tables against the foreign keys of the knowledge graph. The errors are
+        short sentences meant to be given back to the query model.
+
+        Args:
+            graph (nx.DiGraph): The schema knowledge graph (edges FK table -> PK table with 'on_column').
+            catalog (Dict[str, Dict[str, str]]): Table -> column -> data type (see load_column_catalog).
+        """
+        self.graph = graph
+        self.catalog = catalog
+        self.undirected = graph.to_undirected(as_view=True)
+
+        # Columns taking part in a foreign key; joining them off the graph is a wrong join key
+        self.keys: Dict[str, Set[str]] = {table: set() for table in catalog}
+        for source, target, data in graph.edges(data=True):
+            column = data.get("on_column")
+            if column:
+                self.keys.setdefault(source, set()).add(column)
+                self.keys.setdefault(target, set()).add(column)
+
+    @classmethod
+    def from_files(cls, graph: nx.DiGraph, table_docs_dir: str = "docs/table_docs") -> "SQLValidator":
+        return cls(graph, load_column_catalog(table_docs_dir))
+
+    def validate(self, sql: str) -> List[str]:
+        """The errors of a statement (MySQL dialect); an empty list when it is valid."""
+        try:
+            errors = self._check_dialect(sql)
+        except TokenError as e:
+            return [f"Syntax error: {e}"]
+        try:
+            tree = sqlglot.parse_one(sql, read="mysql")
+        except ParseError as e:
+            error = e.errors[0] if e.errors else {}
+            description = str(error.get("description", e)).split(" but got <Token")[0]
+            return errors + [f"Syntax error: {description} near '{error.get('highlight', '')}' "
+                             f"(line {error.get('line')}, column {error.get('col')})"]
+        if tree is None:
+            return ["Syntax error: empty statement"]
+
+        resolved = {}
+        for scope in traverse_scope(tree):
+            errors.extend(self._check_scope(scope, resolved))
+        errors.extend(self._check_joins(tree, resolved))
+        return list(dict.fromkeys(errors))
+
+    def validate_all(self, statements: List[str]) -> List[str]:
+        """The errors of every statement of an answer (no statement at all is an error too)."""
+        if not statements:
+            return ["No SQL statement found in the answer: write the query in a ```sql block"]
+        errors = []
+        for statement in statements:
+            errors.extend(self.validate(statement))
+        return errors
+
+    # ------------------------------------------DIALECT------------------------------------------
+
+    def _check_dialect(self, sql: str) -> List[str]:
+        # Read from the tokens, before sqlglot rewrites them into MySQL equivalents
+        tokens = [token for token in sqlglot.tokenize(sql, read="mysql") if token.token_type != TokenType.STRING]
+        errors = []
+        for i, token in enumerate(tokens):
+            text = token.text.upper()
+            following = tokens[i + 1].text.upper() if i + 1 < len(tokens) else ""
+            previous = tokens[i - 1].text.upper() if i else ""
+            if following == "(" and text in NON_MYSQL_FUNCTIONS:
+                errors.append(f"{text}() is not a MySQL function: use {NON_MYSQL_FUNCTIONS[text]}")
+            elif text == "ILIKE":
+                errors.append("ILIKE is not MySQL: use LIKE (case-insensitive with the default collation)")
+            elif text == "::":
+                errors.append("'::' casts are not MySQL: use CAST(... AS ...)")
+            elif text == "||":
+                errors.append("'||' is a logical OR in MySQL: use CONCAT() to join strings")
+            elif text == "FULL" and following in ("JOIN", "OUTER"):
+                errors.append("MySQL has no FULL OUTER JOIN: use a LEFT JOIN UNION a RIGHT JOIN")
+            elif text == "NULLS" and following in ("FIRST", "LAST"):
+                errors.append("NULLS FIRST / LAST is not MySQL: order by (column IS NULL) first")
+            elif text == "TOP" and previous in ("SELECT", "DISTINCT"):
+                errors.append("SELECT TOP is not MySQL: use LIMIT")
+            elif text == "FETCH" and following in ("FIRST", "NEXT"):
+                errors.append("FETCH FIRST is not MySQL: use LIMIT")
+            elif text == "QUALIFY":
+                errors.append("QUALIFY is not MySQL: filter the window function in an outer query")
+        return errors
+
+    # ------------------------------------------TABLES AND COLUMNS------------------------------------------
+
+    @staticmethod
+    def _derived_columns(scope: Scope) -> Optional[Set[str]]:
+        # Output columns of a subquery / CTE, None when it selects a star
+        select = scope.expression
+        if not isinstance(select, exp.Select) or any(
+                isinstance(projection, exp.Star) or isinstance(projection, exp.Column) and isinstance(projection.this, exp.Star)
+                for projection in select.expressions):
+            return None
+        return {name.lower() for name in select.named_selects}
+
+    def _source_columns(self, source) -> Optional[Set[str]]:
+        if isinstance(source, exp.Table):
+            columns = self.catalog.get(source.name.lower())
+            return set(columns) if columns is not None else None
+        if isinstance(source, Scope):
+            return self._derived_columns(source)
+        return None
+
+    def _lookup(self, scope: Scope, qualifier: str):
+        # The source an alias refers to, in this scope or an enclosing one (correlated subqueries)
+        while scope is not None:
+            for alias, source in scope.sources.items():
+                if alias.lower() == qualifier:
+                    return source
+            scope = scope.parent
+        return None
+
+    def _suggest(self, column: str, tables: List[str]) -> str:
+        candidates = [f"{table}.{name}" for table in tables for name in self.catalog.get(table, {})]
+        close = difflib.get_close_matches(column, [candidate.split(".")[1] for candidate in candidates], n=1, cutoff=0.6)
+        if close:
+            match = next(candidate for candidate in candidates if candidate.endswith("." + close[0]))
+            return f" (did you mean {match}?)"
+        owners = [table for table, columns in self.catalog.items() if column in columns and table not in tables]
+        if owners:
+            return f" (it is a column of {', '.join(owners)}, which the query does not join)"
+        return ""
+
+    def _check_scope(self, scope: Scope, resolved: Dict[int, Tuple[str, str]]) -> List[str]:
+        errors = []
+        for alias, source in scope.sources.items():
+            if isinstance(source, exp.Table) and source.name.lower() not in self.catalog:
+                errors.append(f"Unknown table {source.name}: the tables are {', '.join(sorted(self.catalog))}")
+
+        tables = [source.name.lower() for source in scope.sources.values()
+                  if isinstance(source, exp.Table) and source.name.lower() in self.catalog]
+        select_aliases = {projection.alias.lower() for projection in getattr(scope.expression, "expressions", [])
+                          if isinstance(projection, exp.Alias)}
+
+        for column in scope.columns:
+            if isinstance(column.this, exp.Star):
+                continue
+            name = column.name.lower()
+
+            if column.table:
+                source = self._lookup(scope, column.table.lower())
+                if source is None:
+                    errors.append(f"Unknown table or alias {column.table} in {column.sql('mysql')}")
+                    continue
+                columns = self._source_columns(source)
+                if columns is not None and name not in columns:
+                    owner = source.name.lower() if isinstance(source, exp.Table) else column.table
+                    errors.append(f"Unknown column {column.sql('mysql')}: {owner} has no column {name}"
+                                  + self._suggest(name, tables))
+                elif isinstance(source, exp.Table):
+                    resolved[id(column)] = (source.name.lower(), name)
+                continue
+
+            owners = [source for source in scope.sources.values()
+                      if (self._source_columns(source) or set()) and name in self._source_columns(source)]
+            unknown_sources = any(self._source_columns(source) is None for source in scope.sources.values())
+            if len(owners) > 1 and all(isinstance(owner, exp.Table) for owner in owners):
+                errors.append(f"Column {name} is ambiguous (in {', '.join(owner.name for owner in owners)}): qualify it")
+            elif len(owners) == 1:
+                if isinstance(owners[0], exp.Table):
+                    resolved[id(column)] = (owners[0].name.lower(), name)
+            elif name not in select_aliases and not unknown_sources and not self._in_outer_scope(scope, name):
+                errors.append(f"Unknown column {name}: no table of the query has it" + self._suggest(name, tables))
+        return errors
+
+    def _in_outer_scope(self, scope: Scope, name: str) -> bool:
+        scope = scope.parent
+        while scope is not None:
+            if any(name in (self._source_columns(source) or set()) for source in scope.sources.values()):
+                return True
+            scope = scope.parent
+        return False
+
+    # ------------------------------------------JOINS------------------------------------------
+
+    def _check_joins(self, tree: exp.Expression, resolved: Dict[int, Tuple[str, str]]) -> List[str]:
+        errors = []
+        for condition in tree.find_all(exp.EQ):
+            left, right = condition.this, condition.expression
+            if id(left) not in resolved or id(right) not in resolved:
+                continue
+            (table1, column1), (table2, column2) = resolved[id(left)], resolved[id(right)]
+            if table1 == table2:
+                continue  # Self joins on attributes (e.g. two orders of a customer) are not FK joins
+
+            error = self._join_error(table1, column1, table2, column2)
+            if error:
+                errors.append(f"Wrong join condition {condition.sql('mysql')}: {error}")
+        return errors
+
+    def _join_error(self, table1: str, column1: str, table2: str, column2: str) -> Optional[str]:
+        for source, target in ((table1, table2), (table2, table1)):
+            if self.graph.has_edge(source, target):
+                key = self.graph.edges[source, target].get("on_column")
+                if key and not column1 == column2 == key:
+                    return f"{source} joins {target} on {source}.{key} = {target}.{key}"
+                return None
+
+        if column1 not in self.keys.get(table1, set()) and column2 not in self.keys.get(table2, set()):
+            return None  # A join on plain attributes (e.g. the state of a customer and of a store)
+        try:
+            path = nx.shortest_path(self.undirected, table1, table2)
+            return f"{table1} and {table2} have no foreign key between them; join them through {' -> '.join(path)}"
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            return f"{table1} and {table2} are not related in the knowledge graph"
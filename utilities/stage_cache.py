@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Optional, Type
+
+from pydantic import BaseModel
+
+
+class StageCache:
+    def __init__(self, db_path: str, max_entries: int = 50000):
+        """
+        Disk-backed memoization of the structured LLM stages of the pipeline.
+        A result is keyed by the model, its temperature, the hash of the rendered prompt and
+        the output schema, and stored as the parsed Pydantic object. Least recently used
+        entries are evicted above max_entries.
+
+        Args:
+            db_path (str): Path of the sqlite file holding the cache.
+            max_entries (int): Maximum number of stored stage results.
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS stage_results (
+                   key TEXT PRIMARY KEY,
+                   stage TEXT NOT NULL,
+                   result TEXT NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_stage_last_used ON stage_results (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, temperature: Optional[float], rendered_prompt: str, schema: Type[BaseModel],
+                 namespace: str = "") -> str:
+        """Cache key of a stage invocation (namespace: the database, as the same prompt may mean another schema)."""
+        prompt_hash = hashlib.sha256(rendered_prompt.encode("utf-8")).hexdigest()
+        schema_spec = json.dumps(schema.model_json_schema(), sort_keys=True)
+        parts = [model, temperature, prompt_hash, schema.__name__, schema_spec]
+        if namespace:
+            parts.append(namespace)
+        payload = json.dumps(parts)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, key: str, schema: Type[BaseModel]) -> Optional[BaseModel]:
+        """Return the cached result of a stage, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM stage_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[stage] += 1
+                return None
+
+            self.hits[stage] += 1
+            self._conn.execute("UPDATE stage_results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return schema.model_validate_json(row[0])
+
+    def put(self, stage: str, key: str, result: BaseModel):
+        """Store the result of a stage."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stage_results (key, stage, result, last_used) VALUES (?, ?, ?, ?)",
+                (key, stage, result.model_dump_json(), time.time()),
+            )
+            self._conn.execute(
+                """DELETE FROM stage_results WHERE key IN (
+                       SELECT key FROM stage_results ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                   )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hits, misses and hit rate of every stage."""
+        with self._lock:
+            stats = {}
+            for stage in sorted(set(self.hits) | set(self.misses)):
+                total = self.hits[stage] + self.misses[stage]
+                stats[stage] = {
+                    "hits": self.hits[stage],
+                    "misses": self.misses[stage],
+                    "hit_rate": self.hits[stage] / total if total else 0.0,
+                }
+            return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
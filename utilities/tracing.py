@@ -0,0 +1,374 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per million (prompt, completion) tokens, used to estimate the cost of every span
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "qwen-qwq-32b": (0.29, 0.39),
+}
+
+
+def model_price(model: str) -> Optional[Tuple[float, float]]:
+    """
+    The (prompt, completion) USD prices per million tokens of a model: the MODEL_PRICES entry of
+    its name, or of the longest entry its name starts with (providers report dated snapshots such
+    as gpt-4o-mini-2024-07-18). A provider prefix (openai/...) is ignored.
+    """
+    name = model.lower().rsplit("/", 1)[-1]
+    if name in MODEL_PRICES:
+        return MODEL_PRICES[name]
+    prefixes = [key for key in MODEL_PRICES if name.startswith(key + "-")]
+    return MODEL_PRICES[max(prefixes, key=len)] if prefixes else None
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attrs):
+        """
+        One timed stage of the pipeline. Besides its wall time it accumulates the prompt and
+        completion tokens, model name, retries and cache hits of the LLM calls made inside it.
+        """
+        self.name = name
+        self.parent = parent
+        self.attrs = dict(attrs)
+        self.children: List["Span"] = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.models = set()
+        self.error = None
+        self.started = time.perf_counter()
+        self.start_time = time.time()
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def cache(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def llm_usage(self, model: Optional[str], prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if model:
+                self.models.add(model)
+
+    def retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def cost(self) -> float:
+        """Estimated USD cost of the LLM calls of the span (the first priced model is used)."""
+        for model in sorted(self.models):
+            price = model_price(model)
+            if price is not None:
+                prompt_price, completion_price = price
+                return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start": self.start_time,
+            "seconds": self.duration,
+            "model": ", ".join(sorted(self.models)) or None,
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 8),
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "error": self.error,
+            **self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class SpanCallback(BaseCallbackHandler):
+    def __init__(self, span: Span):
+        """LangChain callback adding the model, token usage and retries of every LLM call to a span."""
+        self.span = span
+        self._failed = False
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._started()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._started()
+
+    def _started(self):
+        # A call started after a failed one is a retry (with_retry, fallbacks)
+        if self._failed:
+            self._failed = False
+            self.span.retry()
+
+    def on_retry(self, retry_state, *, run_id, parent_run_id=None, **kwargs):
+        self.span.retry()
+
+    def on_llm_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        self._failed = True
+
+    def on_llm_end(self, response, *, run_id, parent_run_id=None, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        model = None
+
+        llm_output = response.llm_output or {}
+        usage = llm_output.get("token_usage") or llm_output.get("usage") or {}
+        model = llm_output.get("model_name") or llm_output.get("model")
+        prompt_tokens = usage.get("prompt_tokens", 0) or 0
+        completion_tokens = usage.get("completion_tokens", 0) or 0
+
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    metadata = getattr(message, "usage_metadata", None) or {}
+                    prompt_tokens += metadata.get("input_tokens", 0)
+                    completion_tokens += metadata.get("output_tokens", 0)
+                    response_metadata = getattr(message, "response_metadata", None) or {}
+                    model = model or response_metadata.get("model_name") or response_metadata.get("model")
+
+        self.span.llm_usage(model, prompt_tokens, completion_tokens)
+
+
+class _NoopSpan:
+    """Span returned while tracing is off: every call is a no-op."""
+
+    def set(self, **attrs):
+        pass
+
+    def cache(self, hit: bool):
+        pass
+
+    def llm_usage(self, model, prompt_tokens, completion_tokens):
+        pass
+
+    def retry(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self):
+        """
+        Spans around the stages of the pipeline, off by default (see configure). Every question
+        is one trace: its span tree is written as JSON to trace_dir, and the spans feed latency
+        histograms and token, cost, retry and cache counters exposed in the Prometheus text format.
+        """
+        self.enabled = False
+        self.trace_dir = None
+        self.metrics_path = None
+        self._current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self._counters: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._listeners: List[Callable[[Span], None]] = []
+
+    def configure(self, enabled: bool = True, trace_dir: Optional[str] = "db/traces", metrics_path: Optional[str] = "db/metrics.prom"):
+        """
+        Args:
+            enabled (bool): Record spans.
+            trace_dir (str, optional): Directory of the per-question JSON traces (not written if None).
+            metrics_path (str, optional): Prometheus text file rewritten after every trace (not written if None).
+        """
+        self.enabled = enabled
+        self.trace_dir = trace_dir
+        self.metrics_path = metrics_path
+        if enabled and trace_dir:
+            os.makedirs(trace_dir, exist_ok=True)
+
+    def current(self):
+        return self._current.get() or NOOP_SPAN
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time a stage; nested in the current span if there is one."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        parent = self._current.get()
+        span = Span(name, parent, **attrs)
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(span)
+        token = self._current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.started
+            try:
+                self._current.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. an async generator closed by its caller)
+                self._current.set(parent)
+            self._observe(span)
+
+    @contextmanager
+    def trace(self, question: str, **attrs):
+        """Root span of a question (or a batch); its JSON trace and the metrics are written when it ends."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        root = None
+        try:
+            with self.span("question", question=question, trace_id=uuid.uuid4().hex, **attrs) as root:
+                yield root
+        finally:
+            if root is not None:
+                self._write(root)
+
+    def add_listener(self, listener: Callable[[Span], None]):
+        """Call listener with the root span of every finished trace (e.g. to collect raw timings)."""
+        self._listeners.append(listener)
+
+    def callbacks(self, span=None) -> list:
+        """LangChain callbacks recording the LLM usage of a call into span (the current span by default)."""
+        span = span or self._current.get()
+        if not self.enabled or span is None:
+            return []
+        return [SpanCallback(span)]
+
+    def config(self, config: Optional[dict] = None) -> Optional[dict]:
+        """A runnable config carrying the callbacks of the current span (None while tracing is off)."""
+        callbacks = self.callbacks()
+        if not callbacks:
+            return config
+        return {**(config or {}), "callbacks": callbacks}
+
+    def _observe(self, span: Span):
+        with self._lock:
+            buckets = self._buckets[span.name]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            counters = self._counters[span.name]
+            counters["count"] += 1
+            counters["seconds"] += span.duration
+            counters["prompt_tokens"] += span.prompt_tokens
+            counters["completion_tokens"] += span.completion_tokens
+            counters["cost_usd"] += span.cost
+            counters["retries"] += span.retries
+            counters["cache_hits"] += span.cache_hits
+            counters["cache_misses"] += span.cache_misses
+            counters["errors"] += span.error is not None
+
+    def _write(self, root: Span):
+        for listener in self._listeners:
+            listener(root)
+        if self.trace_dir:
+            path = os.path.join(self.trace_dir, f"{int(root.start_time)}-{root.attrs['trace_id']}.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(root.to_dict(), file, indent=2, default=str)
+        if self.metrics_path:
+            try:
+                self.write_prometheus(self.metrics_path)
+            except OSError as e:
+                print(f"[ERROR] Could not write the metrics to {self.metrics_path}\n{e}")
+
+    def render_prometheus(self) -> str:
+        """The aggregated metrics of every span name, in the Prometheus text exposition format."""
+        lines = [
+            "# HELP nl2sql_stage_seconds Wall time of the pipeline stages.",
+            "# TYPE nl2sql_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._counters)
+            for stage in stages:
+                for bound, count in zip(LATENCY_BUCKETS, self._buckets[stage]):
+                    lines.append(f'nl2sql_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                counters = self._counters[stage]
+                lines.append(f'nl2sql_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {int(counters["count"])}')
+                lines.append(f'nl2sql_stage_seconds_sum{{stage="{stage}"}} {counters["seconds"]:.6f}')
+                lines.append(f'nl2sql_stage_seconds_count{{stage="{stage}"}} {int(counters["count"])}')
+
+            for metric, key, help_text in (
+                ("nl2sql_stage_prompt_tokens_total", "prompt_tokens", "Prompt tokens sent by the stage."),
+                ("nl2sql_stage_completion_tokens_total", "completion_tokens", "Completion tokens received by the stage."),
+                ("nl2sql_stage_cost_usd_total", "cost_usd", "Estimated cost of the stage in USD."),
+                ("nl2sql_stage_retries_total", "retries", "LLM call retries of the stage."),
+                ("nl2sql_stage_cache_hits_total", "cache_hits", "Cache hits of the stage."),
+                ("nl2sql_stage_cache_misses_total", "cache_misses", "Cache misses of the stage."),
+                ("nl2sql_stage_errors_total", "errors", "Failed runs of the stage."),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for stage in stages:
+                    value = self._counters[stage][key]
+                    lines.append(f'{metric}{{stage="{stage}"}} {value:.8g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first, so a scraper never reads half a file. Its name is unique:
+        # concurrent traces each write their own and the last replace wins
+        fd, temp_path = tempfile.mkstemp(dir=directory or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                file.write(self.render_prometheus())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def serve_prometheus(self, port: int):
+        """Serve the metrics at http://0.0.0.0:<port>/metrics from a daemon thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Shared by the whole process
+tracer = Tracer()